@@ -50,4 +50,62 @@ class DoctorInviteAdmin(admin.ModelAdmin):
 
     def get_status_display(self, obj):
         return  "🔴 Usado" if obj.is_used else "🟢 Disponível"
-    get_status_display.short_description = "Status"
\ No newline at end of file
+    get_status_display.short_description = "Status"
+from .models import BitrixLeadConversion
+
+@admin.register(BitrixLeadConversion)
+class BitrixLeadConversionAdmin(admin.ModelAdmin):
+    list_display = ('lead_id', 'user', 'status', 'contact_id', 'attempts', 'next_check_at', 'resolved_at')
+    list_filter = ('status',)
+    search_fields = ('lead_id', 'contact_id', 'user__email')
+    raw_id_fields = ('user',)
+
+from .models import BitrixOutbox
+
+@admin.register(BitrixOutbox)
+class BitrixOutboxAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'user', 'reference', 'status', 'attempts', 'next_attempt_at', 'processed_at')
+    list_filter = ('status', 'kind')
+    search_fields = ('reference', 'dedupe_key', 'user__email')
+    raw_id_fields = ('user',)
+    readonly_fields = ('created_at', 'processed_at', 'locked_at', 'last_error')
+
+from .models import BitrixWebhookEvent
+
+@admin.register(BitrixWebhookEvent)
+class BitrixWebhookEventAdmin(admin.ModelAdmin):
+    list_display = ('id', 'event', 'entity', 'status', 'received_at', 'processed_at')
+    list_filter = ('status', 'event')
+    search_fields = ('entity',)
+    readonly_fields = ('received_at', 'processed_at', 'error')
+
+from .models import BitrixDeal, BitrixDealRow
+
+class BitrixDealRowInline(admin.TabularInline):
+    model = BitrixDealRow
+    extra = 0
+    readonly_fields = ('product_id', 'product_name', 'price', 'quantity', 'sort')
+
+@admin.register(BitrixDeal)
+class BitrixDealAdmin(admin.ModelAdmin):
+    list_display = ('deal_id', 'contact_id', 'lead_id', 'stage_id', 'closed', 'payment_status', 'synced_at', 'rows_synced_at')
+    list_filter = ('closed', 'stage_id')
+    search_fields = ('=deal_id', 'contact_id', 'lead_id')
+    readonly_fields = ('date_modify', 'synced_at', 'rows_synced_at', 'updated_at')
+    inlines = [BitrixDealRowInline]
+
+from .models import BitrixSyncCursor
+
+@admin.register(BitrixSyncCursor)
+class BitrixSyncCursorAdmin(admin.ModelAdmin):
+    list_display = ('entity', 'high_water', 'run_last_id', 'last_completed_at', 'locked_until')
+    readonly_fields = ('run_since', 'run_last_id', 'run_max_modified', 'run_started_at', 'last_completed_at', 'last_stats', 'updated_at')
+
+from .models import UserProfileSnapshot
+
+@admin.register(UserProfileSnapshot)
+class UserProfileSnapshotAdmin(admin.ModelAdmin):
+    list_display = ('user', 'version', 'reason', 'built_at', 'bitrix_contact_synced_at')
+    search_fields = ('user__email',)
+    raw_id_fields = ('user',)
+    readonly_fields = ('data', 'bitrix_contact', 'bitrix_contact_synced_at', 'version', 'reason', 'built_at')
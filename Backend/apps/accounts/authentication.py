@@ -0,0 +1,100 @@
+"""
+Autenticação JWT sem buscar o usuário no banco a cada request.
+
+O JWTAuthentication do simplejwt faz User.objects.get(pk=...) em todo request autenticado, mesmo
+quando a view só precisa do id (perfil, protocolo) ou dos dados que o token já carrega
+(MyTokenObtainPairSerializer.get_token: email, full_name, role, current_plan). ClaimsJWTAuthentication
+devolve um ClaimsUser montado a partir dessas claims; o User completo só é carregado (uma vez, sob
+demanda) quando a view toca outro campo, grava o usuário ou o usa numa query do ORM.
+
+As claims só valem enquanto o usuário não mudou: o token leva `auth_version` e User.save() incrementa
+a versão quando email/nome/role/plano/is_active/senha mudam (troca de plano, cancelamento, desativação).
+A versão atual fica no cache (auth_version_<id>, L1 de CACHE_L1_TIMEOUT segundos em cada worker); versão
+diferente, token sem a claim ou miss no cache: cai no caminho normal do simplejwt (banco + is_active).
+Uso opt-in nas views de leitura: authentication_classes = [ClaimsJWTAuthentication].
+"""
+
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.functional import LazyObject, empty
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .metrics import inc
+
+CLAIM_ATTRS = ('email', 'full_name', 'role', 'current_plan')
+
+
+def auth_version_key(user_id) -> str:
+    return f"auth_version_{user_id}"
+
+
+def publish_auth_version(user_id, version: int):
+    """Grava a versão atual das claims (chamado por User.save após o commit)."""
+    cache.set(auth_version_key(user_id), version, getattr(settings, 'AUTH_VERSION_CACHE_SECONDS', 3600))
+
+
+class ClaimsUser(LazyObject):
+    """
+    Usuário apoiado nas claims do token. id/pk e CLAIM_ATTRS vêm do token; qualquer outro atributo
+    (e isinstance/ORM/save) carrega o User do banco e passa a delegar para ele.
+    """
+
+    def __init__(self, user_id, claims):
+        self.__dict__['_user_id'] = user_id
+        self.__dict__['_claims'] = claims
+        super().__init__()
+
+    def _setup(self):
+        from .models import User
+        inc('auth_user_total', source='lazy_load')
+        try:
+            self._wrapped = User.objects.get(pk=self.__dict__['_user_id'])
+        except User.DoesNotExist as e:
+            raise AuthenticationFailed("User not found", code="user_not_found") from e
+
+    def __getattr__(self, name):
+        if self._wrapped is empty:
+            if name in ('id', 'pk'):
+                return self.__dict__['_user_id']
+            if name in CLAIM_ATTRS:
+                return self.__dict__['_claims'][name]
+            if name in ('is_authenticated', 'is_active'):
+                return True
+            if name == 'is_anonymous':
+                return False
+        return super().__getattr__(name)
+
+    def __bool__(self):
+        # IsAuthenticated faz bool(request.user): não precisa carregar o User
+        return True
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._wrapped is not empty
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication que só vai ao banco quando as claims do token podem estar desatualizadas."""
+
+    def get_user(self, validated_token):
+        try:
+            user_id = uuid.UUID(str(validated_token[api_settings.USER_ID_CLAIM]))
+        except (KeyError, ValueError) as e:
+            raise InvalidToken("Token contained no recognizable user identification") from e
+
+        version = validated_token.get('auth_version')
+        claims = {name: validated_token.get(name) for name in CLAIM_ATTRS}
+        if version is not None and None not in claims.values() and cache.get(auth_version_key(user_id)) == version:
+            inc('auth_user_total', source='claims')
+            return ClaimsUser(user_id, claims)
+
+        inc('auth_user_total', source='database')
+        user = super().get_user(validated_token)
+        # add: não sobrescreve uma versão mais nova publicada por um save concorrente
+        cache.add(auth_version_key(user.pk), user.auth_version, getattr(settings, 'AUTH_VERSION_CACHE_SECONDS', 3600))
+        return user
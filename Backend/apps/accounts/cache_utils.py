@@ -0,0 +1,66 @@
+"""
+Singleflight (anti-dogpile) para chaves caras do cache.
+
+Quando uma chave como `bitrix_product_catalog` ou `user_protocol_<id>` expira, todas as
+requisições concorrentes recalculavam ao mesmo tempo (e o frontend costuma disparar o perfil
+duas vezes). Com `singleflight`, só quem consegue o lock curto no cache compartilhado
+(`cache.add`, atômico) recalcula; os demais:
+  1. esperam o valor aparecer enquanto o líder trabalha (até SINGLEFLIGHT_WAIT_SECONDS);
+  2. se o líder terminar sem gravar (resultado que não vai para o cache), calculam eles mesmos;
+  3. se o líder demorar além da espera, recebem o valor anterior (`<key>:prev`, ou a cópia
+     indicada em `stale_key`, ex: o `:last_good` do BitrixService) — sem anterior, calculam.
+     O `:prev` tem as mesmas tags da chave (config/cache.py): depois de um invalidate_tag, quem
+     espera não recebe o valor de antes da invalidação.
+
+A função de build continua responsável por gravar a chave (com o TTL e as regras de cada site).
+"""
+
+import time
+import uuid
+import logging
+from typing import Any, Callable, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+
+def singleflight(key: str, build: Callable[[], Any], stale_key: Optional[str] = None) -> Any:
+    """Valor de `key` no cache; no miss, um único `build()` por vez (ver docstring do módulo)."""
+    value = cache.get(key)
+    if value is not None:
+        return value
+
+    lock_key = f"{key}:lock"
+    prev_key = stale_key or f"{key}:prev"
+    token = uuid.uuid4().hex
+    if cache.add(lock_key, token, getattr(settings, 'SINGLEFLIGHT_LOCK_SECONDS', 30)):
+        try:
+            value = build()
+        finally:
+            # Só libera o próprio lock (se expirou, outro líder pode já ter assumido)
+            if cache.get(lock_key) == token:
+                cache.delete(lock_key)
+        if stale_key is None:
+            fresh = cache.get(key)
+            if fresh is not None:
+                cache.set(prev_key, fresh, getattr(settings, 'SINGLEFLIGHT_PREV_SECONDS', 3600))
+        return value
+
+    poll = getattr(settings, 'SINGLEFLIGHT_POLL_SECONDS', 0.05)
+    deadline = time.monotonic() + getattr(settings, 'SINGLEFLIGHT_WAIT_SECONDS', 2.0)
+    while time.monotonic() < deadline:
+        time.sleep(poll)
+        value = cache.get(key)
+        if value is not None:
+            return value
+        if cache.get(lock_key) is None:
+            # Líder terminou sem gravar: resultado não cacheável, cada um calcula o seu
+            return build()
+
+    previous = cache.get(prev_key)
+    if previous is not None:
+        logger.info(f"⏳ Singleflight: '{key}' ainda sendo recalculado, servindo valor anterior.")
+        return previous
+    return build()
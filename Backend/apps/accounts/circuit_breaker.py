@@ -0,0 +1,189 @@
+"""
+Circuit breaker para integrações externas (Bitrix) + marcação de dados "stale".
+
+Com o Bitrix lento/fora, cada miss de cache prendia um worker síncrono por 30s+
+(3 tentativas x timeout de 10s + backoff). O breaker observa as últimas chamadas e,
+passando do limite de erros ou de lentidão, abre: as chamadas seguintes falham na hora
+com CircuitOpenError até o tempo de abertura expirar. Depois disso uma única chamada de
+teste (half-open) decide se fecha de novo ou reabre. Chamada de teste sem desfecho (release_probe,
+ou perdida por mais de probe_timeout_seconds) libera a vaga para outra: o breaker nunca fica preso.
+
+O estado é por processo (cada worker do gunicorn aprende sozinho, em poucas chamadas).
+
+Leituras que caem no fallback "last known good" chamam `mark_stale(origem)`; o
+StaleDataMiddleware devolve essas origens no header X-Data-Stale.
+"""
+
+import time
+import logging
+import threading
+import contextvars
+from collections import deque
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """Breaker aberto: a chamada nem foi feita."""
+
+    def __init__(self, name: str, retry_in: float):
+        self.name = name
+        self.retry_in = retry_in
+        super().__init__(f"Circuit breaker '{name}' aberto (nova tentativa em {retry_in:.0f}s)")
+
+
+class CircuitBreaker:
+
+    def __init__(self, name: str, window: int = 20, min_calls: int = 5, error_threshold: float = 0.5,
+                 slow_call_seconds: float = 5.0, slow_call_threshold: float = 0.5, open_seconds: float = 30.0,
+                 probe_timeout_seconds: float = 60.0):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.error_threshold = error_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_threshold = slow_call_threshold
+        self.open_seconds = open_seconds
+        self.probe_timeout_seconds = probe_timeout_seconds
+
+        self._lock = threading.Lock()
+        self._calls = deque(maxlen=window)  # (ok, slow)
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.trips = 0
+        self.rejected = 0
+        self.last_failure: Optional[str] = None
+        self._probe_in_flight = False
+        self._probe_started_at = 0.0
+
+    def before_call(self):
+        """Lança CircuitOpenError se a chamada não deve sair."""
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            elapsed = time.monotonic() - self.opened_at
+            if self.state == OPEN and elapsed >= self.open_seconds:
+                self.state = HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == HALF_OPEN and self._probe_in_flight and \
+                    time.monotonic() - self._probe_started_at >= self.probe_timeout_seconds:
+                logger.warning(f"⚠️ Circuit breaker '{self.name}': chamada de teste sem resposta, liberando outra.")
+                self._probe_in_flight = False
+            if self.state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True  # Deixa passar uma única chamada de teste
+                self._probe_started_at = time.monotonic()
+                return
+            self.rejected += 1
+            raise CircuitOpenError(self.name, max(self.open_seconds - elapsed, 0))
+
+    def record_success(self, elapsed: float):
+        with self._lock:
+            slow = elapsed >= self.slow_call_seconds
+            if self.state == HALF_OPEN:
+                if slow:
+                    self._trip(f"chamada de teste lenta ({elapsed:.1f}s)")
+                else:
+                    self._close()
+                return
+            self._calls.append((True, slow))
+            self._evaluate()
+
+    def release_probe(self):
+        """Chamada terminou sem desfecho conclusivo (ex: 429): a próxima pode ser a chamada de teste."""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probe_in_flight = False
+
+    def record_failure(self, error: str):
+        with self._lock:
+            self.last_failure = error
+            if self.state == HALF_OPEN:
+                self._trip(f"chamada de teste falhou: {error}")
+                return
+            self._calls.append((False, False))
+            self._evaluate()
+
+    def _evaluate(self):
+        total = len(self._calls)
+        if self.state != CLOSED or total < self.min_calls:
+            return
+        errors = sum(1 for ok, _ in self._calls if not ok)
+        slow = sum(1 for ok, is_slow in self._calls if ok and is_slow)
+        if errors / total >= self.error_threshold:
+            self._trip(f"{errors}/{total} erros")
+        elif slow / total >= self.slow_call_threshold:
+            self._trip(f"{slow}/{total} chamadas acima de {self.slow_call_seconds}s")
+
+    def _trip(self, reason: str):
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self.trips += 1
+        self._probe_in_flight = False
+        self._calls.clear()
+        logger.error(f"🔌 Circuit breaker '{self.name}' ABERTO por {self.open_seconds:.0f}s: {reason}")
+
+    def _close(self):
+        self.state = CLOSED
+        self._probe_in_flight = False
+        self._calls.clear()
+        logger.info(f"✅ Circuit breaker '{self.name}' fechado novamente.")
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            total = len(self._calls)
+            retry_in = max(self.open_seconds - (time.monotonic() - self.opened_at), 0) if self.state == OPEN else 0
+            return {
+                "state": self.state,
+                "window_calls": total,
+                "window_errors": sum(1 for ok, _ in self._calls if not ok),
+                "window_slow": sum(1 for ok, slow in self._calls if ok and slow),
+                "trips": self.trips,
+                "rejected": self.rejected,
+                "retry_in_seconds": round(retry_in, 1),
+                "last_failure": self.last_failure,
+            }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name: str, **config) -> CircuitBreaker:
+    """Breaker do processo para `name` (a config só vale na criação)."""
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(name, CircuitBreaker(name, **config))
+    return breaker
+
+
+def breaker_states() -> Dict[str, Dict]:
+    return {name: breaker.snapshot() for name, breaker in list(_breakers.items())}
+
+
+# =========================================================================
+# Marcação de dados stale (por request)
+# =========================================================================
+
+_stale_sources = contextvars.ContextVar('stale_sources', default=None)
+
+
+def reset_stale():
+    return _stale_sources.set(set())
+
+
+def mark_stale(source: str):
+    sources = _stale_sources.get()
+    if sources is None:
+        sources = set()
+        _stale_sources.set(sources)
+    sources.add(source)
+
+
+def stale_sources() -> set:
+    return set(_stale_sources.get() or ())
@@ -51,6 +51,17 @@ class BitrixConfig:
     # Product Categories (Section IDs)
     SECTION_IDS = [16, 18, 20, 22, 24, 32]
 
+    # Protocol Roles -> Product name keywords (all must match, case-insensitive)
+    PROTOCOL_MATCHERS = {
+        "dutasterida_oral": ["Dutasterida"], "finasterida_oral": ["Finasterida"],
+        "minoxidil_oral": ["Minoxidil", "2.5"], "saw_palmetto_oral": ["Saw"], 
+        "minoxidil_topico": ["Minoxidil", "Tópico"], "finasterida_topica": ["Finasterida", "Tópico"], 
+        "shampoo": ["Shampoo"], "biotina": ["Biotina"]
+    }
+
+    # Topical roles only match products from this section
+    TOPICAL_SECTION_ID = '20'
+
     @staticmethod
     def get_map(key):
         return BitrixConfig.KEY_MAP.get(key)
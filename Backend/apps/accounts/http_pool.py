@@ -0,0 +1,207 @@
+"""
+Pool de conexões HTTP (keep-alive) por processo para integrações externas.
+
+Cada worker do gunicorn mantém uma `requests.Session` por integração (ex: 'bitrix'),
+reaproveitando conexões TCP/TLS entre chamadas em vez de abrir uma nova por request.
+O módulo não depende do Django para poder ser usado pelos benchmarks em `benchmarks/`.
+"""
+
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POOL_SIZE = 10
+
+
+class PoolStats:
+    """
+    Contadores do pool (thread-safe).
+    reuse_ratio = fração de checkouts que reaproveitaram um socket já aberto.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.checkouts = 0
+        self.new_connections = 0
+        self.in_use = 0
+        self.checkout_wait_total = 0.0
+        self.checkout_wait_max = 0.0
+
+    def record_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def record_checkout(self, wait: float):
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.checkout_wait_total += wait
+            if wait > self.checkout_wait_max:
+                self.checkout_wait_max = wait
+
+    def record_release(self):
+        with self._lock:
+            if self.in_use > 0:
+                self.in_use -= 1
+
+    def record_new_connection(self):
+        with self._lock:
+            self.new_connections += 1
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            reused = max(self.checkouts - self.new_connections, 0)
+            return {
+                "requests": self.requests,
+                "checkouts": self.checkouts,
+                "new_connections": self.new_connections,
+                "reuse_ratio": round(reused / self.checkouts, 4) if self.checkouts else 0.0,
+                "in_use": self.in_use,
+                "checkout_wait_avg_ms": round(self.checkout_wait_total / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                "checkout_wait_max_ms": round(self.checkout_wait_max * 1000, 3),
+            }
+
+
+class _InstrumentedPoolMixin:
+    """Mede checkout/devolução e criação de conexões no pool do urllib3."""
+
+    _pool_stats: PoolStats = None
+
+    def _get_conn(self, timeout=None):
+        start = time.perf_counter()
+        conn = super()._get_conn(timeout=timeout)
+        self._pool_stats.record_checkout(time.perf_counter() - start)
+        return conn
+
+    def _put_conn(self, conn):
+        self._pool_stats.record_release()
+        return super()._put_conn(conn)
+
+    def _new_conn(self):
+        self._pool_stats.record_new_connection()
+        return super()._new_conn()
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter cujos pools do urllib3 reportam para um `PoolStats`."""
+
+    def __init__(self, stats: PoolStats, **kwargs):
+        self._stats = stats
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        super().init_poolmanager(connections, maxsize, block=block, **pool_kwargs)
+        attrs = {"_pool_stats": self._stats}
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": type("InstrumentedHTTPConnectionPool", (_InstrumentedPoolMixin, HTTPConnectionPool), attrs),
+            "https": type("InstrumentedHTTPSConnectionPool", (_InstrumentedPoolMixin, HTTPSConnectionPool), attrs),
+        }
+
+    def open_sockets(self) -> int:
+        """Sockets abertos = conexões ociosas com socket vivo + conexões em uso."""
+        idle = 0
+        pools = self.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            queue = getattr(getattr(pool, "pool", None), "queue", None) or []
+            idle += sum(1 for conn in list(queue) if conn is not None and getattr(conn, "sock", None) is not None)
+        return idle + self._stats.in_use
+
+
+class HTTPClientPool:
+    """
+    Sessão keep-alive de uma integração + estatísticas.
+    Use `get_pool(name)` em vez de instanciar diretamente (um pool por processo).
+    """
+
+    def __init__(self, name: str, pool_size: int = DEFAULT_POOL_SIZE, block: bool = False):
+        self.name = name
+        self.pool_size = pool_size
+        self.block = block
+        self.pid = os.getpid()
+        self.stats = PoolStats()
+        self.adapter = PooledHTTPAdapter(
+            self.stats,
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            pool_block=block,
+            max_retries=0,  # Retries ficam a cargo do Tenacity no chamador
+        )
+        self.session = requests.Session()
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        self.stats.record_request()
+        return self.session.request(method, url, **kwargs)
+
+    def warm_up(self, url: str, connections: int = 1, timeout: float = 5) -> int:
+        """
+        Abre `connections` conexões em paralelo contra `url` (DNS + TCP + TLS),
+        deixando-as ociosas no pool para as primeiras requisições do worker.
+        Retorna quantas tiveram sucesso. Nunca lança exceção.
+        """
+        connections = max(1, min(connections, self.pool_size))
+
+        def _touch(_):
+            try:
+                self.request("GET", url, timeout=timeout).close()
+                return True
+            except Exception as e:
+                logger.warning(f"⚠️ Warm-up do pool '{self.name}' falhou: {e}")
+                return False
+
+        if connections == 1:
+            return int(_touch(0))
+        with ThreadPoolExecutor(max_workers=connections) as executor:
+            return sum(executor.map(_touch, range(connections)))
+
+    def snapshot(self) -> Dict[str, float]:
+        data = self.stats.snapshot()
+        data.update({
+            "pool_size": self.pool_size,
+            "block": self.block,
+            "open_sockets": self.adapter.open_sockets(),
+            "pid": self.pid,
+        })
+        return data
+
+    def close(self):
+        self.session.close()
+
+
+_pools: Dict[str, HTTPClientPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(name: str, pool_size: int = DEFAULT_POOL_SIZE, block: bool = False) -> HTTPClientPool:
+    """
+    Retorna o pool do processo atual para a integração `name`.
+    Se o processo foi forkado (gunicorn --preload), recria o pool para não
+    compartilhar sockets com o processo pai.
+    """
+    pool = _pools.get(name)
+    if pool is not None and pool.pid == os.getpid():
+        return pool
+    with _pools_lock:
+        pool = _pools.get(name)
+        if pool is None or pool.pid != os.getpid():
+            pool = HTTPClientPool(name, pool_size=pool_size, block=block)
+            _pools[name] = pool
+        return pool
+
+
+def pool_stats(name: Optional[str] = None) -> Dict[str, Dict]:
+    """Estatísticas dos pools deste processo (ou só de `name`)."""
+    names: List[str] = [name] if name else list(_pools.keys())
+    return {n: _pools[n].snapshot() for n in names if n in _pools and _pools[n].pid == os.getpid()}
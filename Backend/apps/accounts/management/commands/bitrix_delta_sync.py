@@ -0,0 +1,64 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.utils.dateparse import parse_datetime
+from apps.accounts.services import BitrixDeltaSyncService
+from apps.accounts.rate_limit import bitrix_lane, LANE_BATCH
+
+# Leads primeiro: conversões reescrevem id_bitrix antes de aplicar Contatos e Deals
+ENTITIES = ['lead', 'contact', 'deal']
+
+
+class Command(BaseCommand):
+    help = ('Reconciliação incremental com o Bitrix: Deals, Contatos e Leads alterados desde a última execução '
+            '(>DATE_MODIFY). Retoma de onde parou se a execução anterior foi interrompida.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--entity', choices=ENTITIES, action='append', help='Entidade a sincronizar (padrão: todas)')
+        parser.add_argument('--max-pages', type=int, default=None, help='Limita páginas por entidade nesta execução (o resto fica para a próxima)')
+        parser.add_argument('--reset', action='store_true', help='Zera o cursor antes de rodar (relê tudo, ou desde --since)')
+        parser.add_argument('--since', type=str, default=None, help='Com --reset: high-water inicial (ISO 8601, ex: 2026-01-01T00:00:00-03:00)')
+        parser.add_argument('--loop', action='store_true', help='Não sai: repete a cada --interval segundos')
+        parser.add_argument('--interval', type=float, default=900.0, help='Espera (s) entre execuções (--loop)')
+
+    def handle(self, *args, **options):
+        entities = options['entity'] or ENTITIES
+        if options['reset']:
+            since = parse_datetime(options['since']) if options['since'] else None
+            if options['since'] and since is None:
+                raise CommandError(f"--since inválido: {options['since']}")
+            for entity in entities:
+                BitrixDeltaSyncService.reset(entity, since)
+            self.stdout.write(f"↩️ Cursor zerado para {', '.join(entities)} (desde {since or 'o início'}).")
+
+        # Cron/worker: consome o rate limit do Bitrix na lane de batch (usuários têm prioridade)
+        with bitrix_lane(LANE_BATCH):
+            if not options['loop']:
+                self._run(entities, options['max_pages'])
+                return
+
+            self.stdout.write("🔄 Reconciliação incremental Bitrix iniciada.")
+            try:
+                while True:
+                    close_old_connections()
+                    self._run(entities, options['max_pages'])
+                    time.sleep(options['interval'])
+            except KeyboardInterrupt:
+                self.stdout.write("🛑 Reconciliação incremental encerrada.")
+
+    def _run(self, entities, max_pages):
+        for entity in entities:
+            try:
+                stats = BitrixDeltaSyncService.sync(entity, max_pages=max_pages)
+            except Exception as e:
+                # Progresso até a última página aplicada fica no cursor: a próxima execução continua dali
+                self.stdout.write(self.style.ERROR(f"❌ {entity}: interrompido ({e}). Será retomado na próxima execução."))
+                continue
+            if stats.get('skipped'):
+                self.stdout.write(self.style.WARNING(f"⏭️ {entity}: outra execução em andamento, pulando."))
+                continue
+            status = "concluído" if stats['completed'] else "parcial (continua na próxima)"
+            self.stdout.write(self.style.SUCCESS(
+                f"✅ {entity}: {stats['records']} alterados em {stats['pages']} páginas, "
+                f"{stats['applied']} aplicados localmente — {status}{' (retomado)' if stats['resumed'] else ''}."
+            ))
@@ -5,6 +5,7 @@ from django.core.management.base import BaseCommand
 from apps.accounts.models import User, UserQuestionnaire
 from apps.financial.models import Transaction
 from apps.accounts.services import BitrixService
+from apps.accounts.rate_limit import bitrix_lane, LANE_BATCH
 from apps.accounts.config import BitrixConfig
 
 logger = logging.getLogger(__name__)
@@ -19,6 +20,11 @@ class Command(BaseCommand):
         parser.add_argument('--dry-run', action='store_true', help='Simula sem enviar ao Bitrix')
 
     def handle(self, *args, **options):
+        # Cron: consome o rate limit do Bitrix na lane de batch (usuários têm prioridade)
+        with bitrix_lane(LANE_BATCH):
+            self._handle(*args, **options)
+
+    def _handle(self, *args, **options):
         email_arg = options.get('email')
         deal_id_arg = options.get('deal_id')
         pending_mode = options.get('pending')
@@ -129,7 +135,6 @@ class Command(BaseCommand):
                 plan_title=f"ProtocoloMed - {plan_slug}",
                 total_amount=final_total,
                 answers=answers,
-                answers=answers,
                 payment_data={
                     "status": "approved",
                     "asaas_payment_id": last_trans.asaas_payment_id,
@@ -45,36 +45,32 @@ class Command(BaseCommand):
                 }
             
             # 3. Deals (Ganhos, Perdidos, Em andamento)
-            deals_resp = BitrixService._safe_request('GET', 'crm.deal.list.json', params={
-                "filter[CONTACT_ID]": bitrix_id,
-                "order[ID]": "DESC",
-                "select[]": ["ID", "TITLE", "STAGE_ID", "OPPORTUNITY", "DATE_CREATE", "CLOSED"]
-            })
-
-            if deals_resp and 'result' in deals_resp:
-                for d in deals_resp['result']:
-                    deal_obj = {
-                        "id": d.get("ID"),
-                        "title": d.get("TITLE"),
-                        "stage": d.get("STAGE_ID"),
-                        "value": d.get("OPPORTUNITY"),
-                        "created": d.get("DATE_CREATE"),
-                        "is_closed": d.get("CLOSED"),
-                        "products": []
-                    }
-                    
-                    # 4. Produtos do Deal
-                    rows_resp = BitrixService._safe_request('GET', 'crm.deal.productrows.get.json', params={"id": d.get("ID")})
-                    if rows_resp and 'result' in rows_resp:
-                        for r in rows_resp['result']:
-                            deal_obj["products"].append({
-                                "product_id": r.get("PRODUCT_ID"),
-                                "name": r.get("PRODUCT_NAME"),
-                                "price": r.get("PRICE"),
-                                "quantity": r.get("QUANTITY")
-                            })
-                    
-                    data["deals"].append(deal_obj)
+            # Todas as páginas (antes só os 50 primeiros Deals)
+            deals = BitrixService.iter_list('crm.deal.list', {"filter": {"CONTACT_ID": bitrix_id}, "order": {"ID": "DESC"}},
+                                            select=["ID", "TITLE", "STAGE_ID", "OPPORTUNITY", "DATE_CREATE", "CLOSED"])
+            for d in deals:
+                deal_obj = {
+                    "id": d.get("ID"),
+                    "title": d.get("TITLE"),
+                    "stage": d.get("STAGE_ID"),
+                    "value": d.get("OPPORTUNITY"),
+                    "created": d.get("DATE_CREATE"),
+                    "is_closed": d.get("CLOSED"),
+                    "products": []
+                }
+                
+                # 4. Produtos do Deal
+                rows_resp = BitrixService._safe_request('GET', 'crm.deal.productrows.get.json', params={"id": d.get("ID")})
+                if rows_resp and 'result' in rows_resp:
+                    for r in rows_resp['result']:
+                        deal_obj["products"].append({
+                            "product_id": r.get("PRODUCT_ID"),
+                            "name": r.get("PRODUCT_NAME"),
+                            "price": r.get("PRICE"),
+                            "quantity": r.get("QUANTITY")
+                        })
+                
+                data["deals"].append(deal_obj)
 
         except Exception as e:
             self.stdout.write(self.style.ERROR(f"Erro na execução: {e}"))
@@ -0,0 +1,44 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from apps.accounts.services import BitrixOutboxService
+from apps.accounts.rate_limit import bitrix_lane, LANE_BATCH
+
+
+class Command(BaseCommand):
+    help = 'Drena o outbox de escritas no Bitrix (BitrixOutbox). Use --loop para rodar como worker contínuo.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=20, help='Eventos reservados por ciclo')
+        parser.add_argument('--loop', action='store_true', help='Não sai: fica consumindo a fila')
+        parser.add_argument('--interval', type=float, default=2.0, help='Espera (s) quando a fila está vazia (--loop)')
+        parser.add_argument('--purge-days', type=int, default=30, help='Apaga eventos concluídos mais antigos que isso')
+
+    def handle(self, *args, **options):
+        # Worker: consome o rate limit do Bitrix na lane de batch (usuários têm prioridade)
+        with bitrix_lane(LANE_BATCH):
+            if not options['loop']:
+                self._report(BitrixOutboxService.process_due(limit=options['limit']))
+                BitrixOutboxService.purge(options['purge_days'])
+                return
+
+            self.stdout.write("📮 Worker do outbox Bitrix iniciado.")
+            last_purge = 0.0
+            try:
+                while True:
+                    close_old_connections()
+                    stats = BitrixOutboxService.process_due(limit=options['limit'])
+                    if stats['claimed']:
+                        self._report(stats)
+                    else:
+                        time.sleep(options['interval'])
+                    if time.time() - last_purge > 3600:
+                        BitrixOutboxService.purge(options['purge_days'])
+                        last_purge = time.time()
+            except KeyboardInterrupt:
+                self.stdout.write("🛑 Worker do outbox encerrado.")
+
+    def _report(self, stats):
+        self.stdout.write(self.style.SUCCESS(
+            f"📮 {stats['claimed']} eventos processados: {stats['done']} ok, {stats['failed']} com falha."
+        ))
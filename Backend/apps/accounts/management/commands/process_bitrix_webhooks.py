@@ -0,0 +1,45 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from apps.accounts.services import BitrixWebhookIngestService
+from apps.accounts.rate_limit import bitrix_lane, LANE_BATCH
+
+
+class Command(BaseCommand):
+    help = 'Processa os webhooks do Bitrix gravados pela BitrixWebhookView (agrupa rajadas e descarta ecos). Rode uma única instância.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=200, help='Eventos lidos por ciclo')
+        parser.add_argument('--loop', action='store_true', help='Não sai: fica consumindo a fila')
+        parser.add_argument('--interval', type=float, default=1.0, help='Espera (s) entre ciclos (--loop)')
+        parser.add_argument('--purge-days', type=int, default=7, help='Apaga eventos já tratados mais antigos que isso')
+
+    def handle(self, *args, **options):
+        # Worker: consome o rate limit do Bitrix na lane de batch (usuários têm prioridade)
+        with bitrix_lane(LANE_BATCH):
+            if not options['loop']:
+                self._report(BitrixWebhookIngestService.process_pending(limit=options['limit']))
+                BitrixWebhookIngestService.purge(options['purge_days'])
+                return
+
+            self.stdout.write("📨 Consumidor de webhooks Bitrix iniciado.")
+            last_purge = 0.0
+            try:
+                while True:
+                    close_old_connections()
+                    stats = BitrixWebhookIngestService.process_pending(limit=options['limit'])
+                    if stats['processed'] or stats['coalesced'] or stats['echo'] or stats['retry'] or stats['failed']:
+                        self._report(stats)
+                    time.sleep(options['interval'])
+                    if time.time() - last_purge > 3600:
+                        BitrixWebhookIngestService.purge(options['purge_days'])
+                        last_purge = time.time()
+            except KeyboardInterrupt:
+                self.stdout.write("🛑 Consumidor de webhooks encerrado.")
+
+    def _report(self, stats):
+        self.stdout.write(self.style.SUCCESS(
+            f"📨 Webhooks: {stats['processed']} processados, {stats['coalesced']} agrupados, "
+            f"{stats['echo']} ecos descartados, {stats['retry']} reagendados, {stats['failed']} com falha, "
+            f"{stats['waiting']} aguardando."
+        ))
@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand
 from django.utils import timezone
 from apps.accounts.models import User
+from apps.accounts.profile_snapshot import ProfileSnapshotService
 import logging
 
 logger = logging.getLogger(__name__)
@@ -24,6 +25,7 @@ class Command(BaseCommand):
                 user.subscription_status = User.SubscriptionStatus.CANCELED
                 user.current_plan = User.PlanType.NONE
                 user.save()
+                ProfileSnapshotService.schedule(user.pk, 'subscription_cancel')
                 count += 1
             except Exception as e:
                 logger.error(f"❌ Erro ao processar user {user.email}: {e}")
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from apps.accounts.services import LeadConversionService
+from apps.accounts.rate_limit import bitrix_lane, LANE_BATCH
+
+
+class Command(BaseCommand):
+    help = 'Resolve Leads pendentes de conversão em Contato no Bitrix e reescreve User.id_bitrix (fallback do webhook ONCRMLEADUPDATE).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=200, help='Máximo de Leads verificados nesta execução')
+
+    def handle(self, *args, **options):
+        # Cron: consome o rate limit do Bitrix na lane de batch (usuários têm prioridade)
+        with bitrix_lane(LANE_BATCH):
+            stats = LeadConversionService.resolve_due(limit=options['limit'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"🔁 {stats['checked']} Leads verificados, {stats['converted']} convertidos em Contato."
+        ))
@@ -0,0 +1,294 @@
+"""
+Métricas das chamadas externas (Bitrix e Asaas), expostas em GET /metrics (formato texto do Prometheus).
+
+Por serviço + método HTTP + endpoint + origem da chamada:
+  - outbound_requests_total{status}        contagem por status HTTP ('error' = sem resposta: timeout/conexão)
+  - outbound_request_duration_seconds      histograma de latência de cada tentativa
+  - outbound_request_bytes / _response_bytes  histograma do tamanho dos payloads
+  - outbound_retries_total                 novas tentativas agendadas pelo tenacity
+  - outbound_rate_limited_total            respostas 429
+  - outbound_batch_commands_total          comandos dentro de cada batch.json do Bitrix (por método da API)
+
+Do cache em dois níveis (config/cache.py), por família de chave:
+  - cache_requests_total{result}           l1_hit / l2_hit / miss
+  - cache_invalidations_total{tag}         invalidate_tag() por tipo de tag (user, catalog, plan)
+
+Da autenticação (apps/accounts/authentication.py):
+  - auth_user_total{source}                claims (sem banco) / database / lazy_load (view pediu o User completo)
+
+A origem ("caller") vem de um contextvar: OutboundCallerMiddleware marca `view:<Classe>` em cada
+request e o manage.py marca `command:<nome>` (env OUTBOUND_CALLER) — assim dá para ver qual tela
+ou cron está consumindo a cota do Bitrix. Threads de background usam `caller_context(...)`.
+
+O registro é por processo. Com METRICS_DIR configurado (volume compartilhado), cada processo
+(workers do gunicorn, crons, workers --loop) grava um snapshot lá a cada METRICS_FLUSH_SECONDS
+e o /metrics soma todos — as chamadas dos management commands aparecem no mesmo endpoint.
+Sem prometheus_client: o formato de exposição é simples e evita mais uma dependência.
+"""
+
+import os
+import re
+import json
+import time
+import atexit
+import logging
+import threading
+import contextvars
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+HISTOGRAMS = {
+    'outbound_request_duration_seconds': LATENCY_BUCKETS,
+    'outbound_request_bytes': SIZE_BUCKETS,
+    'outbound_response_bytes': SIZE_BUCKETS,
+}
+
+HELP = {
+    'outbound_requests_total': ('counter', 'Chamadas externas por status HTTP.'),
+    'outbound_retries_total': ('counter', 'Novas tentativas de chamadas externas.'),
+    'outbound_rate_limited_total': ('counter', 'Respostas 429 recebidas.'),
+    'outbound_batch_commands_total': ('counter', 'Comandos enviados dentro de batch.json do Bitrix.'),
+    'cache_requests_total': ('counter', 'Leituras do cache por família e resultado (l1_hit, l2_hit, miss).'),
+    'cache_invalidations_total': ('counter', 'Invalidações de tag do cache.'),
+    'auth_user_total': ('counter', 'Usuários autenticados por origem (claims do token, banco, carga sob demanda).'),
+    'outbound_request_duration_seconds': ('histogram', 'Latência de cada tentativa (segundos).'),
+    'outbound_request_bytes': ('histogram', 'Tamanho do corpo enviado (bytes).'),
+    'outbound_response_bytes': ('histogram', 'Tamanho do corpo recebido (bytes).'),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+_lock = threading.Lock()
+_counters: Dict[Tuple[str, Labels], float] = defaultdict(float)
+# (nome, labels) -> [contagem por bucket..., soma, total]
+_histograms: Dict[Tuple[str, Labels], List[float]] = {}
+_last_flush = 0.0
+_started_at = int(time.time())
+
+_caller = contextvars.ContextVar('outbound_caller', default=None)
+
+# Segmentos de path que são IDs (pay_xxx, cus_xxx, números, uuids) viram {id}: cardinalidade fixa
+_ID_SEGMENT = re.compile(r'^([a-z]{2,4}_\w+|[\w-]*\d[\w-]*)$', re.IGNORECASE)
+
+
+# --- Origem das chamadas ---
+
+@contextmanager
+def caller_context(name: str):
+    """Marca as chamadas externas feitas dentro do bloco com a origem `name`."""
+    token = _caller.set(name)
+    try:
+        yield
+    finally:
+        _caller.reset(token)
+
+
+def set_caller(name: Optional[str]):
+    """Define a origem no contexto atual; devolve o token para `reset_caller`."""
+    return _caller.set(name)
+
+
+def reset_caller(token):
+    _caller.reset(token)
+
+
+def current_caller() -> str:
+    return _caller.get() or os.environ.get('OUTBOUND_CALLER') or 'unknown'
+
+
+def normalize_endpoint(endpoint: str) -> str:
+    """'payments/pay_123/pixQrCode?x=1' -> 'payments/{id}/pixQrCode' (métodos do Bitrix ficam como estão)."""
+    path = (endpoint or '').split('?', 1)[0].strip('/')
+    return '/'.join('{id}' if _ID_SEGMENT.match(seg) and '.' not in seg else seg for seg in path.split('/'))
+
+
+# --- Registro ---
+
+def _labels(**labels) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name: str, value: float = 1, **labels):
+    with _lock:
+        _counters[(name, _labels(**labels))] += value
+    _maybe_flush()
+
+
+def observe(name: str, value: float, **labels):
+    buckets = HISTOGRAMS[name]
+    key = (name, _labels(**labels))
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = [0.0] * (len(buckets) + 2)
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                hist[i] += 1
+        hist[-2] += value
+        hist[-1] += 1
+
+
+def record_call(service: str, method: str, endpoint: str, status, duration: float,
+                request_bytes: int = 0, response_bytes: int = 0):
+    """Uma tentativa de chamada externa (status = código HTTP ou 'error')."""
+    endpoint = normalize_endpoint(endpoint)
+    caller = current_caller()
+    base = dict(service=service, method=method.upper(), endpoint=endpoint, caller=caller)
+    observe('outbound_request_duration_seconds', duration, **base)
+    observe('outbound_request_bytes', request_bytes, **base)
+    if status != 'error':
+        observe('outbound_response_bytes', response_bytes, **base)
+    if status == 429:
+        inc('outbound_rate_limited_total', service=service, endpoint=endpoint, caller=caller)
+    inc('outbound_requests_total', status=status, **base)
+
+
+def record_retry(service: str, endpoint: str):
+    inc('outbound_retries_total', service=service, endpoint=normalize_endpoint(endpoint), caller=current_caller())
+
+
+def record_batch(service: str, api_methods: List[str]):
+    caller = current_caller()
+    per_method = defaultdict(int)
+    for api_method in api_methods:
+        per_method[api_method] += 1
+    for api_method, count in per_method.items():
+        inc('outbound_batch_commands_total', count, service=service, api_method=api_method, caller=caller)
+
+
+def snapshot() -> dict:
+    with _lock:
+        return {
+            'counters': [[name, list(labels), value] for (name, labels), value in _counters.items()],
+            'histograms': [[name, list(labels), list(hist)] for (name, labels), hist in _histograms.items()],
+        }
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+# --- Snapshots compartilhados (METRICS_DIR) ---
+
+def _metrics_dir() -> Optional[str]:
+    return getattr(settings, 'METRICS_DIR', '') or None
+
+
+def _snapshot_path(directory: str) -> str:
+    # pid + início do processo: um pid reaproveitado após restart não sobrescreve o arquivo antigo
+    return os.path.join(directory, f"{os.getpid()}-{_started_at}.json")
+
+
+def flush():
+    """Grava o snapshot deste processo em METRICS_DIR (escrita atômica)."""
+    global _last_flush
+    directory = _metrics_dir()
+    if not directory:
+        return
+    _last_flush = time.monotonic()
+    try:
+        os.makedirs(directory, exist_ok=True)
+        path = _snapshot_path(directory)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(snapshot(), f)
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.warning(f"⚠️ Métricas: falha ao gravar snapshot em {directory}: {e}")
+
+
+def _maybe_flush():
+    if _metrics_dir() and time.monotonic() - _last_flush >= getattr(settings, 'METRICS_FLUSH_SECONDS', 15):
+        flush()
+
+
+atexit.register(flush)
+
+
+def _merged() -> dict:
+    """Snapshot deste processo + os dos demais processos em METRICS_DIR."""
+    counters: Dict[Tuple[str, Labels], float] = defaultdict(float)
+    histograms: Dict[Tuple[str, Labels], List[float]] = {}
+    snapshots = [snapshot()]
+
+    directory = _metrics_dir()
+    if directory and os.path.isdir(directory):
+        own = os.path.basename(_snapshot_path(directory))
+        max_age = getattr(settings, 'METRICS_RETENTION_SECONDS', 7 * 24 * 3600)
+        for name in os.listdir(directory):
+            if not name.endswith('.json') or name == own:
+                continue
+            path = os.path.join(directory, name)
+            try:
+                if time.time() - os.path.getmtime(path) > max_age:
+                    os.remove(path)
+                    continue
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+
+    for snap in snapshots:
+        for name, labels, value in snap.get('counters', []):
+            counters[(name, tuple(tuple(pair) for pair in labels))] += value
+        for name, labels, hist in snap.get('histograms', []):
+            key = (name, tuple(tuple(pair) for pair in labels))
+            if key not in histograms:
+                histograms[key] = list(hist)
+            else:
+                histograms[key] = [a + b for a, b in zip(histograms[key], hist)]
+    return {'counters': counters, 'histograms': histograms}
+
+
+# --- Exposição ---
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _fmt_labels(labels, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(str(v))}"' for k, v in pairs) + '}'
+
+
+def _fmt_number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render() -> str:
+    """Texto no formato de exposição do Prometheus (versão 0.0.4)."""
+    data = _merged()
+    by_name: Dict[str, List[str]] = defaultdict(list)
+
+    for (name, labels), value in sorted(data['counters'].items()):
+        by_name[name].append(f"{name}{_fmt_labels(labels)} {_fmt_number(value)}")
+
+    for (name, labels), hist in sorted(data['histograms'].items()):
+        buckets = HISTOGRAMS.get(name)
+        if buckets is None or len(hist) != len(buckets) + 2:
+            continue
+        for bound, count in zip(buckets, hist):
+            by_name[name].append(f"{name}_bucket{_fmt_labels(labels, (('le', _fmt_number(bound)),))} {_fmt_number(count)}")
+        by_name[name].append(f"{name}_bucket{_fmt_labels(labels, (('le', '+Inf'),))} {_fmt_number(hist[-1])}")
+        by_name[name].append(f"{name}_sum{_fmt_labels(labels)} {_fmt_number(hist[-2])}")
+        by_name[name].append(f"{name}_count{_fmt_labels(labels)} {_fmt_number(hist[-1])}")
+
+    lines = []
+    for name in sorted(by_name):
+        kind, help_text = HELP.get(name, ('untyped', ''))
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(by_name[name])
+    return "\n".join(lines) + "\n"
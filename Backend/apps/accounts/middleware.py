@@ -0,0 +1,44 @@
+# Backend/apps/accounts/middleware.py
+
+from .circuit_breaker import reset_stale, stale_sources
+from .metrics import set_caller, reset_caller
+
+
+class StaleDataMiddleware:
+    """
+    Informa ao frontend quando parte da resposta veio do último valor bom conhecido
+    (Bitrix fora/circuit breaker aberto): header `X-Data-Stale: catalog,contact`.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        reset_stale()
+        response = self.get_response(request)
+        sources = stale_sources()
+        if sources:
+            response['X-Data-Stale'] = ",".join(sorted(sources))
+        return response
+
+
+class OutboundCallerMiddleware:
+    """
+    Marca as chamadas ao Bitrix/Asaas feitas durante o request com a view de origem
+    (`view:UserProfileView`), usada como label `caller` nas métricas (apps.accounts.metrics).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = set_caller(None)
+        try:
+            return self.get_response(request)
+        finally:
+            reset_caller(token)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view = getattr(view_func, 'view_class', None) or view_func
+        set_caller(f"view:{getattr(view, '__name__', 'unknown')}")
+        return None
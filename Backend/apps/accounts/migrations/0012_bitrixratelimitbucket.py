@@ -0,0 +1,21 @@
+# Generated by Django 6.0.2 on 2026-10-17 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0011_user_date_of_birth'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BitrixRateLimitBucket',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('tokens', models.FloatField(default=0)),
+                ('updated_at', models.FloatField(default=0, help_text='Epoch (segundos) do último refill')),
+            ],
+        ),
+    ]
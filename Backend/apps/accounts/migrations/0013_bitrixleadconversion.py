@@ -0,0 +1,32 @@
+# Generated by Django 6.0.2 on 2026-10-17 12:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0012_bitrixratelimitbucket'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BitrixLeadConversion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('lead_id', models.CharField(max_length=50, unique=True)),
+                ('status', models.CharField(choices=[('pending', 'Aguardando Conversão'), ('converted', 'Convertido'), ('expired', 'Expirado')], default='pending', max_length=20)),
+                ('contact_id', models.CharField(blank=True, max_length=50, null=True)),
+                ('attempts', models.IntegerField(default=0)),
+                ('next_check_at', models.DateTimeField(db_index=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('resolved_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bitrix_lead_conversions', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'next_check_at'], name='accounts_bi_status_3e44f6_idx')],
+            },
+        ),
+    ]
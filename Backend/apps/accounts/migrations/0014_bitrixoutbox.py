@@ -0,0 +1,37 @@
+# Generated by Django 6.0.2 on 2026-10-17 11:00
+
+import django.core.serializers.json
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0013_bitrixleadconversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BitrixOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(help_text='Tipo da escrita (ver BitrixOutboxService.HANDLERS)', max_length=50)),
+                ('payload', models.JSONField(blank=True, default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('reference', models.CharField(blank=True, db_index=True, help_text='Objeto local de origem (ex: transaction:<uuid>)', max_length=100, null=True)),
+                ('dedupe_key', models.CharField(blank=True, help_text='Evita enfileirar a mesma escrita duas vezes', max_length=150, null=True, unique=True)),
+                ('status', models.CharField(choices=[('pending', 'Pendente'), ('processing', 'Processando'), ('done', 'Concluído'), ('failed', 'Falhou (tentativas esgotadas)')], default='pending', max_length=20)),
+                ('attempts', models.IntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(db_index=True)),
+                ('locked_at', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='bitrix_outbox', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='accounts_bi_status_8deffb_idx'), models.Index(fields=['user', 'status'], name='accounts_bi_user_id_4068ea_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 6.0.2 on 2026-10-17 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0014_bitrixoutbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BitrixLocalWrite',
+            fields=[
+                ('entity', models.CharField(max_length=60, primary_key=True, serialize=False)),
+                ('written_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BitrixWebhookEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event', models.CharField(max_length=60)),
+                ('entity', models.CharField(blank=True, help_text='Ex: deal:123 (chave de agrupamento)', max_length=60, null=True)),
+                ('payload', models.JSONField(blank=True, default=dict)),
+                ('status', models.CharField(choices=[('pending', 'Pendente'), ('processed', 'Processado'), ('coalesced', 'Agrupado (evento mais novo processado)'), ('echo', 'Eco de escrita nossa'), ('failed', 'Falhou')], default='pending', max_length=20)),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('error', models.TextField(blank=True, default='')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'received_at'], name='accounts_bi_status_1b61f3_idx'), models.Index(fields=['entity', 'status'], name='accounts_bi_entity_8435f6_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 6.0.2 on 2026-10-17 13:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0015_bitrix_webhook_buffer'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BitrixDeal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('deal_id', models.BigIntegerField(unique=True)),
+                ('contact_id', models.CharField(blank=True, max_length=50, null=True)),
+                ('lead_id', models.CharField(blank=True, max_length=50, null=True)),
+                ('stage_id', models.CharField(blank=True, default='', max_length=50)),
+                ('closed', models.BooleanField(default=False)),
+                ('payment_status', models.CharField(blank=True, max_length=100, null=True)),
+                ('title', models.CharField(blank=True, default='', max_length=255)),
+                ('opportunity', models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['contact_id', '-deal_id'], name='accounts_bi_contact_cfcaa2_idx'), models.Index(fields=['lead_id', '-deal_id'], name='accounts_bi_lead_id_bb7274_idx')],
+            },
+        ),
+    ]
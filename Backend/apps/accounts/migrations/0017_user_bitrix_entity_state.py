@@ -0,0 +1,55 @@
+# Generated by Django 6.0.2 on 2026-10-17 14:00
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_entity_state(apps, schema_editor):
+    """Preenche o que já se sabe localmente: Leads pendentes (BitrixLeadConversion) e Contatos com Deal indexado."""
+    User = apps.get_model('accounts', 'User')
+    BitrixLeadConversion = apps.get_model('accounts', 'BitrixLeadConversion')
+    BitrixDeal = apps.get_model('accounts', 'BitrixDeal')
+    now = timezone.now()
+
+    pending_leads = BitrixLeadConversion.objects.filter(status='pending').values_list('lead_id', flat=True)
+    User.objects.filter(id_bitrix__in=list(pending_leads)).update(
+        bitrix_entity_type='lead', bitrix_conversion_status='pending', bitrix_entity_checked_at=now)
+
+    converted = BitrixLeadConversion.objects.filter(status='converted').values_list('contact_id', flat=True)
+    User.objects.filter(id_bitrix__in=list(converted)).update(
+        bitrix_entity_type='contact', bitrix_conversion_status='converted', bitrix_entity_checked_at=now)
+
+    contacts = BitrixDeal.objects.exclude(contact_id=None).values_list('contact_id', flat=True).distinct()
+    User.objects.filter(id_bitrix__in=list(contacts), bitrix_entity_type='unknown').update(
+        bitrix_entity_type='contact', bitrix_entity_checked_at=now)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0016_bitrixdeal'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='bitrix_conversion_status',
+            field=models.CharField(choices=[('none', 'Não se aplica'), ('pending', 'Lead aguardando conversão'), ('converted', 'Lead convertido em Contato')], default='none', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='bitrix_entity_checked_at',
+            field=models.DateTimeField(blank=True, help_text='Última confirmação do tipo no Bitrix', null=True),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='bitrix_entity_type',
+            field=models.CharField(choices=[('unknown', 'Desconhecido'), ('contact', 'Contato'), ('lead', 'Lead')], default='unknown', max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='id_bitrix',
+            field=models.CharField(blank=True, db_index=True, help_text='ID do contato no CRM', max_length=50, null=True),
+        ),
+        migrations.RunPython(backfill_entity_state, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 6.0.2 on 2026-10-17 15:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0017_user_bitrix_entity_state'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bitrixdeal',
+            name='date_modify',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='bitrixdeal',
+            name='rows_synced_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='bitrixdeal',
+            name='synced_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='BitrixDealRow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_id', models.IntegerField(blank=True, null=True)),
+                ('product_name', models.CharField(blank=True, default='', max_length=255)),
+                ('price', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('quantity', models.DecimalField(decimal_places=2, default=1, max_digits=10)),
+                ('sort', models.PositiveIntegerField(default=0)),
+                ('deal', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rows', to='accounts.bitrixdeal')),
+            ],
+            options={
+                'ordering': ['sort', 'id'],
+            },
+        ),
+    ]
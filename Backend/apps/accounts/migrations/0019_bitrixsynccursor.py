@@ -0,0 +1,29 @@
+# Generated by Django 6.0.2 on 2026-10-17 16:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0018_bitrix_deal_mirror'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BitrixSyncCursor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entity', models.CharField(choices=[('deal', 'Deal'), ('contact', 'Contato'), ('lead', 'Lead')], max_length=20, unique=True)),
+                ('high_water', models.DateTimeField(blank=True, null=True)),
+                ('run_since', models.DateTimeField(blank=True, null=True)),
+                ('run_last_id', models.BigIntegerField(blank=True, null=True)),
+                ('run_max_modified', models.DateTimeField(blank=True, null=True)),
+                ('run_started_at', models.DateTimeField(blank=True, null=True)),
+                ('locked_until', models.DateTimeField(blank=True, null=True)),
+                ('last_completed_at', models.DateTimeField(blank=True, null=True)),
+                ('last_stats', models.JSONField(blank=True, default=dict)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
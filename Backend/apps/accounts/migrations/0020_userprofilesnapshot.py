@@ -0,0 +1,28 @@
+# Generated by Django 6.0.2 on 2026-10-17 17:00
+
+import django.core.serializers.json
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0019_bitrixsynccursor'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserProfileSnapshot',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='profile_snapshot', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('data', models.JSONField(blank=True, default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('bitrix_contact', models.JSONField(blank=True, default=dict)),
+                ('bitrix_contact_synced_at', models.DateTimeField(blank=True, null=True)),
+                ('version', models.PositiveIntegerField(default=0)),
+                ('reason', models.CharField(blank=True, default='', help_text='Evento que gerou a última reconstrução', max_length=50)),
+                ('built_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
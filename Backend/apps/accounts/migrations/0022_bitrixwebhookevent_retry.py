@@ -0,0 +1,23 @@
+# Generated by Django 6.0.2 on 2026-10-17 19:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0021_user_auth_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bitrixwebhookevent',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='bitrixwebhookevent',
+            name='next_attempt_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0.2 on 2026-10-17 20:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0022_bitrixwebhookevent_retry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bitrixlocalwrite',
+            name='pending_echoes',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
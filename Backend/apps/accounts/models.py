@@ -1,4 +1,5 @@
 from django.db import models
+from django.core.serializers.json import DjangoJSONEncoder
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin, BaseUserManager
 import uuid
 
@@ -50,8 +51,22 @@ class User(AbstractBaseUser, PermissionsMixin):
     city = models.CharField(max_length=100, null=True, blank=True)
     state = models.CharField(max_length=2, null=True, blank=True)
 
+    class BitrixEntityType(models.TextChoices):
+        UNKNOWN = 'unknown', 'Desconhecido'
+        CONTACT = 'contact', 'Contato'
+        LEAD = 'lead', 'Lead'
+
+    class BitrixConversionStatus(models.TextChoices):
+        NONE = 'none', 'Não se aplica'
+        PENDING = 'pending', 'Lead aguardando conversão'
+        CONVERTED = 'converted', 'Lead convertido em Contato'
+
     # Integrações
-    id_bitrix = models.CharField(max_length=50, null=True, blank=True, help_text="ID do contato no CRM")
+    id_bitrix = models.CharField(max_length=50, null=True, blank=True, db_index=True, help_text="ID do contato no CRM")
+    # O que o id_bitrix é no Bitrix (evita os probes crm.contact.get/crm.lead.get antes de cada escrita)
+    bitrix_entity_type = models.CharField(max_length=10, choices=BitrixEntityType.choices, default=BitrixEntityType.UNKNOWN)
+    bitrix_conversion_status = models.CharField(max_length=10, choices=BitrixConversionStatus.choices, default=BitrixConversionStatus.NONE)
+    bitrix_entity_checked_at = models.DateTimeField(null=True, blank=True, help_text="Última confirmação do tipo no Bitrix")
     customer_id_mp = models.CharField(max_length=50, null=True, blank=True, help_text="ID do Cliente no Mercado Pago")
     asaas_customer_id = models.CharField(max_length=50, null=True, blank=True, help_text="ID do Cliente no Asaas")
     
@@ -110,6 +125,11 @@ class User(AbstractBaseUser, PermissionsMixin):
     is_staff = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # Versão dos dados copiados para o JWT (ver apps/accounts/authentication.py): muda a cada save
+    # que altera um dos CLAIM_FIELDS, e tokens emitidos antes deixam de ser confiáveis sem o banco
+    auth_version = models.PositiveIntegerField(default=0)
+    CLAIM_FIELDS = ('email', 'full_name', 'role', 'current_plan', 'is_active', 'password')
+
     objects = UserManager()
 
     USERNAME_FIELD = 'email'
@@ -118,6 +138,41 @@ class User(AbstractBaseUser, PermissionsMixin):
     def __str__(self):
         return self.email
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_claims = instance._claim_values()
+        return instance
+
+    def _claim_values(self):
+        # Só campos carregados (deferidos ficam de fora e não disparam query)
+        return {f: self.__dict__.get(f) for f in self.CLAIM_FIELDS}
+
+    def save(self, *args, **kwargs):
+        loaded = getattr(self, '_loaded_claims', None)
+        claims_changed = not self._state.adding and loaded is not None and self._claim_values() != loaded
+        if claims_changed:
+            # Incremento no banco: dois saves de instâncias carregadas na mesma versão não podem gravar o mesmo N+1
+            self.auth_version = models.F('auth_version') + 1
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'auth_version'}
+        super().save(*args, **kwargs)
+        if claims_changed:
+            self.refresh_from_db(fields=['auth_version'])
+        self._loaded_claims = self._claim_values()
+        if claims_changed:
+            from django.db import transaction
+            transaction.on_commit(lambda: User._publish_committed_auth_version(self.pk))
+
+    @staticmethod
+    def _publish_committed_auth_version(user_id):
+        # Relê após o commit: um on_commit atrasado de um save anterior nunca publica uma versão já superada
+        from .authentication import publish_auth_version
+        version = User.objects.filter(pk=user_id).values_list('auth_version', flat=True).first()
+        if version is not None:
+            publish_auth_version(user_id, version)
+
 # --- 3. MODELOS AUXILIARES ---
 
 class UserQuestionnaire(models.Model):
@@ -217,4 +272,216 @@ class DoctorInvite(models.Model):
 
     def __str__(self):
         status = "USADO" if self.is_used else "DISPONÍVEL"
-        return f"{self.code} [{status}]"
\ No newline at end of file
+        return f"{self.code} [{status}]"
+
+class BitrixRateLimitBucket(models.Model):
+    """
+    Estado compartilhado do token-bucket do Bitrix (ver rate_limit.py).
+    Uma linha por bucket; todos os workers do gunicorn e crons consomem da mesma linha.
+    """
+    name = models.CharField(max_length=50, primary_key=True)
+    tokens = models.FloatField(default=0)
+    updated_at = models.FloatField(default=0, help_text="Epoch (segundos) do último refill")
+
+    def __str__(self):
+        return f"{self.name}: {self.tokens:.1f} tokens"
+
+
+class BitrixLeadConversion(models.Model):
+    """
+    Lead criado por nós no Bitrix aguardando conversão em Contato.
+    Resolvido pelo webhook ONCRMLEADUPDATE ou pelo cron resolve_bitrix_leads,
+    que reescrevem User.id_bitrix para o ID do Contato.
+    """
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'Aguardando Conversão'
+        CONVERTED = 'converted', 'Convertido'
+        EXPIRED = 'expired', 'Expirado'
+
+    lead_id = models.CharField(max_length=50, unique=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='bitrix_lead_conversions')
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.PENDING)
+    contact_id = models.CharField(max_length=50, null=True, blank=True)
+    attempts = models.IntegerField(default=0)
+    next_check_at = models.DateTimeField(db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    resolved_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'next_check_at'])]
+
+    def __str__(self):
+        return f"Lead {self.lead_id} -> {self.contact_id or '?'} [{self.status}]"
+
+
+class BitrixOutbox(models.Model):
+    """
+    Outbox transacional das escritas no Bitrix.
+    A linha é gravada na MESMA transação do dado local (ex: Transaction); o worker
+    process_bitrix_outbox drena a fila fora do request, em ordem por usuário, com retry/backoff.
+    """
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'Pendente'
+        PROCESSING = 'processing', 'Processando'
+        DONE = 'done', 'Concluído'
+        FAILED = 'failed', 'Falhou (tentativas esgotadas)'
+
+    kind = models.CharField(max_length=50, help_text="Tipo da escrita (ver BitrixOutboxService.HANDLERS)")
+    payload = models.JSONField(default=dict, blank=True, encoder=DjangoJSONEncoder)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='bitrix_outbox')
+    reference = models.CharField(max_length=100, null=True, blank=True, db_index=True, help_text="Objeto local de origem (ex: transaction:<uuid>)")
+    dedupe_key = models.CharField(max_length=150, unique=True, null=True, blank=True, help_text="Evita enfileirar a mesma escrita duas vezes")
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.PENDING)
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(db_index=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+            models.Index(fields=['user', 'status']),
+        ]
+
+    def __str__(self):
+        return f"#{self.pk} {self.kind} ({self.reference or '-'}) [{self.status}]"
+
+
+class BitrixWebhookEvent(models.Model):
+    """
+    Webhook do Bitrix gravado na chegada (ack em milissegundos) e processado depois
+    por process_bitrix_webhooks, que agrupa rajadas da mesma entidade e descarta ecos das nossas escritas.
+    """
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'Pendente'
+        PROCESSED = 'processed', 'Processado'
+        COALESCED = 'coalesced', 'Agrupado (evento mais novo processado)'
+        ECHO = 'echo', 'Eco de escrita nossa'
+        FAILED = 'failed', 'Falhou'
+
+    event = models.CharField(max_length=60)
+    entity = models.CharField(max_length=60, null=True, blank=True, help_text="Ex: deal:123 (chave de agrupamento)")
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.PENDING)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True, default='')
+    # Falha transitória (breaker aberto, rede/5xx): continua PENDING e volta depois, com backoff
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'received_at']),
+            models.Index(fields=['entity', 'status']),
+        ]
+
+    def __str__(self):
+        return f"{self.event} {self.entity or '-'} [{self.status}]"
+
+
+class BitrixLocalWrite(models.Model):
+    """
+    Última escrita NOSSA em uma entidade do Bitrix (ex: deal:123), usada para reconhecer o webhook de eco.
+    Cada escrita descarta no máximo um webhook (pending_echoes): uma edição real logo depois ainda é processada.
+    """
+    entity = models.CharField(max_length=60, primary_key=True)
+    written_at = models.DateTimeField()
+    pending_echoes = models.PositiveIntegerField(default=1)
+
+    def __str__(self):
+        return f"{self.entity} @ {self.written_at:%Y-%m-%d %H:%M:%S}"
+
+
+class BitrixDeal(models.Model):
+    """
+    Espelho local dos Deals do Bitrix (cabeçalho) + produtos em BitrixDealRow.
+    Contato/Lead -> Deal atual = o de maior ID. Mantido pelos webhooks de Deal, pelas nossas
+    próprias escritas (prepare_deal_payment) e pelo job de sincronização; as leituras
+    (protocolo, plano, painel do médico) consultam só o Postgres.
+    Frescor: synced_at = última leitura/escrita confirmada no Bitrix; rows_synced_at = idem
+    para os produtos (None = produtos ainda não espelhados).
+    """
+    deal_id = models.BigIntegerField(unique=True)
+    contact_id = models.CharField(max_length=50, null=True, blank=True)
+    lead_id = models.CharField(max_length=50, null=True, blank=True)
+    stage_id = models.CharField(max_length=50, blank=True, default='')
+    closed = models.BooleanField(default=False)
+    payment_status = models.CharField(max_length=100, null=True, blank=True)
+    title = models.CharField(max_length=255, blank=True, default='')
+    opportunity = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+    date_modify = models.DateTimeField(null=True, blank=True)  # DATE_MODIFY do Bitrix
+    synced_at = models.DateTimeField(null=True, blank=True)
+    rows_synced_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['contact_id', '-deal_id']),
+            models.Index(fields=['lead_id', '-deal_id']),
+        ]
+
+    def __str__(self):
+        return f"Deal {self.deal_id} (Contato {self.contact_id or '-'}) [{self.stage_id or '?'}]"
+
+
+class BitrixDealRow(models.Model):
+    """Produto de um Deal espelhado (crm.deal.productrows.get). Substituído em bloco a cada sincronização."""
+    deal = models.ForeignKey(BitrixDeal, on_delete=models.CASCADE, related_name='rows')
+    product_id = models.IntegerField(null=True, blank=True)
+    product_name = models.CharField(max_length=255, blank=True, default='')
+    price = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    quantity = models.DecimalField(max_digits=10, decimal_places=2, default=1)
+    sort = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['sort', 'id']
+
+    def __str__(self):
+        return f"{self.product_name or self.product_id} (Deal {self.deal_id})"
+
+
+class BitrixSyncCursor(models.Model):
+    """
+    High-water mark da reconciliação incremental (comando bitrix_delta_sync), uma linha por entidade.
+    high_water = DATE_MODIFY a partir do qual a próxima execução lê. Execução em andamento
+    (run_last_id não nulo) guarda o progresso por página: depois de um crash, continua de onde parou.
+    """
+    class Entity(models.TextChoices):
+        DEAL = 'deal', 'Deal'
+        CONTACT = 'contact', 'Contato'
+        LEAD = 'lead', 'Lead'
+
+    entity = models.CharField(max_length=20, choices=Entity.choices, unique=True)
+    high_water = models.DateTimeField(null=True, blank=True)
+    run_since = models.DateTimeField(null=True, blank=True)
+    run_last_id = models.BigIntegerField(null=True, blank=True)
+    run_max_modified = models.DateTimeField(null=True, blank=True)
+    run_started_at = models.DateTimeField(null=True, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_completed_at = models.DateTimeField(null=True, blank=True)
+    last_stats = models.JSONField(default=dict, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.entity} > {self.high_water or 'início'}"
+
+
+class UserProfileSnapshot(models.Model):
+    """
+    Perfil pronto do usuário (resposta do GET /api/accounts/profile/), uma linha por usuário.
+    Reconstruído pelos eventos que mudam o perfil (ver ProfileSnapshotService); a leitura é um
+    SELECT por chave primária. bitrix_contact = último telefone/endereço lido do Contato no Bitrix.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='profile_snapshot')
+    data = models.JSONField(default=dict, blank=True, encoder=DjangoJSONEncoder)
+    bitrix_contact = models.JSONField(default=dict, blank=True)
+    bitrix_contact_synced_at = models.DateTimeField(null=True, blank=True)
+    version = models.PositiveIntegerField(default=0)
+    reason = models.CharField(max_length=50, blank=True, default='', help_text="Evento que gerou a última reconstrução")
+    built_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Perfil de {self.user_id} v{self.version} ({self.reason or '-'})"
@@ -0,0 +1,306 @@
+"""
+Read model do perfil (GET /api/accounts/profile/ — UserProfileView).
+
+O perfil era montado a cada miss do cache (5 min): sincronização do plano, crm.contact.get no Bitrix,
+equipe médica e três consultas de Transaction, no request. Agora cada usuário tem uma linha
+UserProfileSnapshot com o JSON pronto, reconstruída pelos eventos que mudam o perfil:
+  - pagamentos (webhook/consulta de status do Asaas, checkout, ativação da assinatura);
+  - plano (check_and_update_user_plan via espelho de Deals, upgrade/downgrade/cancelamento);
+  - edição de dados e endereço pelo usuário; atribuição e perfil (foto/bio) da equipe médica;
+  - Bitrix: webhooks ONCRMDEAL*/ONCRMCONTACTUPDATE, conversão de Lead e o bitrix_delta_sync.
+
+A reconstrução só lê o Postgres (espelho de Deals + o último Contato guardado na própria linha).
+Telefone/endereço do Contato chegam pelo job 'sync_profile_contact' do outbox e pelo delta sync:
+preenchem os campos vazios do usuário (auto-heal) e o país. O GET é um SELECT por chave primária;
+sem linha (usuário novo) monta na hora só com dados locais. Linha mais velha que
+PROFILE_SNAPSHOT_MAX_AGE_SECONDS é revalidada em background (espelho do Deal + Contato).
+"""
+
+import logging
+from datetime import timedelta
+from typing import Any, Dict, Iterable, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# payment_status do Deal que contam como pagamento em andamento no dashboard
+PENDING_PAYMENT_STATUSES = ('Pendente', 'Em análise', 'Em processo')
+
+
+class ProfileSnapshotService:
+    OUTBOX_KIND = 'sync_profile_contact'
+
+    @staticmethod
+    def _max_age_seconds() -> int:
+        return getattr(settings, 'PROFILE_SNAPSHOT_MAX_AGE_SECONDS', 3600)
+
+    # =========================================================================
+    # Leitura (request path)
+    # =========================================================================
+
+    @staticmethod
+    def get(user: Any) -> Dict[str, Any]:
+        from .models import UserProfileSnapshot
+        row = UserProfileSnapshot.objects.filter(pk=user.pk).values_list('data', 'built_at').first()
+        if row is None:
+            # Primeiro acesso: só dados locais; Deal e Contato do Bitrix chegam pelo outbox
+            data = ProfileSnapshotService.refresh(user, reason='miss') or ProfileSnapshotService.build(user)
+            ProfileSnapshotService.revalidate(user)
+            return data
+
+        data, built_at = row
+        if data.get('stale') or built_at < timezone.now() - timedelta(seconds=ProfileSnapshotService._max_age_seconds()):
+            ProfileSnapshotService.revalidate(user)
+        return data
+
+    @staticmethod
+    def revalidate(user: Any):
+        """Agenda a releitura do Deal e do Contato (no máximo uma vez por PROFILE_SNAPSHOT_MAX_AGE_SECONDS)."""
+        from .services import BitrixDealMirror
+        # Dedupe antes de ler id_bitrix: com ClaimsUser (authentication.py) o atributo carrega o User do banco
+        if not cache.add(f"profile_snapshot_revalidate_{user.pk}", 1, ProfileSnapshotService._max_age_seconds()):
+            return
+        if not getattr(user, 'id_bitrix', None):
+            return
+        BitrixDealMirror.request_sync(user)
+        ProfileSnapshotService.request_contact_sync(user)
+
+    # =========================================================================
+    # Escrita (eventos de domínio)
+    # =========================================================================
+
+    @staticmethod
+    def schedule(user_id: Any, reason: str):
+        """Reconstrói o perfil depois do commit corrente (fora de um atomic(), na hora)."""
+        if not user_id:
+            return
+        transaction.on_commit(lambda: ProfileSnapshotService.refresh(user_id, reason=reason))
+
+    @staticmethod
+    def schedule_many(user_ids: Iterable[Any], reason: str):
+        user_ids = [u for u in dict.fromkeys(user_ids) if u]
+        if user_ids:
+            transaction.on_commit(lambda: [ProfileSnapshotService.refresh(u, reason=reason) for u in user_ids])
+
+    @staticmethod
+    def refresh(user_or_id: Any, reason: str = '', contact: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """
+        Reconstrói e grava a linha do usuário (contact = Contato recém-lido do Bitrix, se houver).
+        Nunca levanta: perfil desatualizado não pode derrubar o evento que o disparou.
+        """
+        from .models import UserProfileSnapshot
+        user_id = getattr(user_or_id, 'pk', user_or_id)
+        try:
+            with transaction.atomic():
+                row, _ = UserProfileSnapshot.objects.select_for_update().get_or_create(user_id=user_id)
+                if contact is not None:
+                    row.bitrix_contact = contact
+                    row.bitrix_contact_synced_at = timezone.now()
+                row.data = ProfileSnapshotService.build(user_id, row.bitrix_contact)
+                row.version += 1
+                row.reason = reason[:50]
+                row.save()
+            return row.data
+        except Exception as e:
+            logger.warning(f"⚠️ Falha ao reconstruir perfil do usuário {user_id} ({reason}): {e}")
+            return None
+
+    # =========================================================================
+    # Montagem (só Postgres)
+    # =========================================================================
+
+    @staticmethod
+    def build(user_or_id: Any, contact: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        from apps.financial.models import Transaction
+        from .models import User, Patients
+        from .services import BitrixDealMirror
+
+        user = User.objects.select_related(
+            'patients__assigned_trichologist__user', 'patients__assigned_nutritionist__user'
+        ).get(pk=getattr(user_or_id, 'pk', user_or_id))
+        contact = contact or {}
+
+        # 1. Dados Básicos do Usuário (o Contato do Bitrix já preencheu os vazios, ver apply_contact)
+        profile_data = {
+            "name": user.full_name,
+            "email": user.email,
+            "role": user.role,
+            "plan": user.current_plan,
+            "phone": user.phone,
+            "date_of_birth": user.date_of_birth,
+            "address": {
+                "street": user.street,
+                "number": user.number,
+                "city": user.city,
+                "state": user.state,
+                "zip": user.cep,
+                "neighborhood": user.neighborhood,
+                "complement": user.complement,
+                "country": (contact.get('address') or {}).get('country', 'Brasil'),
+            }
+        }
+
+        # 2. Deal atual do espelho (sem chamada ao Bitrix)
+        deal = BitrixDealMirror.current_for_contact(user.id_bitrix) if user.id_bitrix else None
+        if user.id_bitrix:
+            freshness = BitrixDealMirror.freshness(deal)
+            profile_data['bitrix_synced_at'] = freshness['synced_at']
+            if freshness['stale']:
+                profile_data['stale'] = True
+
+        # 3. Equipe Médica (Tricologista + Nutricionista)
+        medical_team = {"trichologist": None, "nutritionist": None}
+        try:
+            patient = user.patients
+        except Patients.DoesNotExist:
+            patient = None
+        if patient:
+            for key, doc in (("trichologist", patient.assigned_trichologist), ("nutritionist", patient.assigned_nutritionist)):
+                if doc:
+                    medical_team[key] = {
+                        "name": doc.user.full_name,
+                        "crm": doc.crm,
+                        "photo": doc.profile_photo.url if doc.profile_photo else None,
+                        "id": str(doc.user.id),
+                        "description": doc.bio
+                    }
+        profile_data['medical_team'] = medical_team
+
+        # 4. Payment Info (último cartão aprovado)
+        last_cc_tx = Transaction.objects.filter(
+            user=user,
+            payment_type=Transaction.PaymentType.CREDIT_CARD,
+            status=Transaction.Status.APPROVED
+        ).order_by('-created_at').first()
+
+        payment_info = {"has_card": False, "cardName": "", "cardNumber": "", "brand": "", "expiry": ""}
+        if last_cc_tx and last_cc_tx.mp_metadata:
+            # Resposta do Asaas (assinatura e pagamento) guardada em payment_response
+            cc_data = last_cc_tx.mp_metadata.get('payment_response', {}).get('creditCard')
+            if cc_data:
+                payment_info = {
+                    "has_card": True,
+                    "cardName": "Cartão Salvo",
+                    "cardNumber": f"**** **** **** {cc_data.get('creditCardNumber', '****')}",
+                    "brand": cc_data.get('creditCardBrand', 'Desconhecido'),
+                    "expiry": "**/**"  # Asaas mascara a validade
+                }
+        profile_data['payment_info'] = payment_info
+
+        # 5. Plan Info (ciclo/preço da última transação aprovada)
+        plan_name = user.current_plan.capitalize() if user.current_plan else "Nenhum"
+        last_success_tx = Transaction.objects.filter(
+            user=user,
+            status=Transaction.Status.APPROVED
+        ).order_by('-created_at').first()
+
+        plan_info = {
+            "name": f"Plano {plan_name}",
+            "cycle": last_success_tx.get_cycle_display() if last_success_tx else "Mensal",
+            "price": f"R$ {last_success_tx.paid_amount}" if last_success_tx else "-",
+            "status": "Ativo",
+            "subscription_status": getattr(user, 'subscription_status', 'active'),
+            "access_until": user.access_valid_until.strftime("%d/%m/%Y") if user.access_valid_until else None,
+            "is_subscription": last_success_tx.asaas_subscription_id is not None if last_success_tx else False,
+            "scheduled_plan": getattr(user, 'scheduled_plan', None),
+            "scheduled_date": user.scheduled_transition_date.strftime("%d/%m/%Y") if getattr(user, 'scheduled_transition_date', None) else None
+        }
+        if user.subscription_status == 'grace_period':
+            plan_info['status'] = 'Cancelamento Agendado'
+            plan_info['warning'] = f"Seu acesso encerra em {plan_info['access_until']}"
+        profile_data['plan_info'] = plan_info
+
+        # 6. Pagamento pendente (transação local ou status do Deal)
+        pending_tx = Transaction.objects.filter(
+            user=user,
+            status=Transaction.Status.PENDING
+        ).order_by('-created_at').first()
+
+        bitrix_payment_status = 'Unknown'
+        if deal:
+            # Mesmo critério do check_and_update_user_plan: Deal sem status e usuário sem plano = Pendente
+            bitrix_payment_status = deal.payment_status or ('Pendente' if user.current_plan == 'none' else 'Unknown')
+
+        if pending_tx or bitrix_payment_status in PENDING_PAYMENT_STATUSES:
+            profile_data['pending_transaction'] = {
+                'exists': True,
+                'order_id': pending_tx.external_reference if pending_tx else None,
+                'payment_method': pending_tx.payment_type if pending_tx else 'pix',  # Default Pix se não achar
+                'bitrix_status': bitrix_payment_status
+            }
+        else:
+            profile_data['pending_transaction'] = {'exists': False}
+
+        return profile_data
+
+    # =========================================================================
+    # Contato do Bitrix (fora do request)
+    # =========================================================================
+
+    @staticmethod
+    def request_contact_sync(user: Any) -> Optional[Any]:
+        """Agenda (outbox) a releitura do Contato do usuário; não duplica se já houver uma na fila."""
+        from .models import User
+        from .services import BitrixOutboxService
+        if not getattr(user, 'pk', None) or not getattr(user, 'id_bitrix', None):
+            return None
+        if getattr(user, 'bitrix_entity_type', None) == User.BitrixEntityType.LEAD:
+            return None  # id_bitrix ainda aponta para um Lead: não há Contato para ler
+        reference = f"profile_contact:user:{user.pk}"
+        try:
+            if BitrixOutboxService.has_active(reference):
+                return None
+            return BitrixOutboxService.enqueue(ProfileSnapshotService.OUTBOX_KIND, {"user_id": user.pk}, user=user, reference=reference)
+        except Exception as e:
+            logger.warning(f"⚠️ Falha ao agendar leitura do Contato de {getattr(user, 'email', user.pk)}: {e}")
+            return None
+
+    @staticmethod
+    def handle_outbox(event: Any):
+        """Handler do outbox: crm.contact.get e reconstrução do perfil (Bitrix fora = nova tentativa)."""
+        from .models import User
+        from .services import BitrixService
+        user = event.user or User.objects.filter(pk=(event.payload or {}).get('user_id')).first()
+        if not user or not user.id_bitrix:
+            return
+        contact = BitrixService.fetch_contact_data(user.id_bitrix)
+        if contact is None:
+            raise RuntimeError(f"Contato {user.id_bitrix} indisponível no Bitrix")
+        ProfileSnapshotService.apply_contact(user, contact, reason='bitrix_contact')
+
+    @staticmethod
+    def apply_contacts(contacts: Iterable[Dict[str, Any]], reason: str = 'bitrix_contact') -> int:
+        """Itens de crm.contact.list (delta sync) -> usuários vinculados. Retorna perfis reconstruídos."""
+        from .models import User
+        from .services import BitrixService
+        parsed = {str(c["ID"]): BitrixService.parse_contact(c) for c in contacts if c.get("ID")}
+        applied = 0
+        for user in User.objects.filter(id_bitrix__in=list(parsed)):
+            applied += ProfileSnapshotService.apply_contact(user, parsed[user.id_bitrix], reason=reason) is not None
+        return applied
+
+    @staticmethod
+    def apply_contact(user: Any, contact: Dict[str, Any], reason: str = 'bitrix_contact') -> Optional[Dict[str, Any]]:
+        # [AUTO-HEAL] Se o banco local estiver vazio, traz do Bitrix (o que o usuário editou prevalece)
+        updated = []
+        if not user.phone and contact.get('phone'):
+            user.phone = contact['phone']
+            updated.append('phone')
+
+        bx_addr = contact.get('address') or {}
+        if not user.street and bx_addr.get('street'):
+            user.street = bx_addr.get('street')
+            user.city = bx_addr.get('city')
+            user.state = bx_addr.get('state')
+            user.cep = bx_addr.get('zip')
+            user.neighborhood = bx_addr.get('neighborhood')
+            updated += ['street', 'city', 'state', 'cep', 'neighborhood']
+
+        if updated:
+            user.save(update_fields=updated)
+            logger.info(f"🔧 Auto-healing: Dados de Contato recuperados do Bitrix p/ {user.email}")
+        return ProfileSnapshotService.refresh(user, reason=reason, contact=contact)
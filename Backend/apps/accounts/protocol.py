@@ -0,0 +1,158 @@
+"""
+Motor do protocolo recomendado (usado por BitrixService.generate_protocol).
+
+- ProtocolMatcherIndex: resolve papel -> produto (BitrixConfig.PROTOCOL_MATCHERS) uma única vez
+  por versão do catálogo, em vez de varrer o catálogo inteiro a cada papel em cada chamada.
+- ProtocolEngine: memoiza o resultado por (versão do catálogo, hash das respostas normalizadas).
+  Mudou o catálogo (nova versão) -> índice e memo são descartados automaticamente.
+
+A versão do catálogo é um fingerprint do conteúdo (catalog_fingerprint), gravado no cache
+junto com o catálogo por BitrixService.get_product_catalog.
+"""
+
+import copy
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from .config import BitrixConfig
+
+
+def catalog_fingerprint(catalog: List[Dict[str, Any]]) -> str:
+    """Versão do catálogo: muda se qualquer campo usado pelo protocolo mudar."""
+    digest = hashlib.sha1()
+    for p in catalog:
+        digest.update(json.dumps(
+            [p.get("id"), p.get("name"), p.get("price"), p.get("category_id"), p.get("image_url"), p.get("description")],
+            ensure_ascii=False, default=str,
+        ).encode())
+    return digest.hexdigest()[:16]
+
+
+class ProtocolMatcherIndex:
+    """Papel -> produto do catálogo, pré-calculado para uma versão."""
+
+    def __init__(self, catalog: List[Dict[str, Any]], version: str):
+        self.version = version
+        self.by_role = {role: self._match(catalog, role, keywords) for role, keywords in BitrixConfig.PROTOCOL_MATCHERS.items()}
+
+    @staticmethod
+    def _match(catalog: List[Dict[str, Any]], role_key: str, keywords: List[str]) -> Optional[Dict[str, Any]]:
+        # Mesmas regras da busca linear original (primeiro produto que casa, na ordem do catálogo)
+        keywords = [k.lower() for k in keywords]
+        for p in catalog:
+            name = p.get("name", "").lower()
+            cat_id = str(p.get("category_id"))
+            if "topico" in role_key and cat_id != BitrixConfig.TOPICAL_SECTION_ID: continue
+            if all(k in name for k in keywords):
+                if "oral" in role_key and "topico" in name: continue
+                return p
+        return None
+
+    def find(self, role_key: str) -> Optional[Dict[str, Any]]:
+        return self.by_role.get(role_key)
+
+
+class ProtocolEngine:
+    MEMO_SIZE = 2048
+
+    _lock = threading.Lock()
+    _index: Optional[ProtocolMatcherIndex] = None
+    _memo: "OrderedDict[Tuple[str, str], Dict[str, Any]]" = OrderedDict()
+
+    @staticmethod
+    def normalize_answers(answers: Dict[str, Any]) -> Tuple:
+        """Só as respostas que influenciam o protocolo, já no formato que as regras usam."""
+        return (
+            answers.get("F1_Q1_gender", "masculino"),
+            str(answers.get("F2_Q14_health_cond", "")).lower(),
+            str(answers.get("F2_Q15_allergy", "")).lower(),
+            answers.get("F2_Q18_pets") == "sim",
+            str(answers.get("F2_Q8_symptom", "")).lower(),
+        )
+
+    @classmethod
+    def answers_hash(cls, answers: Dict[str, Any]) -> str:
+        normalized = json.dumps(cls.normalize_answers(answers), ensure_ascii=False, default=str)
+        return hashlib.sha1(normalized.encode()).hexdigest()
+
+    @classmethod
+    def lookup(cls, version: str, answers: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Resultado memoizado (cópia) ou None."""
+        key = (version, cls.answers_hash(answers))
+        with cls._lock:
+            result = cls._memo.get(key)
+            if result is None:
+                return None
+            cls._memo.move_to_end(key)
+        return copy.deepcopy(result)
+
+    @classmethod
+    def _index_for(cls, catalog: List[Dict[str, Any]], version: str) -> ProtocolMatcherIndex:
+        with cls._lock:
+            index = cls._index
+            if index is not None and index.version == version:
+                return index
+        index = ProtocolMatcherIndex(catalog, version)
+        with cls._lock:
+            if cls._index is None or cls._index.version != version:
+                # Catálogo novo: descarta memo da versão anterior
+                cls._index = index
+                cls._memo.clear()
+            return cls._index
+
+    @staticmethod
+    def select_roles(answers: Dict[str, Any]) -> List[str]:
+        """Lógica de Recomendação (Mantida)"""
+        gender, health, alrg, pets, symptom = ProtocolEngine.normalize_answers(answers)
+
+        block_horm = (gender == "feminino" or "cancer" in health or "hepatica" in health or "finasterida" in alrg)
+        block_minox_or = ("cardiaca" in health or "renal" in health or "minoxidil" in alrg)
+        block_minox_top = (pets or "psoriase" in symptom or "cardiaca" in health)
+
+        selected = []
+        oral = "minoxidil_oral" if gender == "feminino" else ("finasterida_oral" if not block_horm else ("minoxidil_oral" if not block_minox_or else "saw_palmetto_oral"))
+        if oral and not (oral == "minoxidil_oral" and block_minox_or): selected.append(oral)
+
+        topical = "minoxidil_topico" if not block_minox_top else None
+        if not topical and gender == "masculino" and not block_horm: topical = "finasterida_topica"
+        if topical: selected.append(topical)
+
+        selected.extend(["shampoo", "biotina"])
+        return selected
+
+    @classmethod
+    def generate(cls, answers: Dict[str, Any], catalog: List[Dict[str, Any]], version: str) -> Dict[str, Any]:
+        cached = cls.lookup(version, answers)
+        if cached is not None:
+            return cached
+
+        index = cls._index_for(catalog, version)
+        final_products = []
+        total = 0.0
+
+        for role in cls.select_roles(answers):
+            p = index.find(role)
+            if p:
+                price = p["price"]
+                total += price
+                final_products.append({
+                    "id": p["id"],
+                    "name": p["name"],
+                    "price": price,
+                    "sub": "Protocolo Personalizado",
+                    "img": p["image_url"],
+                    "description": p["description"]
+                })
+
+        result = {"redFlag": False, "title": "Seu Protocolo Exclusivo", "description": "Baseado na sua triagem.", "products": final_products, "total_price": round(total, 2)}
+
+        key = (index.version, cls.answers_hash(answers))
+        with cls._lock:
+            cls._memo[key] = result
+            cls._memo.move_to_end(key)
+            while len(cls._memo) > cls.MEMO_SIZE:
+                cls._memo.popitem(last=False)
+        return copy.deepcopy(result)
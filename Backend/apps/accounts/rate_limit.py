@@ -0,0 +1,225 @@
+"""
+Rate limiter (token-bucket) compartilhado para chamadas ao Bitrix.
+
+O Bitrix limita por webhook (~2 req/s com burst de 50) e todos os workers do gunicorn
+e crons usam o mesmo webhook. Cada chamada do BitrixService retira um token do bucket
+antes de sair; sem token, espera o refill em vez de tomar 429.
+
+Backends:
+    - 'db'    (padrão): linha em BitrixRateLimitBucket, atualizada com um único UPDATE atômico
+                        numa conexão própria em autocommit (não segura lock dentro de atomic()).
+    - 'local': bucket em memória do processo (dev/testes).
+
+Lanes de prioridade:
+    - 'interactive' (padrão): checkout, perfil, login. Pode usar o bucket inteiro.
+    - 'batch': crons/comandos. Só consome acima de BITRIX_RATE_LIMIT_INTERACTIVE_RESERVE,
+               deixando essa reserva sempre disponível para usuários.
+
+    with bitrix_lane('batch'):
+        ...  # Todas as chamadas ao Bitrix aqui dentro entram na lane de batch
+"""
+
+import os
+import time
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Optional, Tuple
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+LANE_INTERACTIVE = 'interactive'
+LANE_BATCH = 'batch'
+
+_current_lane = contextvars.ContextVar('bitrix_lane', default=LANE_INTERACTIVE)
+
+
+@contextmanager
+def bitrix_lane(lane: str):
+    """Define a lane de prioridade das chamadas ao Bitrix feitas dentro do bloco."""
+    token = _current_lane.set(lane)
+    try:
+        yield
+    finally:
+        _current_lane.reset(token)
+
+
+def current_lane() -> str:
+    return _current_lane.get()
+
+
+class LocalTokenBucket:
+    """Bucket em memória (por processo). Stand-in do backend compartilhado."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = {}
+
+    def try_acquire(self, name: str, capacity: float, rate: float, floor: float) -> Tuple[bool, float]:
+        now = time.time()
+        with self._lock:
+            tokens, updated_at = self._state.get(name, (capacity, now))
+            tokens = min(capacity, tokens + max(now - updated_at, 0) * rate)
+            if tokens >= 1 + floor:
+                self._state[name] = (tokens - 1, now)
+                return True, tokens - 1
+            self._state[name] = (tokens, now)
+            return False, tokens
+
+    def drain(self, name: str):
+        with self._lock:
+            self._state[name] = (0.0, time.time())
+
+
+class DatabaseTokenBucket:
+    """
+    Bucket numa linha do banco. Refill + consumo num único UPDATE ... RETURNING,
+    então workers concorrentes nunca gastam o mesmo token.
+    """
+
+    _local = threading.local()
+
+    @property
+    def table(self) -> str:
+        from .models import BitrixRateLimitBucket
+        return BitrixRateLimitBucket._meta.db_table
+
+    def _connection(self):
+        """Conexão dedicada (autocommit) por thread/processo, fora de qualquer atomic() do request."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = connections.create_connection('default')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+            self._local.ready = set()
+        return conn
+
+    def _ensure_row(self, conn, name: str, capacity: float):
+        if name in self._local.ready:
+            return
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {self.table} (name, tokens, updated_at) VALUES (%s, %s, %s) "
+                f"ON CONFLICT (name) DO NOTHING",
+                [name, capacity, time.time()],
+            )
+        self._local.ready.add(name)
+
+    def try_acquire(self, name: str, capacity: float, rate: float, floor: float) -> Tuple[bool, float]:
+        conn = self._connection()
+        try:
+            self._ensure_row(conn, name, capacity)
+            now = time.time()
+            refilled = (
+                "CASE WHEN tokens + (CASE WHEN %(now)s > updated_at THEN %(now)s - updated_at ELSE 0 END) * %(rate)s > %(cap)s "
+                "THEN %(cap)s "
+                "ELSE tokens + (CASE WHEN %(now)s > updated_at THEN %(now)s - updated_at ELSE 0 END) * %(rate)s END"
+            )
+            params = {"now": now, "rate": rate, "cap": capacity, "need": 1 + floor, "name": name}
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    f"UPDATE {self.table} SET tokens = {refilled} - 1, "
+                    f"updated_at = CASE WHEN %(now)s > updated_at THEN %(now)s ELSE updated_at END "
+                    f"WHERE name = %(name)s AND {refilled} >= %(need)s RETURNING tokens",
+                    params,
+                )
+                row = cursor.fetchone()
+                if row:
+                    return True, row[0]
+                cursor.execute(f"SELECT tokens, updated_at FROM {self.table} WHERE name = %s", [name])
+                row = cursor.fetchone()
+            if not row:
+                return False, 0.0
+            tokens, updated_at = row
+            return False, min(capacity, tokens + max(now - updated_at, 0) * rate)
+        except Exception:
+            # Conexão quebrada: descarta para reabrir na próxima chamada
+            try:
+                conn.close()
+            finally:
+                self._local.conn = None
+            raise
+
+    def drain(self, name: str):
+        conn = self._connection()
+        with conn.cursor() as cursor:
+            cursor.execute(f"UPDATE {self.table} SET tokens = 0, updated_at = %s WHERE name = %s", [time.time(), name])
+
+
+class BitrixRateLimiter:
+    """Ponto único de consumo de tokens antes de qualquer chamada ao Bitrix."""
+
+    BUCKET = 'bitrix'
+    _backends = {}
+    _fallback = LocalTokenBucket()
+
+    @classmethod
+    def _config(cls):
+        return {
+            "enabled": getattr(settings, 'BITRIX_RATE_LIMIT_ENABLED', True),
+            "backend": getattr(settings, 'BITRIX_RATE_LIMIT_BACKEND', 'db'),
+            "rate": float(getattr(settings, 'BITRIX_RATE_LIMIT_PER_SECOND', 2)),
+            "capacity": float(getattr(settings, 'BITRIX_RATE_LIMIT_BURST', 50)),
+            "reserve": float(getattr(settings, 'BITRIX_RATE_LIMIT_INTERACTIVE_RESERVE', 10)),
+            "max_wait": {
+                LANE_INTERACTIVE: float(getattr(settings, 'BITRIX_RATE_LIMIT_INTERACTIVE_MAX_WAIT', 10)),
+                LANE_BATCH: float(getattr(settings, 'BITRIX_RATE_LIMIT_BATCH_MAX_WAIT', 300)),
+            },
+        }
+
+    @classmethod
+    def _backend(cls, name: str):
+        if name not in cls._backends:
+            cls._backends[name] = DatabaseTokenBucket() if name == 'db' else LocalTokenBucket()
+        return cls._backends[name]
+
+    @classmethod
+    def _try_acquire(cls, cfg, floor: float) -> Tuple[bool, float]:
+        try:
+            return cls._backend(cfg["backend"]).try_acquire(cls.BUCKET, cfg["capacity"], cfg["rate"], floor)
+        except Exception as e:
+            # Banco indisponível não pode derrubar a integração: cai para o bucket local
+            logger.warning(f"⚠️ Rate limiter compartilhado indisponível ({e}). Usando bucket local.")
+            return cls._fallback.try_acquire(cls.BUCKET, cfg["capacity"], cfg["rate"], floor)
+
+    @classmethod
+    def acquire(cls, lane: Optional[str] = None) -> float:
+        """
+        Bloqueia até conseguir um token (ou estourar o max_wait da lane).
+        Retorna o tempo esperado em segundos. Estourado o limite, segue em frente
+        (fail-open) e deixa o backoff do Tenacity lidar com um eventual 429.
+        """
+        cfg = cls._config()
+        if not cfg["enabled"]:
+            return 0.0
+
+        lane = lane or current_lane()
+        floor = cfg["reserve"] if lane == LANE_BATCH else 0.0
+        deadline = time.monotonic() + cfg["max_wait"].get(lane, cfg["max_wait"][LANE_INTERACTIVE])
+        start = time.monotonic()
+
+        while True:
+            ok, tokens = cls._try_acquire(cfg, floor)
+            if ok:
+                return time.monotonic() - start
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                logger.warning(f"⏳ Rate limit Bitrix: lane '{lane}' esperou além do limite. Seguindo sem token.")
+                return time.monotonic() - start
+            missing = (1 + floor) - tokens
+            time.sleep(min(max(missing / cfg["rate"], 0.05), remaining, 1.0))
+
+    @classmethod
+    def penalize(cls):
+        """Recebemos 429: zera o bucket para todos os processos desacelerarem juntos."""
+        cfg = cls._config()
+        if not cfg["enabled"]:
+            return
+        try:
+            cls._backend(cfg["backend"]).drain(cls.BUCKET)
+        except Exception as e:
+            logger.warning(f"⚠️ Falha ao zerar rate limiter após 429: {e}")
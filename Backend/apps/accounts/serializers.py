@@ -2,7 +2,7 @@ from rest_framework import serializers
 from .models import User, UserQuestionnaire
 from django.db import transaction
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
-from .services import BitrixService
+from .services import LeadConversionService
 import logging
 
 logger = logging.getLogger(__name__)
@@ -16,21 +16,20 @@ class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
         token['role'] = user.role
         token['email'] = user.email
         token['current_plan'] = user.current_plan
+        token['auth_version'] = user.auth_version # Claims acima confiáveis enquanto a versão não mudar (authentication.py)
         return token
 
     def validate(self, attrs):
         data = super().validate(attrs)
         
-        # [NOVO] Sincronizar plano com Bitrix no login
+        # Login usa só o plano local. A sincronização com o Bitrix (e o aquecimento dos caches
+        # do dashboard) roda em background depois que o token é emitido.
         try:
-            from apps.accounts.services import BitrixService
-            # Chama o serviço para atualizar o user.current_plan se necessário
-            new_plan = BitrixService.check_and_update_user_plan(self.user)
-            # Atualiza o dado retornado na resposta para refletir a mudança imediata
-            self.user.refresh_from_db()
+            from apps.accounts.warmup import schedule_session_warmup
+            schedule_session_warmup(self.user)
         except Exception as e:
-            # Não bloquear login se falhar sync
-            logger.warning(f"Erro sync Bitrix login: {e}")
+            # Não bloquear login se falhar o agendamento
+            logger.warning(f"Erro agendando sync Bitrix pós-login: {e}")
 
         data['user'] = {
             'id': self.user.id,
@@ -52,11 +51,12 @@ class RegisterSerializer(serializers.ModelSerializer):
     date_of_birth = serializers.DateField(required=True, input_formats=['%Y-%m-%d', '%d/%m/%Y'])
     # Isso impede o erro 400 se o dado não vier.
     questionnaire_data = serializers.JSONField(write_only=True, required=False, allow_null=True)
+    address_data = serializers.JSONField(write_only=True, required=False, allow_null=True)
     password = serializers.CharField(write_only=True, min_length=8)
 
     class Meta:
         model = User
-        fields = ['email', 'full_name', 'phone', 'date_of_birth', 'password', 'questionnaire_data']
+        fields = ['email', 'full_name', 'phone', 'date_of_birth', 'password', 'questionnaire_data', 'address_data']
 
     def validate_email(self, value):
         if User.objects.filter(email=value).exists():
@@ -66,6 +66,7 @@ class RegisterSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         # ALTERAÇÃO 2: Usamos .pop(..., None) para não quebrar se não tiver dados
         questionnaire_answers = validated_data.pop('questionnaire_data', None)
+        address_data = validated_data.pop('address_data', None)
         password = validated_data.pop('password')
         email = validated_data['email']
         
@@ -80,7 +81,6 @@ class RegisterSerializer(serializers.ModelSerializer):
                 role='patient'
             )
             
-            # Só tentamos salvar o questionário e mandar pro Bitrix SE houver respostas
             if questionnaire_answers:
                 # 2. Salva o Primeiro Questionário
                 UserQuestionnaire.objects.create(
@@ -88,25 +88,12 @@ class RegisterSerializer(serializers.ModelSerializer):
                     answers=questionnaire_answers,
                     is_latest=True
                 )
-                
-                # 3. Integração Bitrix (Sua lógica original preservada)
-                logger.info(f"🔄 Tentando registrar no Bitrix para o user ID: {user.id}")
-                
-                try:
-                    bitrix_id = BitrixService.create_lead(user, questionnaire_answers)
-                    
-                    if bitrix_id:
-                        user.id_bitrix = str(bitrix_id)
-                        user.save(update_fields=['id_bitrix'])
-                        logger.info(f"✅ SUCESSO: Local ID {user.id} vinculado ao Bitrix ID {user.id_bitrix}")
-                    else:
-                        logger.warning("⚠️ ATENÇÃO: Usuário criado localmente, mas falha ao obter ID do Bitrix.")
-                except Exception as e:
-                    logger.warning(f"⚠️ Erro não fatal na integração com Bitrix: {e}")
-            
             else:
-                # Caso opcional: Se quiser criar Lead no Bitrix apenas com Nome/Email mesmo sem respostas
-                # você pode colocar uma lógica aqui. Por enquanto, deixei passando direto para não dar erro.
                 logger.info(f"ℹ️ Usuário {user.id} criado sem dados de questionário inicial.")
-            
+
+            # 3. Lead no Bitrix: um job idempotente no outbox, gravado junto com o usuário.
+            # O cadastro não espera o Bitrix (busca Contato/Lead + criação rodam no bitrix-worker).
+            LeadConversionService.request_provisioning(user, questionnaire_answers, address_data)
+            logger.info(f"📮 Lead do user ID {user.id} agendado para o Bitrix")
+
         return user
\ No newline at end of file
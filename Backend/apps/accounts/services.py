@@ -4,13 +4,152 @@ import requests
 import json
 import time
 import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
 from typing import Optional, Dict, List, Any
+from django.conf import settings
 from django.core.cache import cache
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
+from config.cache import invalidate_tag
+from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type, RetryError
 from .config import BitrixConfig
+from .http_pool import get_pool
+from .rate_limit import BitrixRateLimiter
+from .circuit_breaker import get_breaker, mark_stale, CircuitOpenError
+from .cache_utils import singleflight
+from .metrics import record_call, record_retry, record_batch
 
 logger = logging.getLogger(__name__)
 
+
+class BitrixCommandError(Exception):
+    """Comando de um batch recusado pelo Bitrix por outro motivo que não "não encontrado" (cota, permissão, erro interno)."""
+
+    def __init__(self, errors: Dict[str, Any]):
+        self.errors = errors
+        super().__init__(f"Bitrix recusou {len(errors)} comando(s): {errors}")
+
+
+# Bitrix fora/instável (breaker aberto, rede, 5xx/429 após os retries do _safe_request, comando recusado no
+# batch por cota/erro interno): vale tentar de novo depois.
+# Handlers de webhook deixam estes erros subirem em vez de engolir e devolver False.
+TRANSIENT_ERRORS = (CircuitOpenError, requests.exceptions.RequestException, RetryError, BitrixCommandError)
+
+# Prefetch de páginas dos *.list (BitrixService.iter_list_pages): uma thread por processo
+_list_prefetch_executor = None
+_list_prefetch_pid = None
+_list_prefetch_lock = threading.Lock()
+
+
+def _count_bitrix_retry(retry_state):
+    """before_sleep do tenacity: conta a nova tentativa no endpoint (args = method, endpoint)."""
+    args = retry_state.args
+    record_retry('bitrix', args[1] if len(args) > 1 else retry_state.kwargs.get('endpoint', '?'))
+
+
+class BitrixBatch:
+    """
+    Agrupa vários métodos REST numa única chamada `batch.json` do Bitrix (máx. 50 por chamada).
+
+    Comandos podem referenciar o resultado de um comando anterior do mesmo lote:
+        batch.add('deals', 'crm.deal.list', {"filter": {"CONTACT_ID": 10}, "order": {"ID": "DESC"}})
+        batch.add('rows', 'crm.deal.productrows.get', {"id": BitrixBatch.ref('deals', 0, 'ID')})
+        batch.execute()
+        batch.get('rows')
+
+    Referências só resolvem dentro do mesmo bloco de 50 comandos.
+    Se o comando referenciado falhar/vier vazio, o Bitrix substitui por vazio: trate o
+    resultado dependente como inválido nesse caso.
+    """
+    MAX_COMMANDS = 50
+
+    def __init__(self, halt: bool = False):
+        self.halt = halt
+        self._commands: Dict[str, str] = {}
+        self.results: Dict[str, Any] = {}
+        self.errors: Dict[str, Any] = {}
+        self.totals: Dict[str, Any] = {}
+
+    @staticmethod
+    def ref(name: str, *path: Any) -> str:
+        """Referência ao resultado de outro comando: ref('deals', 0, 'ID') -> $result[deals][0][ID]"""
+        return f"$result[{name}]" + "".join(f"[{p}]" for p in path)
+
+    @staticmethod
+    def build_query(params: Optional[Dict[str, Any]]) -> str:
+        """Serializa params no formato do http_build_query do PHP (filter[X]=1&rows[0][PRICE]=2)."""
+        pairs = []
+
+        def _walk(prefix: str, value: Any):
+            if isinstance(value, dict):
+                for k, v in value.items():
+                    _walk(f"{prefix}[{k}]" if prefix else str(k), v)
+            elif isinstance(value, (list, tuple)):
+                if prefix.endswith('[]'):
+                    # Chaves no estilo "select[]" já usadas nos params do serviço
+                    for v in value:
+                        pairs.append((prefix, "" if v is None else str(v)))
+                else:
+                    for i, v in enumerate(value):
+                        _walk(f"{prefix}[{i}]", v)
+            elif isinstance(value, bool):
+                pairs.append((prefix, "Y" if value else "N"))
+            else:
+                pairs.append((prefix, "" if value is None else str(value)))
+
+        _walk("", params or {})
+        return urlencode(pairs)
+
+    def add(self, name: str, method: str, params: Optional[Dict[str, Any]] = None) -> 'BitrixBatch':
+        self._commands[name] = f"{method}?{self.build_query(params)}"
+        return self
+
+    def __len__(self):
+        return len(self._commands)
+
+    def execute(self, silent: bool = False, expect_errors: bool = False) -> 'BitrixBatch':
+        """
+        Executa os comandos em blocos de MAX_COMMANDS.
+        Exceções de rede propagam (mesma semântica do _safe_request).
+        param expect_errors: Não loga erros por comando (probes, referências a listas vazias).
+        """
+        names = list(self._commands.keys())
+        for start in range(0, len(names), self.MAX_COMMANDS):
+            chunk = {n: self._commands[n] for n in names[start:start + self.MAX_COMMANDS]}
+            record_batch('bitrix', [cmd.partition('?')[0] for cmd in chunk.values()])
+            resp = BitrixService._safe_request('POST', 'batch.json', silent=silent, json={
+                "halt": 1 if self.halt else 0,
+                "cmd": chunk,
+            })
+            payload = (resp or {}).get('result') or {}
+            # O PHP serializa dicionários vazios como lista
+            results = payload.get('result') or {}
+            errors = payload.get('result_error') or {}
+            totals = payload.get('result_total') or {}
+            if isinstance(results, dict): self.results.update(results)
+            if isinstance(errors, dict): self.errors.update(errors)
+            if isinstance(totals, dict): self.totals.update(totals)
+
+            if errors and not (silent or expect_errors):
+                logger.warning(f"⚠️ Bitrix batch com erros: {errors}")
+        return self
+
+    def get(self, name: str, default: Any = None) -> Any:
+        value = self.results.get(name)
+        return default if value is None else value
+
+    def failed(self, name: str) -> bool:
+        return name in self.errors or name not in self.results
+
+    def not_found(self, name: str) -> bool:
+        """Erro do comando é "entidade não existe" (o *.get de um ID removido), e não cota/permissão/erro interno."""
+        error = self.errors.get(name)
+        if not isinstance(error, dict):
+            return False
+        return error.get('error') == 'NOT_FOUND' or str(error.get('error_description') or '').strip().lower() == 'not found'
+
+
 class BitrixService:
     @staticmethod
     def _get_base_url() -> str:
@@ -22,6 +161,68 @@ class BitrixService:
             base_url += '/'
         return base_url
 
+    @staticmethod
+    def _http_pool():
+        """Sessão keep-alive do processo atual para o Bitrix (ver http_pool.py)."""
+        return get_pool(
+            'bitrix',
+            pool_size=getattr(settings, 'BITRIX_HTTP_POOL_SIZE', 10),
+            block=getattr(settings, 'BITRIX_HTTP_POOL_BLOCK', False),
+        )
+
+    @staticmethod
+    def warm_up_connections() -> int:
+        """
+        Abre as conexões do pool no boot do worker (chamado pelo gunicorn.conf.py),
+        para que a primeira requisição de usuário não pague DNS + TCP + TLS.
+        """
+        base_url = BitrixService._get_base_url()
+        if not base_url:
+            return 0
+        opened = BitrixService._http_pool().warm_up(
+            f"{base_url}server.time.json",
+            connections=getattr(settings, 'BITRIX_HTTP_WARMUP_CONNECTIONS', 1),
+        )
+        logger.info(f"🔌 Pool Bitrix aquecido: {opened} conexão(ões) pronta(s).")
+        return opened
+
+    @staticmethod
+    def _breaker():
+        return get_breaker(
+            'bitrix',
+            window=getattr(settings, 'BITRIX_BREAKER_WINDOW', 20),
+            min_calls=getattr(settings, 'BITRIX_BREAKER_MIN_CALLS', 5),
+            error_threshold=getattr(settings, 'BITRIX_BREAKER_ERROR_THRESHOLD', 0.5),
+            slow_call_seconds=getattr(settings, 'BITRIX_BREAKER_SLOW_CALL_SECONDS', 5.0),
+            slow_call_threshold=getattr(settings, 'BITRIX_BREAKER_SLOW_CALL_THRESHOLD', 0.5),
+            open_seconds=getattr(settings, 'BITRIX_BREAKER_OPEN_SECONDS', 30.0),
+            probe_timeout_seconds=getattr(settings, 'BITRIX_BREAKER_PROBE_TIMEOUT_SECONDS', 60.0),
+        )
+
+    # =========================================================================
+    # LAST KNOWN GOOD (Stale-if-error)
+    # =========================================================================
+
+    LAST_GOOD_TTL = 60 * 60 * 24 * 7 # 7 dias
+
+    @staticmethod
+    def _remember(cache_key: str, value: Any, timeout: int):
+        """Salva no cache normal e guarda uma cópia longa para servir quando o Bitrix cair."""
+        cache.set(cache_key, value, timeout)
+        cache.set(f"{cache_key}:last_good", value, BitrixService.LAST_GOOD_TTL)
+
+    @staticmethod
+    def _serve_stale(cache_key: str, source: str) -> Any:
+        """Último valor bom conhecido (ou None). Marca a resposta como stale."""
+        value = cache.get(f"{cache_key}:last_good")
+        if value is None:
+            return None
+        mark_stale(source)
+        logger.warning(f"🧊 Bitrix indisponível: servindo '{source}' do último valor conhecido ({cache_key}).")
+        if isinstance(value, dict):
+            return {**value, "stale": True}
+        return value
+
     # =========================================================================
     # THE SHIELD (Safe Request Wrapper)
     # =========================================================================
@@ -30,7 +231,8 @@ class BitrixService:
     @retry(
         stop=stop_after_attempt(3), 
         wait=wait_exponential(multiplier=1, min=2, max=10),
-        retry=retry_if_exception_type((requests.exceptions.RequestException, requests.exceptions.Timeout))
+        retry=retry_if_exception_type((requests.exceptions.RequestException, requests.exceptions.Timeout)),
+        before_sleep=_count_bitrix_retry,
     )
     def _safe_request(method: str, endpoint: str, silent: bool = False, **kwargs) -> Optional[Dict]:
         """
@@ -42,19 +244,46 @@ class BitrixService:
             return None
             
         url = f"{base_url}{endpoint}"
+
+        # Circuit Breaker: com o Bitrix instável, falha na hora (CircuitOpenError não entra no retry)
+        breaker = BitrixService._breaker()
+        breaker.before_call()
+        recorded = False # Toda saída precisa informar o breaker (senão a chamada de teste do half-open fica presa)
         
         try:
-            response = requests.request(method, url, timeout=10, **kwargs)
+            # Token do bucket compartilhado (todos os workers/crons). Lane vem do contexto (bitrix_lane).
+            BitrixRateLimiter.acquire()
+            started = time.monotonic()
+            try:
+                response = BitrixService._http_pool().request(method, url, timeout=10, **kwargs)
+            except requests.exceptions.RequestException:
+                record_call('bitrix', method, endpoint, 'error', time.monotonic() - started)
+                raise
+            record_call('bitrix', method, endpoint, response.status_code, time.monotonic() - started,
+                        len(response.request.body or b''), len(response.content))
             
             # Rate Limiting Handling (429) is handled by Tenacity if we raise exception
             if response.status_code == 429:
                 logger.warning(f"⚠️ Bitrix Rate Limit (429) em {endpoint}. Retrying...")
-                response.raise_for_status() # Trigger retry
+                BitrixRateLimiter.penalize()
+                response.raise_for_status() # Trigger retry (sem desfecho para o breaker: release no finally)
+
+            # 5xx conta como falha do Bitrix; 4xx (ex: probes de ID inexistente) não
+            if response.status_code >= 500:
+                breaker.record_failure(f"HTTP {response.status_code} em {endpoint}")
+            else:
+                breaker.record_success(time.monotonic() - started)
+            recorded = True
                 
             response.raise_for_status()
             
             return response.json()
         except requests.exceptions.RequestException as e:
+            # Erro de transporte (conexão, timeout, corpo truncado, redirects...) conta como falha;
+            # HTTPError já foi registrado acima pelo status (ou é o 429)
+            if not recorded and not isinstance(e, requests.exceptions.HTTPError):
+                breaker.record_failure(f"{type(e).__name__} em {endpoint}")
+                recorded = True
             if not silent:
                 logger.error(f"❌ Erro Bitrix ({endpoint}): {str(e)}")
             raise e # Allow Tenacity to retry
@@ -62,6 +291,101 @@ class BitrixService:
             if not silent:
                 logger.exception(f"❌ Erro Crítico Bitrix ({endpoint}): {e}")
             return None
+        finally:
+            if not recorded:
+                breaker.release_probe()
+
+    # =========================================================================
+    # LISTAS PAGINADAS (Streaming)
+    # =========================================================================
+
+    LIST_PAGE_SIZE = 50 # Limite fixo do Bitrix por página
+
+    @staticmethod
+    def _list_prefetch_executor() -> ThreadPoolExecutor:
+        global _list_prefetch_executor, _list_prefetch_pid
+        # Thread persistente por processo (gunicorn faz fork depois do import): o rate limiter
+        # guarda uma conexão por thread, então não criamos threads por iteração
+        with _list_prefetch_lock:
+            if _list_prefetch_executor is None or _list_prefetch_pid != os.getpid():
+                _list_prefetch_executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'BITRIX_LIST_PREFETCH_THREADS', 1),
+                    thread_name_prefix='bitrix-list-prefetch',
+                )
+                _list_prefetch_pid = os.getpid()
+            return _list_prefetch_executor
+
+    @staticmethod
+    def iter_list_pages(method: str, params: Optional[Dict[str, Any]] = None, select: Optional[List[str]] = None,
+                        after_id: Optional[int] = None, prefetch: bool = True, limit: Optional[int] = None):
+        """
+        Gerador das páginas (até 50 itens) de um *.list do Bitrix.
+        - Padrão: paginação por offset, seguindo 'next' da resposta como 'start' da próxima.
+        - after_id (keyset): filtro >ID + ordem ID ASC + start=-1 (sem COUNT no Bitrix). Estável com
+          registros mudando durante a leitura; a próxima página começa depois do maior ID da atual.
+        - select: projeção (select[]): só os campos pedidos trafegam.
+        - prefetch: a próxima página já é pedida enquanto a atual é consumida (no máximo 2 em memória).
+          A lane do rate limit (bitrix_lane) acompanha a busca antecipada.
+        - limit: para depois de N itens, sem buscar páginas além do necessário.
+        Página sem 'result' levanta RuntimeError: falha parcial nunca parece fim da lista.
+        """
+        base = dict(params or {})
+        if select is not None:
+            base["select"] = list(select)
+        if after_id is not None:
+            base["filter"] = dict(base.get("filter") or {})
+            base["order"] = {"ID": "ASC"}
+        endpoint = method if method.endswith('.json') else f"{method}.json"
+
+        def fetch(position):
+            payload = dict(base)
+            if after_id is not None:
+                payload["filter"] = {**base["filter"], ">ID": position}
+                payload["start"] = -1
+            else:
+                payload["start"] = position
+            resp = BitrixService._safe_request('POST', endpoint, json=payload)
+            if not resp or 'result' not in resp:
+                where = f"ID > {position}" if after_id is not None else f"start={position}"
+                raise RuntimeError(f"{method} sem resultado ({where})")
+            return resp
+
+        position = after_id if after_id is not None else 0
+        pending = None
+        seen = 0
+        try:
+            while position is not None:
+                resp = pending.result() if pending is not None else fetch(position)
+                pending = None
+                page = resp.get('result') or []
+                if not page:
+                    break
+                if after_id is not None:
+                    position = max(int(item["ID"]) for item in page) if len(page) >= BitrixService.LIST_PAGE_SIZE else None
+                else:
+                    position = resp.get('next')
+                if limit is not None:
+                    page = page[:limit - seen]
+                    seen += len(page)
+                    if seen >= limit:
+                        position = None
+                if position is not None and prefetch:
+                    pending = BitrixService._list_prefetch_executor().submit(contextvars.copy_context().run, fetch, position)
+                yield page
+        finally:
+            if pending is not None:
+                pending.cancel()
+
+    @staticmethod
+    def iter_list(method: str, params: Optional[Dict[str, Any]] = None, select: Optional[List[str]] = None, **kwargs):
+        """Itens de um *.list do Bitrix, um a um (ver iter_list_pages)."""
+        for page in BitrixService.iter_list_pages(method, params, select=select, **kwargs):
+            yield from page
+
+    @staticmethod
+    def find_first(method: str, filters: Dict[str, Any], select: Optional[List[str]] = None) -> Optional[Dict]:
+        """Primeiro item de um *.list (1 requisição, sem prefetch)."""
+        return next(BitrixService.iter_list(method, {"filter": filters}, select=select or ["ID"], prefetch=False, limit=1), None)
 
     # =========================================================================
     # 1. MAPEAMENTOS (Configuração)
@@ -126,20 +450,20 @@ class BitrixService:
             
             # Check Contact
             try:
-                contact_check = BitrixService._safe_request('GET', 'crm.contact.list.json', params={
-                    "filter[EMAIL]": user.email, "select[]": ["ID"]
-                })
-                if contact_check and contact_check.get('result'):
-                    return contact_check['result'][0]['ID']
+                contact = BitrixService.find_first('crm.contact.list', {"EMAIL": user.email})
+                if contact:
+                    from .models import User
+                    LeadConversionService.remember_entity(user, User.BitrixEntityType.CONTACT)
+                    return contact['ID']
             except: pass
 
             # Check Lead
             try:
-                lead_check = BitrixService._safe_request('GET', 'crm.lead.list.json', params={
-                    "filter[EMAIL]": user.email, "filter[STATUS_ID]": "NEW", "select[]": ["ID"]
-                })
-                if lead_check and lead_check.get('result'):
-                    return lead_check['result'][0]['ID']
+                lead = BitrixService.find_first('crm.lead.list', {"EMAIL": user.email, "STATUS_ID": "NEW"})
+                if lead:
+                    lead_id = lead['ID']
+                    LeadConversionService.track(user, lead_id)
+                    return lead_id
             except: pass
 
             logger.info(f"📤 Criando NOVO Lead no Bitrix para {user.email}...")
@@ -147,14 +471,9 @@ class BitrixService:
             
             if result and 'result' in result:
                 lead_id = result['result']
-                # Tenta verificar se converteu em contato automaticamente (Delay pequeno)
-                time.sleep(1.0) 
-                try:
-                    check = BitrixService._safe_request('GET', 'crm.lead.get.json', params={'id': lead_id})
-                    if check:
-                        contact_id = check.get('result', {}).get('CONTACT_ID')
-                        if contact_id: return contact_id
-                except: pass
+                # Conversão Lead -> Contato é capturada depois (webhook ONCRMLEADUPDATE ou cron
+                # resolve_bitrix_leads), que reescrevem user.id_bitrix. Nada de sleep/poll aqui.
+                LeadConversionService.track(user, lead_id)
                 return lead_id
             return None
         except Exception as e:
@@ -178,42 +497,64 @@ class BitrixService:
         try:
             deal_id = None
             contact_id_to_use = user.id_bitrix
+            deal_select = ["ID", "STAGE_ID", "CLOSED"]
 
-            # 1. Self-Healing Lead/Contact
-            # Tenta identificar se o ID é Contato primeiro (evita erro 400 ao buscar Lead com ID de Contato)
-            is_contact = False
-            try:
-                # [PROBE] Verifica silenciosamente se é Contato
-                contact_probe = BitrixService._safe_request('GET', 'crm.contact.get.json', params={"id": user.id_bitrix}, silent=True)
-                if contact_probe and contact_probe.get('result'):
-                    is_contact = True
-            except: pass
+            # 1. Deal atual pelo espelho local (hit = o ID já é um Contato com Deal; nenhuma chamada ao Bitrix)
+            indexed = BitrixDealMirror.current_for_contact(user.id_bitrix)
+            if indexed:
+                deals = [BitrixDealMirror.as_bitrix(indexed)]
+            else:
+                # 1.1 Miss: Self-Healing Lead/Contact + Busca do Deal (1 round-trip via batch)
+                # Probes de Contato/Lead só quando o tipo do id_bitrix é desconhecido/vencido (User.bitrix_entity_type).
+                # Lead pendente: só o probe do Lead (detecta a conversão). Se o ID for de um Lead convertido,
+                # 'deals_converted' já busca pelo CONTACT_ID do Lead ($result[lead][CONTACT_ID]).
+                # Removemos "filter[CLOSED]: N" para encontrar o Deal 448 que já está em WON.
+                from .models import User
+                known = LeadConversionService.known_entity(user)
+                lookup = BitrixBatch()
+                if known is None:
+                    lookup.add('contact', 'crm.contact.get', {"id": user.id_bitrix})
+                if known != User.BitrixEntityType.CONTACT:
+                    lookup.add('lead', 'crm.lead.get', {"id": user.id_bitrix})
+                lookup.add('deals', 'crm.deal.list', {
+                    "filter": {"CONTACT_ID": user.id_bitrix},
+                    "order": {"ID": "DESC"}, # O mais recente é o rei
+                    "select": deal_select,
+                })
+                if known != User.BitrixEntityType.CONTACT:
+                    lookup.add('deals_converted', 'crm.deal.list', {
+                        "filter": {"CONTACT_ID": BitrixBatch.ref('lead', 'CONTACT_ID')},
+                        "order": {"ID": "DESC"},
+                        "select": deal_select,
+                    })
+                lookup.execute(expect_errors=True) # Erros de probe são esperados (ID de Contato não é Lead e vice-versa)
 
-            if not is_contact:
-                try:
-                    # [PROBE] Se não é contato, tenta ver se é Lead (pode ter convertido)
-                    lead_check = BitrixService._safe_request('GET', 'crm.lead.get.json', params={"id": user.id_bitrix}, silent=True)
-                    if lead_check and lead_check.get('result'):
-                        lead_data = lead_check.get('result')
-                        if lead_data.get('CONTACT_ID'):
-                            contact_id_to_use = str(lead_data.get('CONTACT_ID'))
-                            user.id_bitrix = contact_id_to_use
-                            user.save()
-                except Exception: 
-                    # Se falhar (ex: 400 Bad Request pq é ID inválido/deleção), ignoramos
+                # Contato tem prioridade (evita tratar como Lead um ID que existe nos dois)
+                deals = lookup.get('deals', [])
+                if known == User.BitrixEntityType.CONTACT:
                     pass
+                elif known is None and not lookup.failed('contact') and lookup.get('contact'):
+                    LeadConversionService.remember_entity(user, User.BitrixEntityType.CONTACT)
+                else:
+                    lead_data = lookup.get('lead') or {}
+                    if not lookup.failed('lead') and lead_data.get('CONTACT_ID'):
+                        # Lead convertido: passa a usar o Contato
+                        lead_id = user.id_bitrix
+                        contact_id_to_use = str(lead_data.get('CONTACT_ID'))
+                        user.id_bitrix = contact_id_to_use
+                        user.save()
+                        LeadConversionService.remember_entity(user, User.BitrixEntityType.CONTACT, User.BitrixConversionStatus.CONVERTED)
+                        LeadConversionService.mark_converted(lead_id, contact_id_to_use)
+                        deals = lookup.get('deals_converted', [])
+                    elif not lookup.failed('lead') and lead_data:
+                        LeadConversionService.remember_entity(user, User.BitrixEntityType.LEAD, User.BitrixConversionStatus.PENDING)
+
+                if deals and isinstance(deals, list):
+                    BitrixDealMirror.record(deals[0], contact_id=contact_id_to_use)
 
             # 2. BUSCA INTELIGENTE (A Correção)
-            # Removemos "filter[CLOSED]: N" para ele encontrar o Deal 448 que já está em WON.
-            deal_resp = BitrixService._safe_request('GET', 'crm.deal.list.json', params={
-                "filter[CONTACT_ID]": contact_id_to_use, 
-                # Sem filtro de CLOSED, para achar os Ganhos também
-                "order[ID]": "DESC", # O mais recente é o rei
-                "select[]": ["ID", "STAGE_ID", "CLOSED"]
-            })
-            
-            if deal_resp and deal_resp.get('result'):
-                 potential_deal = deal_resp['result'][0]
+            if deals and isinstance(deals, list):
+                 potential_deal = deals[0]
                  # Só ignoramos se for uma venda PERDIDA antiga
                  # Ajuste 'LOSE', 'APOLOGY' conforme os IDs das suas colunas de falha
                  if potential_deal.get('STAGE_ID') not in ['LOSE', 'APOLOGY']:
@@ -257,19 +598,38 @@ class BitrixService:
                     if raw_status == 'approved':
                         logger.info(f"ℹ️ Atualizando dados de pagamento no Deal {deal_id or 'Novo'}.")
 
-            # 5. Executa
+            # 5. Executa (Deal + Produtos no mesmo batch; Produtos referenciam o ID do Deal novo)
+            write = BitrixBatch(halt=True)
             if not deal_id:
                 fields_to_save["CONTACT_ID"] = contact_id_to_use
-                resp = BitrixService._safe_request('POST', 'crm.deal.add.json', json={"fields": fields_to_save})
-                if resp and 'result' in resp: deal_id = resp['result']
+                write.add('deal', 'crm.deal.add', {"fields": fields_to_save})
+                target_id = BitrixBatch.ref('deal')
             else:
-                BitrixService._safe_request('POST', 'crm.deal.update.json', json={"id": deal_id, "fields": fields_to_save})
+                write.add('deal', 'crm.deal.update', {"id": deal_id, "fields": fields_to_save})
+                target_id = deal_id
 
             # 6. Produtos
-            if deal_id and products_list:
+            if products_list:
                 rows = [{"PRODUCT_ID": p.get('id', 0), "PRODUCT_NAME": p.get('name'), "PRICE": float(p.get('price', 0)), "QUANTITY": 1} for p in products_list]
-                BitrixService._safe_request('POST', 'crm.deal.productrows.set.json', json={"id": deal_id, "rows": rows})
-            
+                write.add('rows', 'crm.deal.productrows.set', {"id": target_id, "rows": rows})
+
+            write.execute()
+            if write.failed('deal'):
+                # Erro por comando não levanta exceção: None faz o outbox reagendar a escrita
+                logger.error(f"❌ Bitrix recusou o Deal {deal_id or 'Novo'}: {write.errors.get('deal')}")
+                return None
+            if not deal_id:
+                deal_id = write.get('deal')
+
+            # O Bitrix vai disparar ONCRMDEALUPDATE desta escrita: marca para o consumidor descartar o eco
+            BitrixWebhookIngestService.note_local_write('deal', deal_id)
+            # Deal novo entra no espelho mesmo se os produtos falharem: o retry atualiza este Deal em vez de criar outro
+            BitrixDealMirror.record({"ID": deal_id, **fields_to_save}, contact_id=contact_id_to_use)
+            if products_list and write.failed('rows'):
+                logger.error(f"❌ Bitrix recusou os produtos do Deal {deal_id}: {write.errors.get('rows')}")
+                return None
+            if products_list:
+                BitrixDealMirror.record_rows(deal_id, rows)
             return deal_id
 
         except Exception as e:
@@ -314,175 +674,205 @@ class BitrixService:
     def get_product_catalog() -> List[Dict]:
         """
         Retorna o catálogo de produtos com Cache para evitar 429.
+        Miss: um único rebuild por vez (singleflight); os concorrentes esperam ou recebem o :last_good.
         """
         cache_key = "bitrix_product_catalog"
-        cached_catalog = cache.get(cache_key)
-        if cached_catalog:
-            return cached_catalog
+        return singleflight(cache_key, BitrixService._build_product_catalog, stale_key=f"{cache_key}:last_good")
+
+    @staticmethod
+    def _build_product_catalog() -> List[Dict]:
+        cache_key = "bitrix_product_catalog"
+        # Espelho local (store.Products), mantido por webhooks + sync_product_catalog.
+        # Bitrix fica fora do request path; só é consultado se o espelho ainda estiver vazio.
+        from apps.store.services import CatalogSyncService
+        from apps.store.images import ProductImageService
+        catalog = CatalogSyncService.get_catalog(BitrixConfig.SECTION_IDS)
+        if catalog:
+            BitrixService._remember(cache_key, catalog, 300)
+            cache.delete(BitrixService.CATALOG_VERSION_KEY) # Recalculada no próximo generate_protocol
+            return catalog
 
         try:
             target_ids = BitrixConfig.SECTION_IDS
-            target_ids = BitrixConfig.SECTION_IDS
-            payload = { "filter": { "SECTION_ID": target_ids }, "select": ["ID", "NAME", "PRICE", "DESCRIPTION", "SECTION_ID"] }
-            response = BitrixService._safe_request('POST', 'crm.product.list.json', json=payload)
-            
             catalog = []
-            if response and "result" in response:
-                for p in response["result"]:
+            # Todas as páginas (antes só a primeira: catálogo > 50 produtos vinha truncado).
+            # Imagens resolvidas em lote por página (ver _fetch_best_images) enquanto a próxima já é buscada.
+            for products in BitrixService.iter_list_pages('crm.product.list', {"filter": {"SECTION_ID": target_ids}},
+                                                          select=["ID", "NAME", "PRICE", "DESCRIPTION", "SECTION_ID"]):
+                images = BitrixService._fetch_best_images([p["ID"] for p in products])
+                for p in products:
                     catalog.append({
                         "id": p.get("ID"),
                         "name": p.get("NAME"),
                         "price": float(p.get("PRICE") or 0),
                         "description": p.get("DESCRIPTION", ""),
-                        "image_url": BitrixService._fetch_best_image(p["ID"]),
+                        "image_url": ProductImageService.public_url(p["ID"], images.get(str(p["ID"]))),
                         "category_id": p.get("SECTION_ID")
                     })
             
             # Salva no Cache por 5 minutos (Era 1h)
-            cache.set(cache_key, catalog, 300)
+            BitrixService._remember(cache_key, catalog, 300)
+            cache.delete(BitrixService.CATALOG_VERSION_KEY)
             return catalog
-        except Exception: return []
+        except Exception as e:
+            logger.warning(f"⚠️ Falha ao montar catálogo do Bitrix: {e}")
+            stale = BitrixService._serve_stale(cache_key, 'catalog')
+            return stale if stale is not None else []
+
+    PLACEHOLDER_IMAGE = "https://via.placeholder.com/150" # Fallback
 
     @staticmethod
     def _fetch_best_image(product_id: Any) -> Optional[str]:
-        # Tenta cache específico por imagem de produto (longa duração)
-        cache_key = f"bitrix_product_image_{product_id}"
-        cached_img = cache.get(cache_key)
-        if cached_img: return cached_img
+        return BitrixService._fetch_best_images([product_id]).get(str(product_id))
 
+    @staticmethod
+    def _fetch_best_images(product_ids: List[Any], use_cache: bool = True) -> Dict[str, str]:
+        """
+        Resolve a melhor imagem de vários produtos de uma vez.
+        Misses de cache vão em batch (até 50 produtos por chamada), em duas etapas:
+          1. catalog.productImage.list de todos
+          2. crm.product.get (DETAIL/PREVIEW_PICTURE) só de quem não tinha imagem na etapa 1
+        Catálogo frio sai de 2N chamadas sequenciais para 2 * ceil(N/50), todas pelo rate limiter.
+        """
+        ids = [str(pid) for pid in dict.fromkeys(product_ids) if pid]
+        key_of = {pid: f"bitrix_product_image_{pid}" for pid in ids}
+        cached = cache.get_many(list(key_of.values())) if use_cache else {}
+        images = {pid: cached[key] for pid, key in key_of.items() if cached.get(key)}
+        missing = [pid for pid in ids if pid not in images]
+        if not missing:
+            return images
+
+        found = {}
         try:
             # 1. ProductImage List
-            img_res = BitrixService._safe_request('GET', 'catalog.productImage.list.json', params={"productId": product_id})
-            if img_res and "result" in img_res:
-                res = img_res["result"]
-                if res.get("productImages"):
-                    url = res["productImages"][0].get("detailUrl")
-                    if url:
-                        cache.set(cache_key, url, 86400) # 24h
-                        return url
-            
+            batch = BitrixBatch()
+            for pid in missing:
+                batch.add(f"img_{pid}", 'catalog.productImage.list', {"productId": pid})
+            batch.execute(expect_errors=True)
+            for pid in missing:
+                res = batch.get(f"img_{pid}") or {}
+                product_images = res.get("productImages") if isinstance(res, dict) else None
+                url = product_images[0].get("detailUrl") if product_images else None
+                if url: found[pid] = url
+
             # 2. Detail/Preview Picture
-            prod = BitrixService._safe_request('GET', 'crm.product.get.json', params={"id": product_id})
-            if prod and "result" in prod:
-                res = prod["result"]
-                url = None
-                det = res.get("DETAIL_PICTURE")
-                if isinstance(det, dict): url = det.get("showUrl")
-                if not url:
-                    pre = res.get("PREVIEW_PICTURE")
-                    if isinstance(pre, dict): url = pre.get("showUrl")
-                
-                if url:
-                    cache.set(cache_key, url, 86400)
-                    return url
-        except: pass
-        img_placeholder = "https://via.placeholder.com/150" # Fallback
-        cache.set(cache_key, img_placeholder, 3600)
-        return img_placeholder
+            pending = [pid for pid in missing if pid not in found]
+            if pending:
+                batch = BitrixBatch()
+                for pid in pending:
+                    batch.add(f"prod_{pid}", 'crm.product.get', {"id": pid})
+                batch.execute(expect_errors=True)
+                for pid in pending:
+                    res = batch.get(f"prod_{pid}") or {}
+                    url = None
+                    det = res.get("DETAIL_PICTURE")
+                    if isinstance(det, dict): url = det.get("showUrl")
+                    if not url:
+                        pre = res.get("PREVIEW_PICTURE")
+                        if isinstance(pre, dict): url = pre.get("showUrl")
+                    if url: found[pid] = url
+        except CircuitOpenError:
+            # Bitrix fora: não grava o placeholder por 1h, tenta de novo quando voltar
+            images.update({pid: found.get(pid, BitrixService.PLACEHOLDER_IMAGE) for pid in missing})
+            return images
+        except Exception as e:
+            logger.warning(f"⚠️ Falha ao resolver imagens no Bitrix: {e}")
+
+        if found:
+            cache.set_many({key_of[pid]: url for pid, url in found.items()}, 86400) # 24h
+        placeholders = [pid for pid in missing if pid not in found]
+        if placeholders:
+            cache.set_many({key_of[pid]: BitrixService.PLACEHOLDER_IMAGE for pid in placeholders}, 3600)
+
+        images.update(found)
+        images.update({pid: BitrixService.PLACEHOLDER_IMAGE for pid in placeholders})
+        return images
+
+    CATALOG_VERSION_KEY = "bitrix_product_catalog_version"
+
+    @staticmethod
+    def get_catalog_version(catalog: Optional[List[Dict]] = None) -> Optional[str]:
+        """Fingerprint do catálogo em cache (gravado junto com ele). Calcula se faltar."""
+        from .protocol import catalog_fingerprint
+        version = cache.get(BitrixService.CATALOG_VERSION_KEY)
+        if version is None and catalog:
+            version = catalog_fingerprint(catalog)
+            cache.set(BitrixService.CATALOG_VERSION_KEY, version, 300)
+        return version
 
     @staticmethod
     def generate_protocol(answers: Dict[str, Any]) -> Dict[str, Any]:
-        MATCHERS = {
-            "dutasterida_oral": ["Dutasterida"], "finasterida_oral": ["Finasterida"],
-            "minoxidil_oral": ["Minoxidil", "2.5"], "saw_palmetto_oral": ["Saw"], 
-            "minoxidil_topico": ["Minoxidil", "Tópico"], "finasterida_topica": ["Finasterida", "Tópico"], 
-            "shampoo": ["Shampoo"], "biotina": ["Biotina"]
-        }
-        
+        """
+        Protocolo recomendado a partir das respostas do questionário.
+        Índice papel->produto compilado por versão do catálogo + memo por hash das respostas (ver protocol.py).
+        """
+        from .protocol import ProtocolEngine
+
+        # Hit no memo nem precisa carregar o catálogo
+        version = cache.get(BitrixService.CATALOG_VERSION_KEY)
+        if version:
+            cached = ProtocolEngine.lookup(version, answers)
+            if cached is not None:
+                return cached
+
         # Usa o método com cache
         catalog_cache = BitrixService.get_product_catalog()
         if not catalog_cache: return {"error": "Erro CRM Communication"}
 
-        def find_product(role_key):
-            keywords = [k.lower() for k in MATCHERS.get(role_key, [])]
-            for p in catalog_cache:
-                name = p.get("name", "").lower()
-                # Adaptação para usar o dicionário limpo do catalog_cache
-                cat_id = str(p.get("category_id"))
-                if "topico" in role_key and cat_id != '20': continue
-                if all(k in name for k in keywords):
-                    if "oral" in role_key and "topico" in name: continue
-                    return p
-            return None
-
-        # Lógica de Recomendação (Mantida)
-        gender = answers.get("F1_Q1_gender", "masculino")
-        health = answers.get("F2_Q14_health_cond", "").lower()
-        alrg = answers.get("F2_Q15_allergy", "").lower()
-        pets = answers.get("F2_Q18_pets") == "sim"
-        
-        block_horm = (gender == "feminino" or "cancer" in health or "hepatica" in health or "finasterida" in alrg)
-        block_minox_or = ("cardiaca" in health or "renal" in health or "minoxidil" in alrg)
-        block_minox_top = (pets or "psoriase" in answers.get("F2_Q8_symptom", "").lower() or "cardiaca" in health)
-
-        selected = []
-        oral = "minoxidil_oral" if gender == "feminino" else ("finasterida_oral" if not block_horm else ("minoxidil_oral" if not block_minox_or else "saw_palmetto_oral"))
-        if oral and not (oral == "minoxidil_oral" and block_minox_or): selected.append(oral)
-
-        topical = "minoxidil_topico" if not block_minox_top else None
-        if not topical and gender == "masculino" and not block_horm: topical = "finasterida_topica"
-        if topical: selected.append(topical)
-        
-        selected.extend(["shampoo", "biotina"])
-        final_products = []
-        total = 0.0
-
-        for role in selected:
-            p = find_product(role)
-            if p:
-                price = p["price"]
-                total += price
-                final_products.append({
-                    "id": p["id"], 
-                    "name": p["name"], 
-                    "price": price, 
-                    "sub": "Protocolo Personalizado", 
-                    "img": p["image_url"],
-                    "description": p["description"]
-                })
-
-        return {"redFlag": False, "title": "Seu Protocolo Exclusivo", "description": "Baseado na sua triagem.", "products": final_products, "total_price": round(total, 2)}
+        version = BitrixService.get_catalog_version(catalog_cache)
+        return ProtocolEngine.generate(answers, catalog_cache, version)
 
     @staticmethod
     def get_plan_details(plan_slug):
         bitrix_id = BitrixConfig.PLAN_IDS.get(plan_slug)
         if not bitrix_id: return None
         
-        # Cache para detalhes do plano
+        # Cache para detalhes do plano (miss: um único rebuild por vez)
+        cache_key = f"bitrix_plan_details_{plan_slug}"
+        return singleflight(cache_key, lambda: BitrixService._build_plan_details(plan_slug, bitrix_id), stale_key=f"{cache_key}:last_good")
+
+    @staticmethod
+    def _build_plan_details(plan_slug, bitrix_id):
         cache_key = f"bitrix_plan_details_{plan_slug}"
-        cached = cache.get(cache_key)
-        if cached: return cached
+
+        # Espelho local do catálogo (inclui os produtos de plano)
+        from apps.store.services import CatalogSyncService
+        mirrored = CatalogSyncService.get_product(bitrix_id)
+        if mirrored:
+            data = {"id": str(mirrored.bitrix_id), "name": mirrored.name, "price": float(mirrored.price)}
+            BitrixService._remember(cache_key, data, 300)
+            return data
 
         try:
             prod = BitrixService._safe_request('GET', 'crm.product.get.json', params={"id": bitrix_id})
             if prod and 'result' in prod:
                 p = prod['result']
                 data = {"id": str(p.get("ID")), "name": p.get("NAME"), "price": float(p.get("PRICE") or 0)}
-                cache.set(cache_key, data, 300)
+                BitrixService._remember(cache_key, data, 300)
                 return data
-        except: pass
-        return None
+        except Exception as e:
+            logger.warning(f"⚠️ Falha ao buscar plano {plan_slug} no Bitrix: {e}")
+        return BitrixService._serve_stale(cache_key, 'plan')
 
     @staticmethod
     def check_and_update_user_plan(user: Any) -> Dict[str, str]:
         """
-        Sincroniza o plano com o Bitrix e retorna detalhes.
-        Return: {"plan": "plus"|"standard"|"none", "payment_status": "Aprovado"|"Pendente"|...}
+        Sincroniza o plano a partir do espelho local do Deal (BitrixDealMirror) e retorna detalhes.
+        Return: {"plan": "plus"|"standard"|"none", "payment_status": "Aprovado"|"Pendente"|..., "source", "synced_at", "stale"}
         """
         default_return = {"plan": getattr(user, 'current_plan', 'none'), "payment_status": "Unknown"}
         if not getattr(user, 'id_bitrix', None): return default_return
         
         try:
-            # Encontrar o Deal
+            # Deal atual + Produtos do espelho local (sem chamada ao Bitrix; miss/velho agenda a sincronização)
             payment_status_field = BitrixConfig.DEAL_FIELDS.get("PAYMENT_STATUS")
-            resp = BitrixService._safe_request('GET', 'crm.deal.list.json', params={
-                "filter[CONTACT_ID]": user.id_bitrix, 
-                "order[ID]": "DESC", 
-                "select[]": ["ID", payment_status_field]
-            })
-            if not resp or not resp.get('result'): return default_return
-            
-            latest_deal = resp['result'][0]
+            mirrored = BitrixDealMirror.lookup(user, include_lead=False)
+            if not mirrored: return {**default_return, **BitrixDealMirror.freshness(None)}
+            freshness = BitrixDealMirror.freshness(mirrored)
+            rows_ready = mirrored.rows_synced_at is not None
+            rows = BitrixDealMirror.rows_as_bitrix(mirrored) if rows_ready else []
+
+            latest_deal = BitrixDealMirror.as_bitrix(mirrored)
             deal_id = latest_deal.get("ID")
             payment_status_raw = latest_deal.get(payment_status_field)
             
@@ -515,19 +905,16 @@ class BitrixService:
                 
                 # Se quiser manter a lógica de sync, mas sem destruir o acesso:
                 if user.current_plan == 'none':
-                     return {"plan": "none", "payment_status": payment_status or "Pendente"}
+                     return {"plan": "none", "payment_status": payment_status or "Pendente", **freshness}
                 else:
                      # Mantém o plano local como Source of Truth temporária
-                     return {"plan": user.current_plan, "payment_status": payment_status or "Divergente"}
+                     return {"plan": user.current_plan, "payment_status": payment_status or "Divergente", **freshness}
 
             # Se Bitrix diz que é Aprovado, continuamos para atualizar/confirmar o tipo de plano
             
-            # Obter produtos
-            rows_resp = BitrixService._safe_request('GET', 'crm.deal.productrows.get.json', params={"id": deal_id})
-            if not rows_resp: 
-                 return {"plan": user.current_plan, "payment_status": "Aprovado"} # Falback
-            
-            rows = rows_resp.get('result', [])
+            # Produtos ainda não espelhados (sincronização já agendada pelo lookup)
+            if not rows_ready:
+                 return {"plan": user.current_plan, "payment_status": "Aprovado", **freshness} # Falback
             
             plan_ids = BitrixConfig.PLAN_IDS
             id_standard = plan_ids.get('standard')
@@ -564,106 +951,84 @@ class BitrixService:
             
             # [FIX] Se o plano for 'none', verifica se precisamos remover acesso (opcional, por enquanto mantemos histórico)
             
-            return {"plan": new_plan, "payment_status": payment_status}
+            return {"plan": new_plan, "payment_status": payment_status, **freshness}
 
         except Exception as e:
             logger.error(f"Erro ao sincronizar plano do Bitrix: {e}")
             return default_return
 
     @staticmethod
-    def get_contact_data(user: Any) -> Dict[str, Any]:
-        contact_id = getattr(user, 'id_bitrix', None)
-        if not contact_id: return {}
-        
-        cache_key = f"bitrix_contact_details_{contact_id}"
-        cached = cache.get(cache_key)
-        if cached: return cached
-
-        try:
-            resp = BitrixService._safe_request('GET', 'crm.contact.get.json', params={"id": contact_id})
-            if not resp: return {}
-            
-            data = resp.get('result', {})
-            
-            phone = ""
-            if "PHONE" in data and isinstance(data["PHONE"], list) and len(data["PHONE"]) > 0:
-                phone = data["PHONE"][0].get("VALUE", "")
-
-            address = {
-                "street": data.get("ADDRESS", ""),
-                "city": data.get("ADDRESS_CITY", ""),
-                "state": data.get("ADDRESS_PROVINCE", ""),
-                "zip": data.get("ADDRESS_POSTAL_CODE", ""),
-                "neighborhood": data.get("ADDRESS_2", ""),
-                "country": data.get("ADDRESS_COUNTRY", "Brasil")
-            }
-            
-            final_data = {"phone": phone, "address": address}
-            cache.set(cache_key, final_data, 300) # 5 minutos
-            return final_data
+    def parse_contact(data: Dict[str, Any]) -> Dict[str, Any]:
+        """Telefone/endereço de um Contato (crm.contact.get ou item de crm.contact.list)."""
+        phone = ""
+        if "PHONE" in data and isinstance(data["PHONE"], list) and len(data["PHONE"]) > 0:
+            phone = data["PHONE"][0].get("VALUE", "")
+
+        address = {
+            "street": data.get("ADDRESS") or "",
+            "city": data.get("ADDRESS_CITY") or "",
+            "state": data.get("ADDRESS_PROVINCE") or "",
+            "zip": data.get("ADDRESS_POSTAL_CODE") or "",
+            "neighborhood": data.get("ADDRESS_2") or "",
+            "country": data.get("ADDRESS_COUNTRY") or "Brasil"
+        }
+        return {"phone": phone, "address": address}
 
-        except Exception as e:
-            logger.warning(f"⚠️ Erro ao buscar dados do contato {contact_id} (Offline Mode): {e}")
-            return {}
+    @staticmethod
+    def fetch_contact_data(contact_id: Any) -> Optional[Dict[str, Any]]:
+        """crm.contact.get -> parse_contact. None se o Bitrix não respondeu (quem chama decide se tenta de novo)."""
+        if not contact_id: return None
+        resp = BitrixService._safe_request('GET', 'crm.contact.get.json', params={"id": contact_id})
+        if not resp or not isinstance(resp.get('result'), dict): return None
+        return BitrixService.parse_contact(resp['result'])
 
     @staticmethod
     def get_client_protocol(user: Any) -> Dict:
+        """
+        Protocolo atual (Deal + Produtos) lido do espelho local — nenhuma chamada ao Bitrix.
+        Miss ou espelho velho: agenda a sincronização (outbox) e responde com o que houver,
+        com os metadados de frescor (source/synced_at/stale).
+        """
         if not getattr(user, 'id_bitrix', None):
-            found_id = BitrixService._find_bitrix_id_by_email(user.email)
-            if found_id:
-                user.id_bitrix = str(found_id)
-                user.save()
-            else:
-                return {"error": "Usuário não vinculado ao Bitrix (Lead não encontrado)"}
+            # O job de sincronização tenta vincular o Contato/Lead pelo e-mail
+            BitrixDealMirror.request_sync(user)
+            return {"error": "Usuário não vinculado ao Bitrix (Lead não encontrado)"}
 
         try:
-            resp = BitrixService._safe_request('GET', 'crm.deal.list.json', params={
-                "filter[CONTACT_ID]": user.id_bitrix, "order[ID]": "DESC", "select[]": ["ID", "STAGE_ID", "TITLE", "OPPORTUNITY"]
-            })
-            deals = resp.get('result', []) if resp else []
-            if not deals: 
-                 resp_lead = BitrixService._safe_request('GET', 'crm.deal.list.json', params={
-                    "filter[LEAD_ID]": user.id_bitrix, "order[ID]": "DESC", "select[]": ["ID", "STAGE_ID", "TITLE", "OPPORTUNITY"]
-                 })
-                 deals = resp_lead.get('result', []) if resp_lead else []
-
-            if not deals: return {"status": "no_deal", "message": "Nenhum protocolo encontrado."}
-            
-            deal = deals[0]
-            deal_id = deal.get("ID")
-            total_value = float(deal.get("OPPORTUNITY", 0))
+            mirrored = BitrixDealMirror.lookup(user)
+            if not mirrored:
+                return {"status": "no_deal", "message": "Nenhum protocolo encontrado.", **BitrixDealMirror.freshness(None)}
+
+            rows = list(mirrored.rows.all())
+            product_ids = [r.product_id for r in rows if r.product_id]
+            # Imagem/descrição do espelho do catálogo; imagem ainda não espelhada: cache, senão placeholder
+            from apps.store.models import Products
+            from apps.store.images import ProductImageService
+            catalog = {p.bitrix_id: p for p in Products.objects.filter(bitrix_id__in=product_ids).only('bitrix_id', 'image_url', 'description')}
+            cached_images = cache.get_many([f"bitrix_product_image_{pid}" for pid in product_ids if not getattr(catalog.get(pid), 'image_url', None)])
 
-            rows_res = BitrixService._safe_request('GET', 'crm.deal.productrows.get.json', params={"id": deal_id})
-            rows = rows_res.get('result', []) if rows_res else []
-            
             enrich_products = []
             for r in rows:
-                p_id = r.get("PRODUCT_ID")
-                # Usa métodos cacheados
-                desc = ""
-                img = None
-                if p_id:
-                    # Tenta pegar info do catálogo ou cache temporário
-                    img = BitrixService._fetch_best_image(p_id)
-                    # Descrição exigiria outro call se não estiver no catalog cache.
-                    # Simplificação para performance: não busca description individualmente se for pesado
-                
+                product = catalog.get(r.product_id)
+                img = (product.image_url if product else None) or cached_images.get(f"bitrix_product_image_{r.product_id}") or BitrixService.PLACEHOLDER_IMAGE
+                img = ProductImageService.public_url(r.product_id, img)
                 enrich_products.append({
-                    "id": p_id,
-                    "name": r.get("PRODUCT_NAME"), 
-                    "price": float(r.get("PRICE", 0)), 
-                    "quantity": int(r.get("QUANTITY", 1)),
-                    "description": desc,
+                    "id": str(r.product_id) if r.product_id else None,
+                    "name": r.product_name,
+                    "price": float(r.price),
+                    "quantity": int(r.quantity),
+                    "description": product.description if product else "",
                     "img": img,
                     "sub": "Protocolo Personalizado"
                 })
-            
+
             return {
-                "deal_id": deal_id, 
-                "stage": deal.get("STAGE_ID"), 
-                "title": deal.get("TITLE"),
-                "total_value": total_value,
-                "products": enrich_products
+                "deal_id": str(mirrored.deal_id),
+                "stage": mirrored.stage_id,
+                "title": mirrored.title,
+                "total_value": float(mirrored.opportunity or 0),
+                "products": enrich_products,
+                **BitrixDealMirror.freshness(mirrored),
             }
         except Exception as e: 
             logger.error(f"Erro get_client_protocol: {e}")
@@ -672,15 +1037,11 @@ class BitrixService:
     @staticmethod
     def _find_bitrix_id_by_email(email: str) -> Optional[str]:
         try:
-            contact_check = BitrixService._safe_request('GET', 'crm.contact.list.json', params={
-                "filter[EMAIL]": email, "select[]": ["ID"]
-            })
-            if contact_check and contact_check.get('result'): return contact_check['result'][0]['ID']
+            contact = BitrixService.find_first('crm.contact.list', {"EMAIL": email})
+            if contact: return contact['ID']
 
-            lead_check = BitrixService._safe_request('GET', 'crm.lead.list.json', params={
-                "filter[EMAIL]": email, "select[]": ["ID"]
-            })
-            if lead_check and lead_check.get('result'): return lead_check['result'][0]['ID']
+            lead = BitrixService.find_first('crm.lead.list', {"EMAIL": email})
+            if lead: return lead['ID']
         except: pass
         return None
 
@@ -700,12 +1061,37 @@ class BitrixService:
 
         if event == 'ONCRMDEALUPDATE':
             return BitrixService._handle_deal_update(data)
+
+        # Espelho de Deals: Deals criados/removidos fora do nosso fluxo (ex: pelo comercial)
+        if event == 'ONCRMDEALADD':
+            if not data.get('data[FIELDS][ID]'): return False
+            deal = BitrixDealMirror.refresh([data.get('data[FIELDS][ID]')]).get(str(data.get('data[FIELDS][ID]')))
+            if not deal: return False
+            BitrixDealMirror.reapply_contacts([deal.get('CONTACT_ID')], 'bitrix_deal')
+            return True
+        if event == 'ONCRMDEALDELETE':
+            BitrixDealMirror.reapply_contacts([BitrixDealMirror.forget(data.get('data[FIELDS][ID]'))], 'bitrix_deal')
+            return True
+
+        # Contato alterado no Bitrix (telefone/endereço): releitura pelo outbox, depois reconstrói o perfil
+        if event == 'ONCRMCONTACTUPDATE':
+            from .models import User
+            from .profile_snapshot import ProfileSnapshotService
+            for user in User.objects.filter(id_bitrix=str(data.get('data[FIELDS][ID]') or '')):
+                ProfileSnapshotService.request_contact_sync(user)
+            return True
+
+        # Lead convertido em Contato: reescreve id_bitrix de quem ainda aponta para o Lead
+        if event == 'ONCRMLEADUPDATE':
+            # Só Leads nossos: o webhook dispara para todo Lead do CRM e o crm.lead.get gasta a cota compartilhada
+            lead_ids = LeadConversionService.tracked([data.get('data[FIELDS][ID]')])
+            return LeadConversionService.resolve(lead_ids) > 0 if lead_ids else True
             
-        # Limpar Cache de Produtos se houver alteração no Catálogo
+        # Atualiza o espelho local do catálogo (e limpa o cache) se houver alteração no Catálogo
         if event in ['ONCRMPRODUCTUPDATE', 'ONCRMPRODUCTADD', 'ONCRMPRODUCTDELETE']:
-            logger.info(f"♻️ Limpando Cache de Produtos (Trigger: {event})")
-            cache.delete("bitrix_product_catalog")
-            return True
+            from apps.store.services import CatalogSyncService
+            logger.info(f"♻️ Atualizando Espelho de Produtos (Trigger: {event})")
+            return CatalogSyncService.apply_event(event, data.get('data[FIELDS][ID]'))
         
         # Outros eventos: ONCRMCONTACTADD, etc.
         return True
@@ -719,11 +1105,10 @@ class BitrixService:
             deal_id = data.get('data[FIELDS][ID]')
             if not deal_id: return False
 
-            # Buscar o Deal para ver quem é o CONTACT_ID
-            deal_info = BitrixService._safe_request('GET', 'crm.deal.get.json', params={"id": deal_id})
-            if not deal_info or not deal_info.get('result'): return False
+            # Relê o Deal + Produtos para o espelho (e para ver quem é o CONTACT_ID)
+            result = BitrixDealMirror.refresh([deal_id]).get(str(deal_id))
+            if not result: return False
             
-            result = deal_info['result']
             contact_id = result.get('CONTACT_ID')
             stage_id = result.get('STAGE_ID') 
             
@@ -737,8 +1122,8 @@ class BitrixService:
                 user = User.objects.get(id_bitrix=str(contact_id))
                 logger.info(f"🔄 Sincronizando Plano para usuário {user.email} (Trigger: Webhook Deal {deal_id})")
                 
-                # Forçar atualização do plano
-                BitrixService.check_and_update_user_plan(user)
+                # Forçar atualização do plano (lê o espelho recém-atualizado) + protocolo/perfil
+                BitrixDealMirror.reapply([user], 'bitrix_deal')
 
                 # [BIDIRECTIONAL SYNC] Verificar consistência financeira
                 # Se o Django diz que está pago, o Bitrix TEM que dizer que está pago.
@@ -818,6 +1203,8 @@ class BitrixService:
                 logger.warning(f"Webhook: Usuário com id_bitrix {contact_id} não encontrado no Django.")
                 return False
 
+        except TRANSIENT_ERRORS:
+            raise # O consumidor (process_pending) reagenda o evento
         except Exception as e:
             logger.exception(f"❌ Erro _handle_deal_update: {e}")
             return False
@@ -903,6 +1290,971 @@ class BitrixService:
             results["errors"].append(str(e))
             return results
 
+class LeadConversionService:
+    """
+    Cria (outbox 'provision_lead', fora do cadastro) e acompanha Leads até virarem Contato no Bitrix.
+    Entradas: webhook ONCRMLEADUPDATE (imediato) e cron resolve_bitrix_leads (backoff).
+    """
+    OUTBOX_KIND = 'provision_lead'
+    # Espera entre verificações do cron (por tentativa); depois da última, expira
+    BACKOFF_MINUTES = [1, 5, 15, 60, 180, 720, 1440]
+
+    @staticmethod
+    def request_provisioning(user: Any, answers: Optional[Dict] = None, address_data: Optional[Dict] = None) -> Optional[Any]:
+        """
+        Agenda (outbox) a criação/vinculação do Lead de um usuário recém-cadastrado.
+        Um job por usuário (dedupe_key): cadastro repetido ou reenvio não cria um segundo Lead.
+        """
+        if not getattr(user, 'pk', None): return None
+        key = f"provision_lead:user:{user.pk}"
+        return BitrixOutboxService.enqueue(
+            LeadConversionService.OUTBOX_KIND,
+            {"user_id": str(user.pk), "answers": answers or {}, "address_data": address_data or {}},
+            user=user, reference=key, dedupe_key=key,
+        )
+
+    @staticmethod
+    def handle_outbox(event: Any):
+        """Handler do outbox: busca Contato/Lead pelo e-mail ou cria o Lead (Bitrix fora = nova tentativa)."""
+        from django.db.models import Q
+        from .models import User
+        from .profile_snapshot import ProfileSnapshotService
+        payload = event.payload or {}
+        user = event.user or User.objects.filter(pk=payload.get('user_id')).first()
+        if not user or user.id_bitrix:
+            return  # Já vinculado (ex: checkout chegou antes): nada a criar
+        bitrix_id = BitrixService.create_lead(user, payload.get('answers') or None, payload.get('address_data') or None)
+        if not bitrix_id:
+            raise RuntimeError(f"Lead de {user.email} não criado/encontrado no Bitrix")
+        # Só preenche se ninguém vinculou enquanto o Bitrix respondia
+        linked = User.objects.filter(Q(id_bitrix__isnull=True) | Q(id_bitrix=''), pk=user.pk).update(id_bitrix=str(bitrix_id))
+        if linked:
+            logger.info(f"✅ SUCESSO: Local ID {user.pk} vinculado ao Bitrix ID {bitrix_id}")
+            ProfileSnapshotService.schedule(user.pk, 'lead_provisioned')
+
+    @staticmethod
+    def remember_entity(user: Any, entity_type: str, conversion_status: Optional[str] = None):
+        """Persiste o que o id_bitrix do usuário é no Bitrix (Contato/Lead), confirmado agora."""
+        from django.utils import timezone
+        from .models import User
+        fields = {"bitrix_entity_type": entity_type, "bitrix_entity_checked_at": timezone.now()}
+        if conversion_status: fields["bitrix_conversion_status"] = conversion_status
+        for name, value in fields.items():
+            setattr(user, name, value)
+        if getattr(user, 'pk', None):
+            User.objects.filter(pk=user.pk).update(**fields)
+
+    @staticmethod
+    def known_entity(user: Any) -> Optional[str]:
+        """Tipo persistido do id_bitrix ('contact'/'lead') se ainda confiável; None = desconhecido/vencido (precisa de probe)."""
+        from django.utils import timezone
+        from datetime import timedelta
+        from .models import User
+        entity_type = getattr(user, 'bitrix_entity_type', User.BitrixEntityType.UNKNOWN)
+        checked_at = getattr(user, 'bitrix_entity_checked_at', None)
+        if entity_type == User.BitrixEntityType.UNKNOWN or not checked_at: return None
+        ttl = timedelta(hours=getattr(settings, 'BITRIX_ENTITY_STATE_TTL_HOURS', 720))
+        if timezone.now() - checked_at > ttl: return None
+        return entity_type
+
+    @staticmethod
+    def track(user: Any, lead_id: Any):
+        from django.utils import timezone
+        from datetime import timedelta
+        from .models import BitrixLeadConversion
+        from .models import User
+        if not getattr(user, 'pk', None) or not lead_id: return
+        LeadConversionService.remember_entity(user, User.BitrixEntityType.LEAD, User.BitrixConversionStatus.PENDING)
+        try:
+            BitrixLeadConversion.objects.get_or_create(lead_id=str(lead_id), defaults={
+                "user": user,
+                "next_check_at": timezone.now() + timedelta(minutes=LeadConversionService.BACKOFF_MINUTES[0]),
+            })
+        except Exception as e:
+            logger.error(f"❌ Erro registrando conversão pendente do Lead {lead_id}: {e}")
+
+    @staticmethod
+    def mark_converted(lead_id: Any, contact_id: Any) -> int:
+        """Aplica a conversão: reescreve id_bitrix de quem ainda aponta para o Lead. Retorna usuários afetados."""
+        from django.utils import timezone
+        from .models import User, BitrixLeadConversion
+        lead_id, contact_id = str(lead_id), str(contact_id)
+        updated = User.objects.filter(id_bitrix=lead_id).update(
+            id_bitrix=contact_id,
+            bitrix_entity_type=User.BitrixEntityType.CONTACT,
+            bitrix_conversion_status=User.BitrixConversionStatus.CONVERTED,
+            bitrix_entity_checked_at=timezone.now(),
+        )
+        BitrixLeadConversion.objects.filter(lead_id=lead_id).exclude(
+            status=BitrixLeadConversion.Status.CONVERTED
+        ).update(status=BitrixLeadConversion.Status.CONVERTED, contact_id=contact_id, resolved_at=timezone.now())
+        if updated:
+            from .profile_snapshot import ProfileSnapshotService
+            users = list(User.objects.filter(id_bitrix=contact_id))
+            for user in users:
+                ProfileSnapshotService.request_contact_sync(user)
+            ProfileSnapshotService.schedule_many([u.pk for u in users], 'lead_converted')
+            logger.info(f"🔁 Lead {lead_id} convertido no Contato {contact_id} ({updated} usuário(s) atualizado(s)).")
+        return updated
+
+    @staticmethod
+    def tracked(lead_ids: List[Any]) -> List[str]:
+        """Leads acompanhados por nós (conversão pendente ou id_bitrix de algum usuário)."""
+        from .models import BitrixLeadConversion, User
+        lead_ids = [str(l) for l in dict.fromkeys(lead_ids) if l]
+        if not lead_ids: return []
+        known = set(BitrixLeadConversion.objects.filter(
+            lead_id__in=lead_ids, status=BitrixLeadConversion.Status.PENDING
+        ).values_list('lead_id', flat=True))
+        known.update(User.objects.filter(id_bitrix__in=lead_ids).values_list('id_bitrix', flat=True))
+        return [l for l in lead_ids if l in known]
+
+    @staticmethod
+    def resolve(lead_ids: List[Any]) -> int:
+        """
+        Consulta os Leads (em batch) e aplica os que já têm CONTACT_ID.
+        Os ainda não convertidos são reagendados com backoff. Retorna quantos converteram.
+        """
+        from django.utils import timezone
+        from datetime import timedelta
+        from .models import BitrixLeadConversion
+
+        lead_ids = [str(l) for l in dict.fromkeys(lead_ids) if l]
+        if not lead_ids: return 0
+
+        batch = BitrixBatch()
+        for lead_id in lead_ids:
+            batch.add(f"lead_{lead_id}", 'crm.lead.get', {"id": lead_id})
+        batch.execute(expect_errors=True)
+
+        converted = 0
+        for lead_id in lead_ids:
+            lead = batch.get(f"lead_{lead_id}") or {}
+            contact_id = lead.get('CONTACT_ID') if isinstance(lead, dict) else None
+            if contact_id:
+                LeadConversionService.mark_converted(lead_id, contact_id)
+                converted += 1
+                continue
+
+            pending = BitrixLeadConversion.objects.filter(lead_id=lead_id, status=BitrixLeadConversion.Status.PENDING).first()
+            if not pending: continue
+            pending.attempts += 1
+            if pending.attempts >= len(LeadConversionService.BACKOFF_MINUTES):
+                pending.status = BitrixLeadConversion.Status.EXPIRED
+                pending.resolved_at = timezone.now()
+            else:
+                pending.next_check_at = timezone.now() + timedelta(minutes=LeadConversionService.BACKOFF_MINUTES[pending.attempts])
+            pending.save(update_fields=['attempts', 'status', 'next_check_at', 'resolved_at'])
+        return converted
+
+    @staticmethod
+    def resolve_due(limit: int = 200) -> Dict[str, int]:
+        """Cron: resolve as conversões pendentes com verificação vencida."""
+        from django.utils import timezone
+        from .models import BitrixLeadConversion
+        due = list(BitrixLeadConversion.objects.filter(
+            status=BitrixLeadConversion.Status.PENDING, next_check_at__lte=timezone.now()
+        ).order_by('next_check_at').values_list('lead_id', flat=True)[:limit])
+        converted = LeadConversionService.resolve(due) if due else 0
+        return {"checked": len(due), "converted": converted}
+
+
+class BitrixDealMirror:
+    """
+    Espelho local dos Deals do Bitrix (modelos BitrixDeal + BitrixDealRow).
+    Leituras de Deal (protocolo, plano, painel do médico) saem daqui, sem chamada ao Bitrix.
+    Alimentado por: webhooks ONCRMDEAL* (refresh), escritas em prepare_deal_payment e o job
+    'sync_deal_mirror' do outbox, que a própria leitura agenda em caso de miss ou espelho velho.
+    """
+    OUTBOX_KIND = 'sync_deal_mirror'
+
+    @staticmethod
+    def _first_value(value: Any) -> Any:
+        # Campos customizados do Bitrix podem vir como lista ['Valor']
+        if isinstance(value, list):
+            return value[0] if value else None
+        return value
+
+    @staticmethod
+    def _decimal(value: Any, default: str = "0") -> Any:
+        from decimal import Decimal, InvalidOperation
+        try:
+            return Decimal(str(value)) if value not in (None, "") else Decimal(default)
+        except InvalidOperation:
+            return Decimal(default)
+
+    @staticmethod
+    def _max_age_minutes() -> int:
+        return getattr(settings, 'BITRIX_DEAL_MIRROR_MAX_AGE_MINUTES', 60)
+
+    @staticmethod
+    def current_for_contact(contact_id: Any) -> Optional[Any]:
+        from .models import BitrixDeal
+        if not contact_id: return None
+        return BitrixDeal.objects.filter(contact_id=str(contact_id)).order_by('-deal_id').first()
+
+    @staticmethod
+    def current_for_lead(lead_id: Any) -> Optional[Any]:
+        from .models import BitrixDeal
+        if not lead_id: return None
+        return BitrixDeal.objects.filter(lead_id=str(lead_id)).order_by('-deal_id').first()
+
+    @staticmethod
+    def lookup(user: Any, include_lead: bool = True) -> Optional[Any]:
+        """
+        Deal atual do usuário no espelho (por Contato; se include_lead, depois pelo Lead).
+        Miss, produtos ainda não espelhados ou espelho velho: agenda a sincronização e devolve o que houver.
+        """
+        bitrix_id = getattr(user, 'id_bitrix', None)
+        row = BitrixDealMirror.current_for_contact(bitrix_id)
+        if row is None and include_lead:
+            row = BitrixDealMirror.current_for_lead(bitrix_id)
+        if row is None or row.rows_synced_at is None or BitrixDealMirror.is_stale(row):
+            BitrixDealMirror.request_sync(user)
+        return row
+
+    @staticmethod
+    def is_stale(row: Any) -> bool:
+        from datetime import timedelta
+        from django.utils import timezone
+        if row is None or row.synced_at is None: return True
+        return row.synced_at < timezone.now() - timedelta(minutes=BitrixDealMirror._max_age_minutes())
+
+    @staticmethod
+    def freshness(row: Any) -> Dict[str, Any]:
+        """Metadados de frescor anexados às respostas lidas do espelho."""
+        synced_at = getattr(row, 'synced_at', None)
+        return {"source": "mirror", "synced_at": synced_at.isoformat() if synced_at else None, "stale": BitrixDealMirror.is_stale(row)}
+
+    @staticmethod
+    def as_bitrix(row: Any) -> Dict[str, Any]:
+        """Linha do espelho no formato de um item de crm.deal.list (compatível com o código existente)."""
+        return {
+            "ID": str(row.deal_id),
+            "STAGE_ID": row.stage_id,
+            "CLOSED": "Y" if row.closed else "N",
+            "TITLE": row.title,
+            "OPPORTUNITY": str(row.opportunity) if row.opportunity is not None else "0",
+            BitrixConfig.DEAL_FIELDS["PAYMENT_STATUS"]: row.payment_status,
+        }
+
+    @staticmethod
+    def rows_as_bitrix(row: Any) -> List[Dict[str, Any]]:
+        """Produtos espelhados no formato do crm.deal.productrows.get."""
+        return [{
+            "PRODUCT_ID": r.product_id or 0,
+            "PRODUCT_NAME": r.product_name,
+            "PRICE": str(r.price),
+            "QUANTITY": str(r.quantity),
+        } for r in row.rows.all()]
+
+    @staticmethod
+    def _fields(deal: Dict[str, Any], contact_id: Any = None, lead_id: Any = None) -> Dict[str, Any]:
+        """Campos do espelho presentes no Deal do Bitrix (crm.deal.get/list) ou na nossa escrita."""
+        from django.utils import timezone
+        from django.utils.dateparse import parse_datetime
+        fields = {"synced_at": timezone.now()}
+        contact_id = contact_id or deal.get("CONTACT_ID")
+        lead_id = lead_id or deal.get("LEAD_ID")
+        if contact_id: fields["contact_id"] = str(contact_id)
+        if lead_id: fields["lead_id"] = str(lead_id)
+        if deal.get("STAGE_ID") is not None: fields["stage_id"] = str(deal["STAGE_ID"])
+        if deal.get("CLOSED") is not None: fields["closed"] = deal["CLOSED"] in ("Y", True)
+        if deal.get("TITLE") is not None: fields["title"] = str(deal["TITLE"])[:255]
+        if deal.get("OPPORTUNITY") not in (None, ""):
+            fields["opportunity"] = BitrixDealMirror._decimal(deal["OPPORTUNITY"])
+        if deal.get("DATE_MODIFY"):
+            try: fields["date_modify"] = parse_datetime(str(deal["DATE_MODIFY"]))
+            except ValueError: pass
+        payment_field = BitrixConfig.DEAL_FIELDS["PAYMENT_STATUS"]
+        if payment_field in deal:
+            status = BitrixDealMirror._first_value(deal.get(payment_field))
+            fields["payment_status"] = str(status)[:100] if status not in (None, "") else None
+        return fields
+
+    @staticmethod
+    def record(deal: Dict[str, Any], contact_id: Any = None, lead_id: Any = None) -> Optional[Any]:
+        """Upsert a partir de um Deal do Bitrix (crm.deal.get/list) ou da nossa escrita. Só atualiza os campos presentes."""
+        from .models import BitrixDeal
+        try:
+            deal_id = int(deal.get("ID"))
+        except (TypeError, ValueError):
+            return None
+
+        try:
+            row, _ = BitrixDeal.objects.update_or_create(deal_id=deal_id, defaults=BitrixDealMirror._fields(deal, contact_id, lead_id))
+            return row
+        except Exception as e:
+            logger.warning(f"⚠️ Falha atualizando espelho do Deal {deal_id}: {e}")
+            return None
+
+    @staticmethod
+    def record_many(deals: List[Dict[str, Any]], rows_by_deal: Optional[Dict[int, List[Dict]]] = None) -> int:
+        """
+        Upsert em bloco (reconciliação): bulk_create dos novos + bulk_update dos existentes, e troca dos
+        produtos dos Deals presentes em rows_by_deal. Chamar dentro de transaction.atomic().
+        """
+        from django.utils import timezone
+        from .models import BitrixDeal, BitrixDealRow
+        parsed = {}
+        for deal in deals:
+            try: parsed[int(deal.get("ID"))] = BitrixDealMirror._fields(deal)
+            except (TypeError, ValueError): continue
+        if not parsed: return 0
+
+        existing = BitrixDeal.objects.in_bulk(list(parsed), field_name='deal_id')
+        to_create, to_update, updated_fields = [], [], {'updated_at'}
+        now = timezone.now()
+        for deal_id, fields in parsed.items():
+            row = existing.get(deal_id)
+            if row is None:
+                to_create.append(BitrixDeal(deal_id=deal_id, **fields))
+                continue
+            for name, value in fields.items():
+                setattr(row, name, value)
+            row.updated_at = now
+            updated_fields.update(fields)
+            to_update.append(row)
+        BitrixDeal.objects.bulk_create(to_create)
+        if to_update:
+            BitrixDeal.objects.bulk_update(to_update, sorted(updated_fields))
+
+        if rows_by_deal:
+            deals_by_id = BitrixDeal.objects.in_bulk([d for d in rows_by_deal if d in parsed], field_name='deal_id')
+            BitrixDealRow.objects.filter(deal__in=deals_by_id.values()).delete()
+            items = []
+            for deal_id, deal in deals_by_id.items():
+                for i, r in enumerate(rows_by_deal.get(deal_id) or []):
+                    items.append(BitrixDealMirror._row(deal, r, i))
+            BitrixDealRow.objects.bulk_create(items)
+            BitrixDeal.objects.filter(pk__in=[d.pk for d in deals_by_id.values()]).update(rows_synced_at=now)
+        return len(parsed)
+
+    @staticmethod
+    def _row(deal: Any, r: Dict[str, Any], sort: int) -> Any:
+        from .models import BitrixDealRow
+        try: product_id = int(r.get("PRODUCT_ID") or 0) or None
+        except (TypeError, ValueError): product_id = None
+        return BitrixDealRow(
+            deal=deal,
+            product_id=product_id,
+            product_name=str(r.get("PRODUCT_NAME") or "")[:255],
+            price=BitrixDealMirror._decimal(r.get("PRICE")),
+            quantity=BitrixDealMirror._decimal(r.get("QUANTITY"), "1"),
+            sort=sort,
+        )
+
+    @staticmethod
+    def record_rows(deal_id: Any, rows: List[Dict[str, Any]]) -> Optional[Any]:
+        """Substitui os produtos espelhados do Deal (rows no formato do crm.deal.productrows.get/set)."""
+        from django.db import transaction
+        from django.utils import timezone
+        from .models import BitrixDeal, BitrixDealRow
+        try:
+            with transaction.atomic():
+                deal, _ = BitrixDeal.objects.get_or_create(deal_id=int(deal_id))
+                BitrixDealRow.objects.filter(deal=deal).delete()
+                BitrixDealRow.objects.bulk_create([
+                    BitrixDealMirror._row(deal, r, i) for i, r in enumerate(rows if isinstance(rows, list) else [])
+                ])
+                deal.rows_synced_at = timezone.now()
+                deal.save(update_fields=['rows_synced_at', 'updated_at'])
+            return deal
+        except Exception as e:
+            logger.warning(f"⚠️ Falha atualizando produtos espelhados do Deal {deal_id}: {e}")
+            return None
+
+    @staticmethod
+    def forget(deal_id: Any) -> Optional[str]:
+        """Remove o Deal do espelho. Retorna o Contato dele (para reaplicar o plano de quem apontava para ele)."""
+        from .models import BitrixDeal
+        try:
+            deals = BitrixDeal.objects.filter(deal_id=int(deal_id))
+        except (TypeError, ValueError):
+            return None
+        contact_id = deals.values_list('contact_id', flat=True).first()
+        deals.delete()
+        return contact_id
+
+    @staticmethod
+    def refresh(deal_ids: List[Any]) -> Dict[str, Dict[str, Any]]:
+        """
+        Relê Deals (cabeçalho + produtos) do Bitrix e grava no espelho: 2 comandos por Deal, em batch.
+        Retorna {deal_id: deal}. Deal que o Bitrix diz não existir (removido) sai do espelho; outro erro no
+        crm.deal.get (cota, permissão, erro interno) mantém a linha e levanta BitrixCommandError depois de
+        gravar os demais.
+        """
+        ids = [str(d) for d in dict.fromkeys(deal_ids) if d]
+        if not ids: return {}
+        batch = BitrixBatch()
+        for deal_id in ids:
+            batch.add(f'deal_{deal_id}', 'crm.deal.get', {"id": deal_id})
+            batch.add(f'rows_{deal_id}', 'crm.deal.productrows.get', {"id": deal_id})
+        batch.execute(expect_errors=True)
+
+        refreshed, errors = {}, {}
+        for deal_id in ids:
+            if f'deal_{deal_id}' in batch.errors:
+                if batch.not_found(f'deal_{deal_id}'):
+                    BitrixDealMirror.forget(deal_id)
+                else:
+                    errors[deal_id] = batch.errors[f'deal_{deal_id}']
+                continue
+            deal = batch.get(f'deal_{deal_id}')
+            if not isinstance(deal, dict) or not deal or not BitrixDealMirror.record(deal):
+                continue
+            if not batch.failed(f'rows_{deal_id}'):
+                BitrixDealMirror.record_rows(deal_id, batch.get(f'rows_{deal_id}', []))
+            refreshed[deal_id] = deal
+        if errors:
+            raise BitrixCommandError(errors)
+        return refreshed
+
+    @staticmethod
+    def sync_user(user: Any) -> Optional[Any]:
+        """
+        Busca no Bitrix o Deal atual do usuário (por Contato e por Lead, 1 round-trip) e grava no espelho.
+        Sem id_bitrix: tenta vincular pelo e-mail antes.
+        """
+        if not getattr(user, 'id_bitrix', None):
+            found_id = BitrixService._find_bitrix_id_by_email(user.email)
+            if not found_id: return None
+            user.id_bitrix = str(found_id)
+            user.save(update_fields=['id_bitrix'])
+
+        deal_select = ["ID", "CONTACT_ID", "LEAD_ID", "STAGE_ID", "CLOSED", "TITLE", "OPPORTUNITY", "DATE_MODIFY",
+                       BitrixConfig.DEAL_FIELDS["PAYMENT_STATUS"]]
+        batch = BitrixBatch()
+        for source, field in (('contact', 'CONTACT_ID'), ('lead', 'LEAD_ID')):
+            batch.add(f'deals_{source}', 'crm.deal.list', {
+                "filter": {field: user.id_bitrix}, "order": {"ID": "DESC"}, "select": deal_select
+            })
+            batch.add(f'rows_{source}', 'crm.deal.productrows.get', {"id": BitrixBatch.ref(f'deals_{source}', 0, 'ID')})
+        batch.execute(expect_errors=True)
+
+        # Contato tem prioridade (mesmo critério das leituras)
+        for source in ('contact', 'lead'):
+            deals = batch.get(f'deals_{source}')
+            if not deals or not isinstance(deals, list): continue
+            row = BitrixDealMirror.record(deals[0], **{f"{source}_id": user.id_bitrix})
+            if row and not batch.failed(f'rows_{source}'):
+                row = BitrixDealMirror.record_rows(row.deal_id, batch.get(f'rows_{source}', [])) or row
+            return row
+        return None
+
+    @staticmethod
+    def request_sync(user: Any) -> Optional[Any]:
+        """
+        Agenda (outbox) a sincronização do Deal do usuário. Não duplica se já houver uma na fila
+        ou se uma terminou há menos de BITRIX_DEAL_MIRROR_MAX_AGE_MINUTES (ex: usuário sem Deal).
+        """
+        from datetime import timedelta
+        from django.db.models import Q
+        from django.utils import timezone
+        from .models import BitrixOutbox
+        if not getattr(user, 'pk', None): return None
+        reference = f"deal_mirror:user:{user.pk}"
+        recent = timezone.now() - timedelta(minutes=BitrixDealMirror._max_age_minutes())
+        try:
+            if BitrixOutbox.objects.filter(reference=reference).filter(
+                Q(status__in=[BitrixOutbox.Status.PENDING, BitrixOutbox.Status.PROCESSING]) |
+                Q(status=BitrixOutbox.Status.DONE, processed_at__gte=recent)
+            ).exists():
+                return None
+            return BitrixOutboxService.enqueue(BitrixDealMirror.OUTBOX_KIND, {"user_id": user.pk}, user=user, reference=reference)
+        except Exception as e:
+            logger.warning(f"⚠️ Falha ao agendar sincronização do Deal de {getattr(user, 'email', user.pk)}: {e}")
+            return None
+
+    @staticmethod
+    def handle_outbox(event: Any):
+        """Handler do outbox: sincroniza o espelho e reaplica o plano a partir dele."""
+        from .models import User
+        user = event.user or User.objects.filter(pk=(event.payload or {}).get('user_id')).first()
+        if not user: return
+        row = BitrixDealMirror.sync_user(user)
+        if row:
+            BitrixDealMirror.reapply([user], 'deal_mirror')
+        else:
+            from .profile_snapshot import ProfileSnapshotService
+            invalidate_tag(f"user:{user.pk}")
+            ProfileSnapshotService.schedule(user.pk, 'deal_mirror')
+
+    @staticmethod
+    def reapply(users: List[Any], reason: str) -> None:
+        """Plano/equipe médica a partir do espelho (sem chamada ao Bitrix), depois protocolo e perfil de cada usuário."""
+        from .profile_snapshot import ProfileSnapshotService
+        for user in users:
+            BitrixService.check_and_update_user_plan(user)
+            invalidate_tag(f"user:{user.pk}")
+            ProfileSnapshotService.schedule(user.pk, reason)
+
+    @staticmethod
+    def reapply_contacts(contact_ids: List[Any], reason: str) -> None:
+        from .models import User
+        contact_ids = [str(c) for c in contact_ids if c]
+        if contact_ids:
+            BitrixDealMirror.reapply(list(User.objects.filter(id_bitrix__in=contact_ids)), reason)
+
+
+class BitrixOutboxService:
+    """
+    Outbox transacional das escritas no Bitrix (modelo BitrixOutbox).
+    - enqueue(): chamado DENTRO do atomic() da escrita local; a escrita no Bitrix só existe se o commit local existir.
+    - process_due(): worker (process_bitrix_outbox) drena a fila fora do request.
+      Ordem por usuário: um evento só roda quando os anteriores do mesmo usuário terminaram.
+      Falhas voltam para a fila com backoff; depois da última tentativa ficam como FAILED.
+    """
+    # kind -> classe com handle_outbox(event). Import tardio: os handlers vivem nos apps que geram a escrita.
+    HANDLERS = {
+        'sync_transaction': 'apps.financial.services.BitrixTransactionSync',
+        'sync_deal_mirror': 'apps.accounts.services.BitrixDealMirror',
+        'sync_profile_contact': 'apps.accounts.profile_snapshot.ProfileSnapshotService',
+        'provision_lead': 'apps.accounts.services.LeadConversionService',
+    }
+    # Espera antes da próxima tentativa (por tentativa já feita); depois da última, FAILED
+    BACKOFF_SECONDS = [10, 30, 120, 300, 900, 1800, 3600, 3 * 3600]
+    # Evento em PROCESSING há mais que isso = worker morreu no meio; volta a ser elegível
+    LEASE_SECONDS = 600
+
+    @staticmethod
+    def enqueue(kind: str, payload: Optional[Dict] = None, user: Any = None, reference: Optional[str] = None,
+                dedupe_key: Optional[str] = None) -> Any:
+        from django.utils import timezone
+        from .models import BitrixOutbox
+        if kind not in BitrixOutboxService.HANDLERS:
+            raise ValueError(f"Tipo de evento de outbox desconhecido: {kind}")
+
+        fields = {
+            "kind": kind,
+            "payload": payload or {},
+            "user": user if getattr(user, 'pk', None) else None,
+            "reference": reference,
+            "next_attempt_at": timezone.now(),
+        }
+        if dedupe_key:
+            event, created = BitrixOutbox.objects.get_or_create(dedupe_key=dedupe_key, defaults=fields)
+            if not created:
+                logger.info(f"📮 Outbox: {dedupe_key} já enfileirado (#{event.pk}), ignorando duplicata.")
+            return event
+        return BitrixOutbox.objects.create(**fields)
+
+    @staticmethod
+    def has_active(reference: str) -> bool:
+        from .models import BitrixOutbox
+        return BitrixOutbox.objects.filter(
+            reference=reference, status__in=[BitrixOutbox.Status.PENDING, BitrixOutbox.Status.PROCESSING]
+        ).exists()
+
+    @staticmethod
+    def claim(limit: int = 20) -> List[Any]:
+        """Reserva (PROCESSING) os próximos eventos vencidos, no máximo um por usuário (o mais antigo)."""
+        from datetime import timedelta
+        from django.db import transaction
+        from django.db.models import Exists, OuterRef, Q
+        from django.utils import timezone
+        from .models import BitrixOutbox
+
+        now = timezone.now()
+        active = [BitrixOutbox.Status.PENDING, BitrixOutbox.Status.PROCESSING]
+        earlier_for_user = BitrixOutbox.objects.filter(user_id=OuterRef('user_id'), pk__lt=OuterRef('pk'), status__in=active)
+
+        with transaction.atomic():
+            events = list(
+                BitrixOutbox.objects.select_for_update(skip_locked=True)
+                .filter(Q(status=BitrixOutbox.Status.PENDING, next_attempt_at__lte=now) |
+                        Q(status=BitrixOutbox.Status.PROCESSING, locked_at__lt=now - timedelta(seconds=BitrixOutboxService.LEASE_SECONDS)))
+                .exclude(Exists(earlier_for_user))
+                .order_by('pk')[:limit]
+            )
+            for event in events:
+                event.status = BitrixOutbox.Status.PROCESSING
+                event.locked_at = now
+                event.attempts += 1
+            BitrixOutbox.objects.bulk_update(events, ['status', 'locked_at', 'attempts'])
+        return events
+
+    @staticmethod
+    def run(event: Any) -> bool:
+        from django.utils import timezone
+        from django.utils.module_loading import import_string
+        from datetime import timedelta
+        from .models import BitrixOutbox
+
+        try:
+            handler = import_string(BitrixOutboxService.HANDLERS[event.kind])
+            handler.handle_outbox(event)
+        except Exception as e:
+            event.last_error = f"{type(e).__name__}: {e}"[:2000]
+            if event.attempts >= len(BitrixOutboxService.BACKOFF_SECONDS):
+                event.status = BitrixOutbox.Status.FAILED
+                event.processed_at = timezone.now()
+                logger.error(f"❌ Outbox #{event.pk} ({event.kind}) falhou definitivamente após {event.attempts} tentativas: {e}")
+            else:
+                event.status = BitrixOutbox.Status.PENDING
+                event.next_attempt_at = timezone.now() + timedelta(seconds=BitrixOutboxService.BACKOFF_SECONDS[event.attempts - 1])
+                logger.warning(f"⚠️ Outbox #{event.pk} ({event.kind}) tentativa {event.attempts} falhou, nova tentativa em {event.next_attempt_at:%H:%M:%S}: {e}")
+            event.save(update_fields=['status', 'next_attempt_at', 'last_error', 'processed_at'])
+            return False
+
+        event.status = BitrixOutbox.Status.DONE
+        event.processed_at = timezone.now()
+        event.last_error = ''
+        event.save(update_fields=['status', 'processed_at', 'last_error'])
+        return True
+
+    @staticmethod
+    def process_due(limit: int = 20) -> Dict[str, int]:
+        stats = {"claimed": 0, "done": 0, "failed": 0}
+        for event in BitrixOutboxService.claim(limit):
+            stats["claimed"] += 1
+            stats["done" if BitrixOutboxService.run(event) else "failed"] += 1
+        return stats
+
+    @staticmethod
+    def purge(days: int = 30) -> int:
+        """Remove eventos concluídos antigos (os FAILED ficam para auditoria)."""
+        from django.utils import timezone
+        from datetime import timedelta
+        from .models import BitrixOutbox
+        deleted, _ = BitrixOutbox.objects.filter(
+            status=BitrixOutbox.Status.DONE, processed_at__lt=timezone.now() - timedelta(days=days)
+        ).delete()
+        return deleted
+
+
+class BitrixWebhookIngestService:
+    """
+    Ingestão bufferizada dos webhooks do Bitrix (modelo BitrixWebhookEvent).
+    - ingest(): a view só grava o evento e responde 200 (o Bitrix desativa webhooks lentos/com erro).
+    - process_pending(): consumidor (process_bitrix_webhooks, uma instância) processa em background:
+      rajadas da mesma entidade viram um único processamento (o evento mais novo, após um período
+      de silêncio) e eventos que são eco das nossas próprias escritas (BitrixLocalWrite) são descartados.
+      Erro transitório (TRANSIENT_ERRORS) deixa o evento PENDING com backoff (mesmo escalonamento do outbox);
+      depois da última tentativa, FAILED.
+    """
+    # Prefixo do evento -> tipo da entidade (chave de agrupamento "deal:123")
+    ENTITY_EVENTS = {'ONCRMDEAL': 'deal', 'ONCRMLEAD': 'lead', 'ONCRMCONTACT': 'contact', 'ONCRMPRODUCT': 'product'}
+
+    @staticmethod
+    def _coalesce_seconds() -> float:
+        return float(getattr(settings, 'BITRIX_WEBHOOK_COALESCE_SECONDS', 5))
+
+    @staticmethod
+    def _echo_seconds() -> float:
+        return float(getattr(settings, 'BITRIX_WEBHOOK_ECHO_SECONDS', 30))
+
+    @staticmethod
+    def entity_key(event: str, entity_id: Any) -> Optional[str]:
+        if not entity_id: return None
+        for prefix, entity_type in BitrixWebhookIngestService.ENTITY_EVENTS.items():
+            if event.startswith(prefix):
+                return f"{entity_type}:{entity_id}"
+        return None
+
+    @staticmethod
+    def ingest(data: Any) -> Any:
+        from .models import BitrixWebhookEvent
+        # QueryDict (form-urlencoded do Bitrix) ou dict; o token de auth não é persistido
+        payload = {k: v for k, v in data.items() if not str(k).startswith('auth[')}
+        event = str(payload.get('event') or '')[:60]
+        return BitrixWebhookEvent.objects.create(
+            event=event,
+            entity=BitrixWebhookIngestService.entity_key(event, payload.get('data[FIELDS][ID]')),
+            payload=payload,
+        )
+
+    @staticmethod
+    def note_local_write(entity_type: str, entity_id: Any):
+        """
+        Registra que NÓS acabamos de escrever na entidade: o próximo webhook que o Bitrix dispara é eco.
+        Uma escrita = um eco esperado; os seguintes (ex: edição do comercial logo depois) são processados.
+        """
+        from datetime import timedelta
+        from django.db.models import Case, F, Value, When
+        from django.utils import timezone
+        from .models import BitrixLocalWrite
+        if not entity_id: return
+        entity = f"{entity_type}:{entity_id}"
+        now = timezone.now()
+        window_start = now - timedelta(seconds=BitrixWebhookIngestService._echo_seconds())
+        try:
+            # Eco de uma escrita anterior ainda dentro da janela continua esperado; fora dela, não conta mais
+            updated = BitrixLocalWrite.objects.filter(entity=entity).update(
+                written_at=now,
+                pending_echoes=Case(When(written_at__gte=window_start, then=F('pending_echoes') + 1), default=Value(1)),
+            )
+            if not updated:
+                BitrixLocalWrite.objects.get_or_create(entity=entity, defaults={"written_at": now})
+        except Exception as e:
+            logger.warning(f"⚠️ Falha registrando escrita local em {entity}: {e}")
+
+    @staticmethod
+    def _consume_echoes(write: Any, count: int):
+        from django.db.models import F
+        from .models import BitrixLocalWrite
+        if count >= write.pending_echoes:
+            BitrixLocalWrite.objects.filter(pk=write.pk).delete()
+        else:
+            BitrixLocalWrite.objects.filter(pk=write.pk).update(pending_echoes=F('pending_echoes') - count)
+
+    @staticmethod
+    def process_pending(limit: int = 200) -> Dict[str, int]:
+        from collections import OrderedDict
+        from datetime import timedelta
+        from django.db.models import Q
+        from django.utils import timezone
+        from .models import BitrixWebhookEvent, BitrixLocalWrite
+
+        now = timezone.now()
+        settled_before = now - timedelta(seconds=BitrixWebhookIngestService._coalesce_seconds())
+        echo_window = timedelta(seconds=BitrixWebhookIngestService._echo_seconds())
+        stats = {"processed": 0, "coalesced": 0, "echo": 0, "retry": 0, "failed": 0, "waiting": 0}
+
+        events = list(
+            BitrixWebhookEvent.objects.filter(status=BitrixWebhookEvent.Status.PENDING)
+            .filter(Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now))
+            .order_by('pk')[:limit]
+        )
+        groups = OrderedDict()
+        for event in events:
+            groups.setdefault(event.entity or f"#{event.pk}", []).append(event)
+        writes = BitrixLocalWrite.objects.in_bulk([k for k in groups if not k.startswith('#')])
+
+        for key, group in groups.items():
+            latest = group[-1]
+            # Rajada ainda chegando: espera o período de silêncio para processar uma vez só
+            if latest.entity and latest.received_at > settled_before:
+                stats["waiting"] += len(group)
+                continue
+
+            # Eco: evento dentro da janela da nossa escrita, no máximo um por escrita. A escrita é consumida
+            # mesmo quando o grupo também tem eventos reais (o processamento abaixo já lê o estado atual)
+            write = writes.get(key)
+            echoes = 0
+            if write:
+                in_window = sum(1 for e in group if abs(e.received_at - write.written_at) <= echo_window)
+                echoes = min(in_window, write.pending_echoes)
+                if echoes:
+                    BitrixWebhookIngestService._consume_echoes(write, echoes)
+            if echoes and echoes == len(group):
+                BitrixWebhookEvent.objects.filter(pk__in=[e.pk for e in group]).update(
+                    status=BitrixWebhookEvent.Status.ECHO, processed_at=now)
+                stats["echo"] += len(group)
+                continue
+
+            if len(group) > 1:
+                BitrixWebhookEvent.objects.filter(pk__in=[e.pk for e in group[:-1]]).update(
+                    status=BitrixWebhookEvent.Status.COALESCED, processed_at=now)
+                stats["coalesced"] += len(group) - 1
+
+            try:
+                BitrixService.process_incoming_webhook(latest.payload)
+                latest.status = BitrixWebhookEvent.Status.PROCESSED
+                latest.processed_at = timezone.now()
+                stats["processed"] += 1
+            except TRANSIENT_ERRORS as e:
+                # Bitrix fora: os eventos anteriores já foram agrupados neste, então ele não pode se perder
+                latest.attempts += 1
+                latest.error = f"{type(e).__name__}: {e}"[:2000]
+                backoff = BitrixOutboxService.BACKOFF_SECONDS
+                if latest.attempts > len(backoff):
+                    logger.error(f"❌ Webhook {latest.event} ({key}) falhou definitivamente após {latest.attempts} tentativas: {e}")
+                    latest.status = BitrixWebhookEvent.Status.FAILED
+                    latest.processed_at = timezone.now()
+                    stats["failed"] += 1
+                else:
+                    latest.next_attempt_at = timezone.now() + timedelta(seconds=backoff[latest.attempts - 1])
+                    logger.warning(f"⚠️ Webhook {latest.event} ({key}) tentativa {latest.attempts} falhou, nova tentativa em {latest.next_attempt_at:%H:%M:%S}: {e}")
+                    stats["retry"] += 1
+            except Exception as e:
+                logger.error(f"❌ Erro processando Webhook {latest.event} ({key}): {e}")
+                latest.status = BitrixWebhookEvent.Status.FAILED
+                latest.error = f"{type(e).__name__}: {e}"[:2000]
+                latest.processed_at = timezone.now()
+                stats["failed"] += 1
+            latest.save(update_fields=['status', 'processed_at', 'error', 'attempts', 'next_attempt_at'])
+        return stats
+
+    @staticmethod
+    def purge(days: int = 7) -> int:
+        from django.utils import timezone
+        from datetime import timedelta
+        from .models import BitrixWebhookEvent, BitrixLocalWrite
+        cutoff = timezone.now() - timedelta(days=days)
+        deleted, _ = BitrixWebhookEvent.objects.exclude(status=BitrixWebhookEvent.Status.PENDING).filter(received_at__lt=cutoff).delete()
+        BitrixLocalWrite.objects.filter(written_at__lt=cutoff).delete()
+        return deleted
+
+
+class BitrixDeltaSyncService:
+    """
+    Reconciliação incremental com o Bitrix (comando bitrix_delta_sync).
+    Lê de crm.deal/contact/lead.list só o que mudou desde a última execução (>DATE_MODIFY, high-water
+    mark em BitrixSyncCursor) e aplica no estado local em bloco, uma página (50 registros) por vez:
+    custo O(registros alterados), não O(usuários).
+    Paginação por chave (BitrixService.iter_list_pages com after_id): estável mesmo com registros mudando.
+    O progresso é gravado junto com cada página aplicada: depois de um crash, continua de onde parou.
+    """
+    # Lease do cursor: impede duas execuções simultâneas na mesma entidade (renovado a cada página)
+    LEASE_SECONDS = 600
+    CONTACT_SELECT = ["ID", "DATE_MODIFY", "PHONE", "ADDRESS", "ADDRESS_2", "ADDRESS_CITY", "ADDRESS_PROVINCE",
+                      "ADDRESS_POSTAL_CODE", "ADDRESS_COUNTRY"]
+    LEAD_SELECT = ["ID", "STATUS_ID", "CONTACT_ID", "DATE_MODIFY"]
+
+    @staticmethod
+    def _select(entity: str) -> List[str]:
+        if entity == 'deal':
+            return ["ID", "CONTACT_ID", "LEAD_ID", "STAGE_ID", "CLOSED", "TITLE", "OPPORTUNITY", "DATE_MODIFY",
+                    BitrixConfig.DEAL_FIELDS["PAYMENT_STATUS"]]
+        return BitrixDeltaSyncService.CONTACT_SELECT if entity == 'contact' else BitrixDeltaSyncService.LEAD_SELECT
+
+    @staticmethod
+    def _overlap():
+        from datetime import timedelta
+        # Relê uma janela antes do high-water: cobre diferença de relógio com o Bitrix e gravações em andamento
+        return timedelta(seconds=getattr(settings, 'BITRIX_DELTA_SYNC_OVERLAP_SECONDS', 300))
+
+    @staticmethod
+    def _acquire(entity: str) -> Optional[Any]:
+        from datetime import timedelta
+        from django.db.models import Q
+        from django.utils import timezone
+        from .models import BitrixSyncCursor
+        BitrixSyncCursor.objects.get_or_create(entity=entity)
+        now = timezone.now()
+        claimed = BitrixSyncCursor.objects.filter(entity=entity).filter(
+            Q(locked_until__isnull=True) | Q(locked_until__lt=now)
+        ).update(locked_until=now + timedelta(seconds=BitrixDeltaSyncService.LEASE_SECONDS))
+        return BitrixSyncCursor.objects.get(entity=entity) if claimed else None
+
+    @staticmethod
+    def reset(entity: str, since: Any = None) -> None:
+        """Reinicia o cursor (since=None: próxima execução relê tudo)."""
+        from .models import BitrixSyncCursor
+        BitrixSyncCursor.objects.update_or_create(entity=entity, defaults={
+            "high_water": since, "run_since": None, "run_last_id": None, "run_max_modified": None, "run_started_at": None,
+        })
+
+    @staticmethod
+    def sync(entity: str, max_pages: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Executa (ou retoma) a reconciliação de uma entidade. max_pages limita o trabalho desta chamada:
+        a execução fica aberta no cursor e a próxima chamada continua dela.
+        """
+        from datetime import timedelta
+        from django.db import transaction
+        from django.utils import timezone
+        from django.utils.dateparse import parse_datetime
+
+        cursor = BitrixDeltaSyncService._acquire(entity)
+        if cursor is None:
+            return {"entity": entity, "skipped": True}
+
+        stats = {"entity": entity, "pages": 0, "records": 0, "applied": 0, "resumed": cursor.run_last_id is not None, "completed": False}
+        try:
+            if cursor.run_last_id is None:
+                cursor.run_since = cursor.high_water
+                cursor.run_last_id = 0
+                cursor.run_max_modified = cursor.high_water
+                cursor.run_started_at = timezone.now()
+                cursor.save(update_fields=['run_since', 'run_last_id', 'run_max_modified', 'run_started_at', 'updated_at'])
+            elif stats["resumed"]:
+                logger.info(f"⏯️ Delta sync {entity}: retomando após ID {cursor.run_last_id} (desde {cursor.run_since}).")
+
+            filters = {">DATE_MODIFY": cursor.run_since.isoformat()} if cursor.run_since else {}
+            # Próxima página já vem sendo buscada enquanto esta é aplicada (iter_list_pages, prefetch)
+            pages = BitrixService.iter_list_pages(f'crm.{entity}.list', {"filter": filters},
+                                                  select=BitrixDeltaSyncService._select(entity), after_id=cursor.run_last_id)
+            for page in pages:
+                prepared = BitrixDeltaSyncService._prepare(entity, page)
+                with transaction.atomic():
+                    stats["applied"] += BitrixDeltaSyncService._apply(entity, page, prepared)
+                    cursor.run_last_id = max(int(r["ID"]) for r in page)
+                    for r in page:
+                        modified = parse_datetime(str(r.get("DATE_MODIFY") or "")) if r.get("DATE_MODIFY") else None
+                        if modified and (cursor.run_max_modified is None or modified > cursor.run_max_modified):
+                            cursor.run_max_modified = modified
+                    cursor.locked_until = timezone.now() + timedelta(seconds=BitrixDeltaSyncService.LEASE_SECONDS)
+                    cursor.save(update_fields=['run_last_id', 'run_max_modified', 'locked_until', 'updated_at'])
+                BitrixDeltaSyncService._after_apply(entity, page)
+
+                stats["pages"] += 1
+                stats["records"] += len(page)
+                if max_pages and stats["pages"] >= max_pages and len(page) >= BitrixService.LIST_PAGE_SIZE:
+                    pages.close()
+                    return stats
+
+            # Execução completa: avança o high-water (com sobreposição) e fecha a execução.
+            # Limitado ao início da execução: a paginação sobe por ID, então um registro de ID menor alterado
+            # depois que a página dele foi lida fica com DATE_MODIFY abaixo do maior visto e seria pulado
+            # (execuções longas, retomadas entre chamadas com --max-pages, primeira leitura completa)
+            if cursor.run_max_modified:
+                newest = min(cursor.run_max_modified, cursor.run_started_at or cursor.run_max_modified)
+                candidate = newest - BitrixDeltaSyncService._overlap()
+                if cursor.high_water is None or candidate > cursor.high_water:
+                    cursor.high_water = candidate
+            stats["completed"] = True
+            cursor.run_since = cursor.run_last_id = cursor.run_max_modified = cursor.run_started_at = None
+            cursor.last_completed_at = timezone.now()
+            cursor.last_stats = stats
+            cursor.save()
+            return stats
+        finally:
+            type(cursor).objects.filter(pk=cursor.pk).update(locked_until=None)
+
+    @staticmethod
+    def _prepare(entity: str, page: List[Dict[str, Any]]) -> Dict[Any, Any]:
+        """Chamadas ao Bitrix necessárias para aplicar a página (fora da transação local)."""
+        if entity != 'deal':
+            return {}
+        # Produtos de todos os Deals da página: 1 batch (50 comandos)
+        batch = BitrixBatch()
+        for deal in page:
+            batch.add(f"rows_{deal['ID']}", 'crm.deal.productrows.get', {"id": deal["ID"]})
+        batch.execute(expect_errors=True)
+        return {int(d["ID"]): batch.get(f"rows_{d['ID']}", []) for d in page if not batch.failed(f"rows_{d['ID']}")}
+
+    @staticmethod
+    def _apply(entity: str, page: List[Dict[str, Any]], prepared: Dict[Any, Any]) -> int:
+        from django.utils import timezone
+        from .models import User
+        if entity == 'deal':
+            return BitrixDealMirror.record_many(page, prepared)
+
+        ids = [str(r["ID"]) for r in page]
+        if entity == 'contact':
+            # Confirma o tipo do id_bitrix de quem aponta para estes Contatos
+            return User.objects.filter(id_bitrix__in=ids).update(
+                bitrix_entity_type=User.BitrixEntityType.CONTACT, bitrix_entity_checked_at=timezone.now()
+            )
+
+        applied = 0
+        converted = {str(r["ID"]): str(r["CONTACT_ID"]) for r in page if r.get("CONTACT_ID")}
+        for lead_id, contact_id in converted.items():
+            applied += LeadConversionService.mark_converted(lead_id, contact_id)
+        open_leads = [i for i in ids if i not in converted]
+        applied += User.objects.filter(id_bitrix__in=open_leads).update(
+            bitrix_entity_type=User.BitrixEntityType.LEAD,
+            bitrix_conversion_status=User.BitrixConversionStatus.PENDING,
+            bitrix_entity_checked_at=timezone.now(),
+        )
+        return applied
+
+    @staticmethod
+    def _after_apply(entity: str, page: List[Dict[str, Any]]) -> None:
+        """Efeitos por usuário afetado (só os usuários desta página), depois do commit."""
+        if entity == 'contact':
+            # Telefone/endereço vieram na própria página: auto-heal + perfil, sem crm.contact.get
+            from .profile_snapshot import ProfileSnapshotService
+            ProfileSnapshotService.apply_contacts(page, reason='delta_sync')
+            return
+        if entity != 'deal':
+            return
+        # Plano/equipe médica a partir do espelho recém-gravado (sem chamada ao Bitrix)
+        BitrixDealMirror.reapply_contacts([r.get("CONTACT_ID") for r in page], 'delta_sync')
+
+
 class PasswordResetService:
     @staticmethod
     def request_password_reset(email: str) -> bool:
@@ -1088,6 +2440,8 @@ class AssignmentService:
                 # Garante perfil de paciente (Resiliência)
                 patient_profile, created = Patients.objects.get_or_create(user=patient_user)
                 
+                team_before = (patient_profile.assigned_trichologist_id, patient_profile.assigned_nutritionist_id)
+
                 # 1. Atribui Tricologista (Se não tiver)
                 if not patient_profile.assigned_trichologist:
                     trichologist = AssignmentService.get_least_loaded_doctor('trichologist')
@@ -1107,6 +2461,9 @@ class AssignmentService:
                         logger.warning("⚠️ Nenhum Nutricionista disponível no sistema.")
                         
                 patient_profile.save()
+                if created or team_before != (patient_profile.assigned_trichologist_id, patient_profile.assigned_nutritionist_id):
+                    from .profile_snapshot import ProfileSnapshotService
+                    ProfileSnapshotService.schedule(patient_user.pk, 'medical_team')
                 return patient_profile
         except Exception as e:
             logger.error(f"❌ Erro ao atribuir equipe médica: {e}")
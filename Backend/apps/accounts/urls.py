@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
-from .views import RegisterView, UserQuestionnaireListView, MyTokenObtainPairView, SubscribeView, RecommendationView, UpdateAddressView, UserProfileView, UserProtocolView, UserUpdateView, BitrixWebhookView, PasswordResetRequestView, PasswordResetConfirmView, DoctorRegisterView, DoctorProfileUpdateView
+from .views import RegisterView, UserQuestionnaireListView, MyTokenObtainPairView, SubscribeView, RecommendationView, UpdateAddressView, UserProfileView, UserProtocolView, UserUpdateView, BitrixWebhookView, IntegrationStatusView, PasswordResetRequestView, PasswordResetConfirmView, DoctorRegisterView, DoctorProfileUpdateView
 
 urlpatterns = [
     # Rota de Cadastro
@@ -27,6 +27,9 @@ urlpatterns = [
     
     # Webhooks
     path('webhooks/bitrix/', BitrixWebhookView.as_view(), name='bitrix_webhook'),
+
+    # Diagnóstico das Integrações (Admin)
+    path('integrations/status/', IntegrationStatusView.as_view(), name='integrations_status'),
     
     # Perfil Completo (Bitrix)
     path('profile/', UserProfileView.as_view(), name='user_profile'),
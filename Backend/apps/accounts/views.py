@@ -3,9 +3,11 @@
 import logging
 from rest_framework import status, generics
 from django.db import transaction
+from django.http import HttpResponse
+from django.views import View
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAuthenticated, IsAdminUser
 from rest_framework_simplejwt.views import TokenObtainPairView
 from .models import User, UserQuestionnaire
 from .serializers import (
@@ -13,7 +15,10 @@ from .serializers import (
     MyTokenObtainPairSerializer, 
     UserQuestionnaireSerializer
 )
-from .services import BitrixService
+from .services import BitrixService, BitrixWebhookIngestService
+from .cache_utils import singleflight
+from .profile_snapshot import ProfileSnapshotService
+from .authentication import ClaimsJWTAuthentication
 
 logger = logging.getLogger(__name__)
 
@@ -37,28 +42,10 @@ class RegisterView(generics.CreateAPIView):
         
         if serializer.is_valid():
             try:
-                # 1. Salva no Banco Local
+                # Banco local + questionário; o Lead (com o endereço) sai pelo outbox (RegisterSerializer.create)
                 user = serializer.save()
                 logger.info(f"✅ Usuário Local Criado: {user.email}")
 
-                # 2. Envia para o Bitrix
-                try:
-                    answers = request.data.get('questionnaire_data', {})
-                    address_data = request.data.get('address_data', {}) # <--- CAPTURA O ENDEREÇO
-                    
-                    logger.info("🚀 Enviando dados (Lead + Endereço) para o Bitrix...")
-                    
-                    # Passamos o endereço para a função create_lead
-                    bitrix_id = BitrixService.create_lead(user, answers, address_data)
-                    
-                    if bitrix_id:
-                        user.id_bitrix = str(bitrix_id)
-                        user.save()
-                        logger.info(f"✅ Bitrix Vinculado! ID: {bitrix_id}")
-                    
-                except Exception as e_bitrix:
-                    logger.error(f"❌ Erro Bitrix: {e_bitrix}")
-
                 return Response({
                     "message": "Sucesso",
                     "user": {"id": user.id, "email": user.email}
@@ -164,9 +151,8 @@ class UpdateAddressView(APIView):
             user.save()
             logger.info(f"✅ Endereço salvo localmente para {user.email}")
             
-            # 3. Limpar Cache do Perfil
-            from django.core.cache import cache
-            cache.delete(f"user_profile_full_{user.id}")
+            # 3. Reconstrói o perfil
+            ProfileSnapshotService.schedule(user.id, 'address')
 
             return Response({"message": "Endereço atualizado com sucesso."}, status=status.HTTP_200_OK)
 
@@ -176,211 +162,14 @@ class UpdateAddressView(APIView):
 
 class UserProfileView(APIView):
     """
-    Retorna o perfil completo do usuário, incluindo dados do Bitrix.
+    Retorna o perfil completo do usuário (plano, equipe médica, pagamento, dados do Bitrix).
+    Leitura do read model UserProfileSnapshot, mantido pelos eventos de domínio (ver profile_snapshot.py).
     """
     permission_classes = [IsAuthenticated]
+    authentication_classes = [ClaimsJWTAuthentication] # Só precisa do id: sem buscar o User
 
     def get(self, request):
-        user = request.user
-        cache_key = f"user_profile_full_{user.id}"
-
-        # 1. Tenta Cache
-        cached_profile = cache.get(cache_key)
-        if cached_profile:
-            return Response(cached_profile, status=status.HTTP_200_OK)
-        
-        # 2. Dados Básicos do Usuário
-        profile_data = {
-            "name": user.full_name,
-            "email": user.email,
-            "role": user.role,
-            "plan": user.current_plan,
-            "phone": user.phone,
-            "date_of_birth": user.date_of_birth,
-            "address": {
-                "street": user.street,
-                "number": user.number,
-                "city": user.city,
-                "state": user.state,
-                "zip": user.cep,
-                "neighborhood": user.neighborhood,
-                "complement": user.complement
-            }
-        }
-
-        # [MOVED] Logic moved downstream to ensure Fresh Data after Sync
-
-        # [NOVO] Verificar se existe transação Pendente (Para mostrar no Dashboard)
-        # Import local para evitar ciclo se financial importar accounts
-        from apps.financial.models import Transaction
-        
-        # 3. Buscar dados enriquecidos do Bitrix (Telefone, Endereço, PLANO)
-        bitrix_status_report = {}
-        try:
-            # [FIX] Forçar sincronização do plano com Bitrix (Source of Truth)
-            bitrix_status_report = BitrixService.check_and_update_user_plan(user)
-            
-            # Recarrega usuário do banco para pegar o plano atualizado
-            user.refresh_from_db()
-            profile_data['plan'] = user.current_plan
-
-            bitrix_data = BitrixService.get_contact_data(user)
-            
-            # [AUTO-HEAL] Persistência: Se o banco local estiver vazio, trazer do Bitrix
-            updated_local = False
-            
-            if not user.phone and bitrix_data.get('phone'):
-                user.phone = bitrix_data['phone']
-                updated_local = True
-
-            bx_addr = bitrix_data.get('address', {})
-            if not user.street and bx_addr.get('street'):
-                user.street = bx_addr.get('street')
-                user.city = bx_addr.get('city')
-                user.state = bx_addr.get('state')
-                user.cep = bx_addr.get('zip')
-                user.neighborhood = bx_addr.get('neighborhood')
-                # Bitrix pode juntar numero/comp, mas tentamos o básico
-                updated_local = True
-
-            if updated_local:
-                user.save()
-                logger.info(f"🔧 Auto-healing: Dados de Contato recuperados do Bitrix p/ {user.email}")
-
-            # Mescla para o frontend (Prioriza Bitrix se vier algo novo, mas local já está no default)
-            # [FIX] Não sobrescrever telefone local com vazio do Bitrix
-            bitrix_phone = bitrix_data.get('phone')
-            if bitrix_phone:
-                profile_data['phone'] = bitrix_phone
-            
-            # Remove phone do update genérico para evitar overwrite com vazio/None
-            bitrix_data_copy = bitrix_data.copy()
-            if 'phone' in bitrix_data_copy:
-                del bitrix_data_copy['phone']
-
-            profile_data.update(bitrix_data_copy) 
-        except Exception as e:
-            logger.warning(f"⚠️ Erro ao buscar perfil Bitrix: {e}")
-            # Não falha o request, apenas vai sem os dados extras
-
-        # [MOVED HERE] Equipe Médica (Tricologista + Nutricionista)
-        # Refresh User again to be safe
-        user.refresh_from_db()
-        
-        medical_team = {"trichologist": None, "nutritionist": None}
-        try:
-            if hasattr(user, 'patients'):
-                p = user.patients
-                
-                if p.assigned_trichologist:
-                    doc = p.assigned_trichologist
-                    medical_team["trichologist"] = {
-                        "name": doc.user.full_name,
-                        "crm": doc.crm,
-                        "photo": doc.profile_photo.url if doc.profile_photo else None,
-                        "id": str(doc.user.id),
-                        "description": doc.bio
-                    }
-                    
-                if p.assigned_nutritionist:
-                    doc = p.assigned_nutritionist
-                    medical_team["nutritionist"] = {
-                        "name": doc.user.full_name,
-                        "crm": doc.crm,
-                        "photo": doc.profile_photo.url if doc.profile_photo else None,
-                        "id": str(doc.user.id),
-                        "description": doc.bio
-                    }
-        except Exception as e:
-            logger.warning(f"Erro ao montar equipe médica (Pós-Sync): {e}")
-
-        profile_data['medical_team'] = medical_team
-
-        # [NOVO] Payment Info (Last Approved Credit Card)
-        last_cc_tx = Transaction.objects.filter(
-            user=user,
-            payment_type=Transaction.PaymentType.CREDIT_CARD,
-            status=Transaction.Status.APPROVED
-        ).order_by('-created_at').first()
-
-        payment_info = {
-            "has_card": False,
-            "cardName": "",
-            "cardNumber": "",
-            "brand": "",
-            "expiry": "" 
-        }
-
-        if last_cc_tx and last_cc_tx.mp_metadata:
-            # Asaas Response is stored in payment_response
-            resp = last_cc_tx.mp_metadata.get('payment_response', {})
-            # Try to get creditCard object (common in Subscription and Payment response)
-            cc_data = resp.get('creditCard')
-            
-            if cc_data:
-                payment_info = {
-                    "has_card": True,
-                    "cardName": "Cartão Salvo", # Asaas returns holderName? Often not in response, but let's check input
-                    "cardNumber": f"**** **** **** {cc_data.get('creditCardNumber', '****')}",
-                    "brand": cc_data.get('creditCardBrand', 'Desconhecido'),
-                    "expiry": "**/**" # Asaas usually masks this
-                }
-        
-        profile_data['payment_info'] = payment_info
-
-        # [NOVO] Plan Info for UI
-        # Try to get from last Approved Transaction or User
-        plan_name = user.current_plan.capitalize() if user.current_plan else "Nenhum"
-        
-        # Encontra última transação aprovada para saber ciclo/preço
-        last_success_tx = Transaction.objects.filter(
-            user=user, 
-            status=Transaction.Status.APPROVED
-        ).order_by('-created_at').first()
-
-        plan_info = {
-            "name": f"Plano {plan_name}",
-            "cycle": last_success_tx.get_cycle_display() if last_success_tx else "Mensal",
-            "price": f"R$ {last_success_tx.paid_amount}" if last_success_tx else "-",
-            "status": "Ativo",
-            "subscription_status": getattr(user, 'subscription_status', 'active'),
-            "access_until": user.access_valid_until.strftime("%d/%m/%Y") if user.access_valid_until else None,
-            "is_subscription": last_success_tx.asaas_subscription_id is not None if last_success_tx else False,
-            # [NOVO] Downgrade Agendado
-            "scheduled_plan": getattr(user, 'scheduled_plan', None),
-            "scheduled_date": user.scheduled_transition_date.strftime("%d/%m/%Y") if getattr(user, 'scheduled_transition_date', None) else None
-        }
-        
-        # Adjust Display Status for Grace Period
-        if user.subscription_status == 'grace_period':
-             plan_info['status'] = 'Cancelamento Agendado'
-             plan_info['warning'] = f"Seu acesso encerra em {plan_info['access_until']}"
-             
-        profile_data['plan_info'] = plan_info
-
-        pending_tx = Transaction.objects.filter(
-            user=user, 
-            status=Transaction.Status.PENDING
-        ).order_by('-created_at').first()
-
-        bitrix_payment_status = bitrix_status_report.get('payment_status', 'Unknown')
-        is_bitrix_pending = bitrix_payment_status in ['Pendente', 'Em análise', 'Em processo']
-
-
-        if pending_tx or is_bitrix_pending:
-            profile_data['pending_transaction'] = {
-                'exists': True,
-                'order_id': pending_tx.external_reference if pending_tx else None,
-                'payment_method': pending_tx.payment_type if pending_tx else 'pix', # Default Pix se não achar
-                'bitrix_status': bitrix_payment_status # Debug Frontend
-            }
-        else:
-             profile_data['pending_transaction'] = {'exists': False}
-
-        # 4. Salva Cache (5 min)
-        cache.set(cache_key, profile_data, 300)
-
-        return Response(profile_data, status=status.HTTP_200_OK)
+        return Response(ProfileSnapshotService.get(request.user), status=status.HTTP_200_OK)
 
 from django.core.cache import cache
 
@@ -390,17 +179,24 @@ class UserProtocolView(APIView):
     Com Cache de 10 minutos para evitar lentidão.
     """
     permission_classes = [IsAuthenticated]
+    authentication_classes = [ClaimsJWTAuthentication] # Hit no cache só usa o id; miss carrega o User sob demanda
 
     def get(self, request):
-        user = request.user
+        result = self.cached_protocol(request.user)
+        status_code = status.HTTP_400_BAD_REQUEST if not result or "error" in result else status.HTTP_200_OK
+        return Response(result, status=status_code)
+
+    @staticmethod
+    def cached_protocol(user):
+        """1. Tenta pegar do Cache. Miss: um único build por usuário (singleflight)."""
+        return singleflight(f"user_protocol_{user.id}", lambda: UserProtocolView.build_protocol(user)[0])
+
+    @staticmethod
+    def build_protocol(user):
+        """Busca o protocolo e grava no cache. Retorna (dados, status HTTP); também usado pelo warm-up pós-login."""
         cache_key = f"user_protocol_{user.id}"
-        
-        # 1. Tenta pegar do Cache
-        cached_data = cache.get(cache_key)
-        if cached_data:
-            return Response(cached_data, status=status.HTTP_200_OK)
 
-        # 2. Se não tiver, busca no Bitrix (Lento)
+        # 2. Se não tiver, lê do espelho local do Deal (sem chamada ao Bitrix)
         result = BitrixService.get_client_protocol(user)
         
         if not result or "error" in result:
@@ -412,16 +208,17 @@ class UserProtocolView(APIView):
                  if suggested and not "error" in suggested:
                      # Salva no Cache e retorna como sucesso
                      cache.set(cache_key, suggested, 600)
-                     return Response(suggested, status=status.HTTP_200_OK)
+                     return suggested, status.HTTP_200_OK
 
              error_msg = result.get('error') if result else 'Erro desconhecido'
              logger.warning(f"⚠️ UserProtocolView Warning: {error_msg} for user {user.email}")
-             return Response(result or {"error": "Erro ao buscar protocolo"}, status=status.HTTP_400_BAD_REQUEST)
+             return result or {"error": "Erro ao buscar protocolo"}, status.HTTP_400_BAD_REQUEST
 
-        # 3. Salva no Cache por 10 minutos (600s)
-        cache.set(cache_key, result, 600)
+        # 3. Salva no Cache por 10 minutos (600s). Espelho velho/miss: sincronização já agendada, não segura no cache
+        if not result.get('stale'):
+            cache.set(cache_key, result, 600)
 
-        return Response(result, status=status.HTTP_200_OK)
+        return result, status.HTTP_200_OK
 
 class UserUpdateView(APIView):
     """
@@ -452,6 +249,7 @@ class UserUpdateView(APIView):
         
         if updated:
             user.save()
+            ProfileSnapshotService.schedule(user.id, 'user_update')
             # Tenta sincronizar contato no Bitrix (Nome/Fone)
             try:
                 if user.id_bitrix:
@@ -486,17 +284,58 @@ class BitrixWebhookView(APIView):
             logger.warning(f"⛔ Tentativa de Webhook com Token Inválido: {incoming_token}")
             return Response({"error": "Forbidden"}, status=status.HTTP_403_FORBIDDEN)
 
-        # 2. Processamento Assíncrono (Idealmente) ou Rápido
-        # O Bitrix espera 200 OK rápido.
+        # 2. Ingestão Bufferizada
+        # O Bitrix espera 200 OK rápido: só gravamos o evento; process_bitrix_webhooks processa em background.
         try:
-            # Delegate to Service
-            BitrixService.process_incoming_webhook(request.data)
+            BitrixWebhookIngestService.ingest(request.data)
         except Exception as e:
-            # Nunca retornar erro 500 para o Bitrix, senão ele desativa o webhook
-            logger.error(f"❌ Erro processando Webhook: {e}")
+            # Banco indisponível para a fila: processa inline para não perder o evento
+            logger.error(f"❌ Erro gravando Webhook na fila, processando inline: {e}")
+            try:
+                BitrixService.process_incoming_webhook(request.data)
+            except Exception as e:
+                # Nunca retornar erro 500 para o Bitrix, senão ele desativa o webhook
+                logger.error(f"❌ Erro processando Webhook: {e}")
         
         return Response({"status": "received"}, status=status.HTTP_200_OK)
 
+# 6.1 Status das Integrações (Admin)
+class IntegrationStatusView(APIView):
+    """
+    Diagnóstico das integrações externas no worker que atendeu a requisição:
+    pools HTTP keep-alive (reuso, espera de checkout, sockets abertos) e
+    estado dos circuit breakers.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        from .http_pool import pool_stats
+        from .circuit_breaker import breaker_states
+        return Response({
+            "http_pools": pool_stats(),
+            "circuit_breakers": breaker_states(),
+        }, status=status.HTTP_200_OK)
+
+# 6.2 Métricas das chamadas externas (Prometheus)
+class MetricsView(View):
+    """
+    GET /metrics no formato texto do Prometheus (apps/accounts/metrics.py).
+    View Django pura (sem DRF): o scraper espera text/plain e não autentica por JWT.
+    Com METRICS_TOKEN configurado, exige `Authorization: Bearer <token>`.
+    """
+
+    def get(self, request):
+        import hmac
+        from django.conf import settings
+        from . import metrics
+
+        token = getattr(settings, 'METRICS_TOKEN', '')
+        if token:
+            sent = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+            if not hmac.compare_digest(sent.encode(), token.encode()):
+                return HttpResponse(status=401)
+        return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 # 7. Password Reset Views
 from .services import PasswordResetService
 
@@ -682,5 +521,13 @@ class DoctorProfileUpdateView(APIView):
             doctor.profile_photo = photo
         
         doctor.save()
+
+        # Nome/foto/bio aparecem na equipe médica do perfil de cada paciente
+        from .models import Patients
+        from django.db.models import Q
+        ProfileSnapshotService.schedule_many(
+            Patients.objects.filter(Q(assigned_trichologist=doctor) | Q(assigned_nutritionist=doctor)).values_list('user_id', flat=True),
+            'doctor_profile'
+        )
         
         return Response({"message": "Perfil atualizado com sucesso!"}, status=status.HTTP_200_OK)
\ No newline at end of file
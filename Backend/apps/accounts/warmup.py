@@ -0,0 +1,77 @@
+"""
+Refresh pós-login em background.
+
+O login não sincroniza mais o plano com o Bitrix de forma síncrona (era até 2 chamadas ao Bitrix
++ atribuição de equipe médica antes do JWT sair). Depois que o token é emitido, agendamos aqui:
+  1. check_and_update_user_plan (plano/equipe médica, a partir do espelho de Deals);
+  2. reconstrução do perfil (UserProfileSnapshot) e pré-aquecimento do cache do protocolo (user_protocol_<id>).
+
+Roda num pool de threads do próprio worker; o protocolo aquecido vai para o L2 compartilhado
+(config/cache.py) e fica no L1 deste processo, o mesmo que atende o dashboard logo depois do login.
+Um refresh por usuário a cada SESSION_WARMUP_DEDUPE_SECONDS (logins repetidos não empilham).
+"""
+
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, transaction
+
+from .circuit_breaker import reset_stale
+from .metrics import caller_context
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor, _executor_pid
+    # Pool por processo: o gunicorn faz fork dos workers depois do import
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'SESSION_WARMUP_THREADS', 2),
+                thread_name_prefix='session-warmup',
+            )
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def warm_user_session(user_id):
+    """Job: sincroniza o plano, reconstrói o perfil e grava o protocolo no cache."""
+    from .models import User
+    from .profile_snapshot import ProfileSnapshotService
+    from .services import BitrixService
+    from .views import UserProtocolView
+
+    reset_stale()
+    try:
+        user = User.objects.get(pk=user_id)
+        with caller_context("task:session_warmup"):
+            BitrixService.check_and_update_user_plan(user)
+            ProfileSnapshotService.refresh(user, reason='login')
+            # Mesmo singleflight da view: se o dashboard já pediu o protocolo, não recalcula em dobro
+            if user.role == User.RoleType.PATIENT:
+                UserProtocolView.cached_protocol(user)
+        logger.info(f"🔥 Sessão aquecida para {user.email}")
+    except Exception as e:
+        logger.warning(f"⚠️ Warm-up pós-login falhou para {user_id}: {e}")
+    finally:
+        # Thread fora do ciclo de request: devolve a conexão do banco
+        close_old_connections()
+
+
+def schedule_session_warmup(user):
+    """Agenda o refresh após o commit corrente (no login, imediatamente)."""
+    if not getattr(settings, 'SESSION_WARMUP_ENABLED', True) or not getattr(user, 'pk', None):
+        return
+    if not cache.add(f"session_warmup_{user.pk}", 1, getattr(settings, 'SESSION_WARMUP_DEDUPE_SECONDS', 60)):
+        return
+    user_id = user.pk
+    transaction.on_commit(lambda: _get_executor().submit(warm_user_session, user_id))
@@ -2,7 +2,9 @@ from django.core.management.base import BaseCommand
 from django.utils import timezone
 from django.db import transaction as db_transaction
 from apps.financial.models import Transaction
-from apps.accounts.services import BitrixService
+from apps.accounts.services import BitrixService, BitrixOutboxService
+from apps.financial.services import BitrixTransactionSync
+from apps.accounts.rate_limit import bitrix_lane, LANE_BATCH
 import logging
 
 logger = logging.getLogger(__name__)
@@ -11,6 +13,11 @@ class Command(BaseCommand):
     help = 'Sincroniza Batch de transações com Bitrix (Scalable Pattern).'
 
     def handle(self, *args, **options):
+        # Cron: consome o rate limit do Bitrix na lane de batch (usuários têm prioridade)
+        with bitrix_lane(LANE_BATCH):
+            self._handle(*args, **options)
+
+    def _handle(self, *args, **options):
         if not BitrixService:
             self.stdout.write(self.style.ERROR("BitrixService não disponível."))
             return
@@ -24,7 +31,11 @@ class Command(BaseCommand):
                 status=Transaction.Status.APPROVED 
             ).select_related('user').select_for_update(skip_locked=True).order_by('created_at')[:50]
             
-            transactions = list(transactions_qs)
+            # Quem ainda tem envio no outbox fica com o worker (process_bitrix_outbox)
+            transactions = [
+                t for t in transactions_qs
+                if not BitrixOutboxService.has_active(BitrixTransactionSync.reference(t))
+            ]
 
         if not transactions:
             self.stdout.write("Nenhuma transação pendente neste batch.")
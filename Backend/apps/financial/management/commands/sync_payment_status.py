@@ -1,5 +1,4 @@
 import logging
-import time
 from datetime import timedelta
 from django.utils import timezone
 from django.core.management.base import BaseCommand
@@ -7,6 +6,7 @@ from django.conf import settings
 from apps.financial.models import Transaction
 from apps.store.services import SubscriptionService
 from apps.accounts.services import BitrixService
+from apps.accounts.rate_limit import bitrix_lane, LANE_BATCH
 from apps.financial.services import AsaasService
 
 logger = logging.getLogger(__name__)
@@ -19,6 +19,11 @@ class Command(BaseCommand):
         parser.add_argument('--hours', type=int, default=24, help='Olhar transações das últimas X horas (Default: 24)')
 
     def handle(self, *args, **options):
+        # Cron: consome o rate limit do Bitrix na lane de batch (usuários têm prioridade)
+        with bitrix_lane(LANE_BATCH):
+            self._handle(*args, **options)
+
+    def _handle(self, *args, **options):
         dry_run = options['dry_run']
         hours = options['hours']
         
@@ -156,8 +161,5 @@ class Command(BaseCommand):
 
             except Exception as e:
                 self.stdout.write(self.style.ERROR(f"      ❌ Erro ao processar: {e}"))
-            
-            # Rate limit friendly
-            time.sleep(0.5)
 
         self.stdout.write(self.style.SUCCESS(f"🏁 Fim. Recuperados: {recovered_count}/{count}"))
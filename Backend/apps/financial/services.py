@@ -2,9 +2,11 @@ import requests
 import json
 import logging
 import os
+import time
 from datetime import datetime, timedelta
 from decimal import Decimal
 from django.conf import settings
+from apps.accounts.metrics import record_call
 from .models import Coupon, Transaction
 
 logger = logging.getLogger(__name__)
@@ -71,7 +73,14 @@ class AsaasService:
 
         try:
             # [FIX] allow_redirects=False to see if we are being redirected to login
-            response = requests.request(method, url, headers=self.headers, json=payload, timeout=30, allow_redirects=False)
+            started = time.monotonic()
+            try:
+                response = requests.request(method, url, headers=self.headers, json=payload, timeout=30, allow_redirects=False)
+            except requests.exceptions.RequestException:
+                record_call('asaas', method, endpoint, 'error', time.monotonic() - started)
+                raise
+            record_call('asaas', method, endpoint, response.status_code, time.monotonic() - started,
+                        len(response.request.body or b''), len(response.content))
             
             if response.is_redirect:
                 logger.error(f"❌ Asaas Redirects to: {response.headers.get('Location')}")
@@ -255,6 +264,8 @@ class AsaasService:
                 user.current_plan = User.PlanType.NONE
                 user.cancel_reason = reason
                 user.save()
+            from apps.accounts.profile_snapshot import ProfileSnapshotService
+            ProfileSnapshotService.schedule(user.id, 'subscription_cancel')
             return True, "Assinatura cancelada localmente (sem vínculo Asaas)."
 
         # 2. Consulta data de validade no Asaas (Next Due Date)
@@ -294,9 +305,9 @@ class AsaasService:
                          pass 
                 except: pass
             
-            # [FIX] Limpar Cache do Perfil para Frontend ver status atualizado imediatamente
-            from django.core.cache import cache
-            cache.delete(f"user_profile_full_{user.id}")
+            # [FIX] Reconstrói o perfil para o Frontend ver o status atualizado imediatamente
+            from apps.accounts.profile_snapshot import ProfileSnapshotService
+            ProfileSnapshotService.schedule(user.id, 'subscription_cancel')
                 
             return True, f"Assinatura cancelada. Seu acesso continua válido até {access_until.strftime('%d/%m/%Y')}."
             
@@ -358,9 +369,9 @@ class AsaasService:
                 user.scheduled_transition_date = next_due_date
                 user.save()
             
-            # Limpa Cache
-            from django.core.cache import cache
-            cache.delete(f"user_profile_full_{user.id}")
+            # Reconstrói o perfil (downgrade agendado)
+            from apps.accounts.profile_snapshot import ProfileSnapshotService
+            ProfileSnapshotService.schedule(user.id, 'downgrade_scheduled')
             
             due_fmt = next_due_date.strftime('%d/%m/%Y') if next_due_date else 'próximo ciclo'
             return True, f"Downgrade para Standard agendado. Sua fatura vencerá em {due_fmt} já com o novo valor."
@@ -491,12 +502,158 @@ class AsaasService:
                 user.scheduled_cancellation_date = None
                 user.save()
             
-            # [FIX] Limpar Cache do Perfil
-            from django.core.cache import cache
-            cache.delete(f"user_profile_full_{user.id}")
+            # [FIX] Reconstrói o perfil
+            from apps.accounts.profile_snapshot import ProfileSnapshotService
+            ProfileSnapshotService.schedule(user.id, 'upgrade')
 
             return True, "Upgrade realizado com sucesso!"
 
         except Exception as e:
             logger.exception(f"❌ Erro Upgrade: {e}")
             return False, f"Erro interno: {str(e)}"
+
+
+class BitrixTransactionSync:
+    """
+    Escritas no Bitrix disparadas por uma Transaction (checkout, webhook do Asaas, check-status).
+    As views só enfileiram (BitrixOutboxService.enqueue, na mesma transação do banco);
+    o worker process_bitrix_outbox executa handle_outbox fora do request.
+    """
+    KIND = 'sync_transaction'
+    STAGE_CHECKOUT = 'checkout'   # Lead/Contato + Deal com produtos, logo após a compra
+    STAGE_PAYMENT = 'payment'     # Atualiza o Deal com o pagamento confirmado
+
+    @staticmethod
+    def reference(transaction_obj):
+        return f"transaction:{transaction_obj.pk}"
+
+    @staticmethod
+    def enqueue_checkout(transaction_obj, validated_data, payment_info, total_amount, coupon_code=None):
+        from apps.accounts.services import BitrixOutboxService
+        return BitrixOutboxService.enqueue(
+            BitrixTransactionSync.KIND,
+            payload={
+                "stage": BitrixTransactionSync.STAGE_CHECKOUT,
+                "transaction_id": str(transaction_obj.pk),
+                "products": [dict(p) for p in validated_data.get('products', [])],
+                "questionnaire_data": validated_data.get('questionnaire_data'),
+                "address_data": dict(validated_data.get('address_data') or {}),
+                "cpf": validated_data.get('cpf'),
+                "phone": validated_data.get('phone'),
+                "total_amount": total_amount,
+                "coupon_code": coupon_code,
+                "payment": payment_info,
+            },
+            user=transaction_obj.user,
+            reference=BitrixTransactionSync.reference(transaction_obj),
+            dedupe_key=f"{BitrixTransactionSync.reference(transaction_obj)}:{BitrixTransactionSync.STAGE_CHECKOUT}",
+        )
+
+    @staticmethod
+    def enqueue_payment(transaction_obj, payment_info):
+        from apps.accounts.services import BitrixOutboxService
+        status = payment_info.get('status') or 'unknown'
+        return BitrixOutboxService.enqueue(
+            BitrixTransactionSync.KIND,
+            payload={
+                "stage": BitrixTransactionSync.STAGE_PAYMENT,
+                "transaction_id": str(transaction_obj.pk),
+                "payment": payment_info,
+            },
+            user=transaction_obj.user,
+            reference=BitrixTransactionSync.reference(transaction_obj),
+            # Webhook e check-status podem ver a mesma confirmação: um único envio por status
+            dedupe_key=f"{BitrixTransactionSync.reference(transaction_obj)}:{BitrixTransactionSync.STAGE_PAYMENT}:{status}",
+        )
+
+    @staticmethod
+    def handle_outbox(event):
+        """Handler do outbox: levanta exceção para o worker reagendar com backoff."""
+        from django.utils import timezone
+        from config.cache import invalidate_tag
+        from apps.accounts.profile_snapshot import ProfileSnapshotService
+        payload = event.payload or {}
+        transaction_obj = Transaction.objects.select_related('user').get(pk=payload['transaction_id'])
+
+        try:
+            if payload.get('stage') == BitrixTransactionSync.STAGE_CHECKOUT:
+                deal_id = BitrixTransactionSync._sync_checkout(transaction_obj, payload)
+            else:
+                deal_id = BitrixTransactionSync._sync_payment(transaction_obj, payload)
+            if not deal_id:
+                raise Exception("Bitrix retornou None para Deal ID.")
+        except Exception:
+            transaction_obj.bitrix_sync_status = 'failed'
+            transaction_obj.last_sync_attempt = timezone.now()
+            transaction_obj.save(update_fields=['bitrix_sync_status', 'last_sync_attempt'])
+            raise
+
+        transaction_obj.bitrix_deal_id = str(deal_id)
+        transaction_obj.bitrix_sync_status = 'synced'
+        transaction_obj.last_sync_attempt = timezone.now()
+        transaction_obj.save(update_fields=['bitrix_deal_id', 'bitrix_sync_status', 'last_sync_attempt'])
+
+        invalidate_tag(f"user:{transaction_obj.user_id}")
+        ProfileSnapshotService.schedule(transaction_obj.user_id, 'bitrix_synced')
+        logger.info(f"✅ Bitrix Synced ({payload.get('stage')}). Transaction {transaction_obj.pk} -> Deal {deal_id}")
+
+    @staticmethod
+    def _sync_checkout(transaction_obj, payload):
+        from apps.accounts.services import BitrixService
+        from apps.accounts.config import BitrixConfig
+        user = transaction_obj.user
+
+        # 1. Lead/Contact Sync
+        if not user.id_bitrix:
+            bitrix_id = BitrixService.create_lead(user, payload.get('questionnaire_data'), payload.get('address_data'))
+            if not bitrix_id:
+                raise Exception("Falha crítica: Sem ID Bitrix.")
+            user.id_bitrix = str(bitrix_id)
+            user.save(update_fields=['id_bitrix'])
+
+        # 2. Update Contact
+        BitrixService.update_contact_data(user.id_bitrix, payload.get('cpf'), payload.get('phone'))
+
+        # 3. Prepare Deal
+        # [FIX UPGRADE] Remover produtos que sejam PLANOS antigos (Standard/Plus) para evitar duplicidade
+        all_plan_ids = BitrixConfig.PLAN_IDS.values()
+        final_products = [p for p in payload.get('products', []) if int(p.get('id', 0)) not in all_plan_ids]
+
+        plan_item = BitrixService.get_plan_details(transaction_obj.plan_type)
+        if plan_item: final_products.append(plan_item)
+
+        payment = payload.get('payment') or {}
+        return BitrixService.prepare_deal_payment(
+            user,
+            final_products,
+            f"ProtocoloMed - {transaction_obj.plan_type}",
+            float(payload.get('total_amount') or transaction_obj.paid_amount or transaction_obj.amount),
+            payload.get('questionnaire_data'),
+            payment_data={"id": payment.get('id'), "date_created": payment.get('date_created'), "status": payment.get('status')},
+            coupon_code=payload.get('coupon_code'),
+        )
+
+    @staticmethod
+    def _sync_payment(transaction_obj, payload):
+        from apps.accounts.services import BitrixService
+
+        # Snapshot de Produtos
+        products_list = []
+        if transaction_obj.mp_metadata and isinstance(transaction_obj.mp_metadata, dict):
+            products_list = transaction_obj.mp_metadata.get('original_products', [])
+
+        # Fallback
+        if not products_list:
+            from apps.accounts.models import UserQuestionnaire
+            last_q = UserQuestionnaire.objects.filter(user=transaction_obj.user).order_by('-created_at').first()
+            if last_q:
+                products_list = BitrixService.generate_protocol(last_q.answers).get('products', [])
+
+        return BitrixService.prepare_deal_payment(
+            user=transaction_obj.user,
+            products_list=products_list,
+            plan_title=f"ProtocoloMed - {transaction_obj.plan_type}",
+            total_amount=float(transaction_obj.amount),
+            answers=None,  # Já enviado no checkout
+            payment_data=payload.get('payment'),
+        )
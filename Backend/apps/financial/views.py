@@ -9,9 +9,10 @@ from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework_simplejwt.tokens import RefreshToken
 from .models import Transaction, Coupon
-from .services import AsaasService 
+from .services import AsaasService, BitrixTransactionSync
 from .serializers import PurchaseSerializer, CouponValidateSerializer
 from apps.accounts.serializers import RegisterSerializer
+from apps.accounts.profile_snapshot import ProfileSnapshotService
 from apps.store.services import SubscriptionService
 import os
 # Importa o BitrixService com tratamento de erro
@@ -115,83 +116,55 @@ class WebhookView(APIView):
                 # 3. Atualizar e Disparar Ações
                 # Só processamos mudanças de status relevantes (Aprovado/Rejeitado/Estornado)
                 # Ignoramos PENDING se já estiver PENDING, mas se vier APPROVED é ação nova.
-                if new_status and transaction.status != new_status:
+                if not new_status or transaction.status == new_status:
+                    logger.info(f"   ⚠️ Transaction {transaction.id} ignored: Status unchanged ({transaction.status} -> {new_status})")
+                    return Response({"status": "received"}, status=200)
+
+                with db_transaction.atomic():
                     # Se for status final ou mudança importante
                     transaction.status = new_status
-                else:
-                    logger.info(f"   ⚠️ Transaction {transaction.id} ignored: Status unchanged ({transaction.status} -> {new_status})")
 
                     # Salva ID do Asaas se não tiver
                     if not transaction.asaas_payment_id: transaction.asaas_payment_id = payment_id
                     transaction.save()
-                    
-                    logger.info(f"   ✅ Transaction {transaction.id} updated to {new_status}")
-
-                    if new_status == Transaction.Status.APPROVED:
-                        # Ativa Assinatura
-                        try:
-                            SubscriptionService.activate_subscription_from_transaction(transaction)
-                            logger.info(f"      📦 Subscription activated.")
-                        except Exception as e:
-                            logger.error(f"      ❌ Subscription Activation Error: {e}")
-
-                        # [DOWNGRADE EXECUTION]
-                        # Se o usuário tinha um downgrade agendado e pagou o valor do Standard, efetiva a troca.
-                        try:
-                            user = transaction.user
-                            if getattr(user, 'scheduled_plan', None) == 'standard':
-                                paid_val = float(payment_data.get('value', 0.0))
-                                # Valor do Standard é 97.00. Aceitamos pequena margem por segurança.
-                                if abs(paid_val - 97.00) < 1.0: 
-                                    logger.info(f"📉 Efetivando Downgrade Agendado para {user.email}")
-                                    user.current_plan = 'standard'
-                                    user.scheduled_plan = None
-                                    user.scheduled_transition_date = None
-                                    user.save()
-                                    
-                                    from django.core.cache import cache
-                                    cache.delete(f"user_profile_full_{user.id}")
-                        except Exception as e:
-                            logger.error(f"      ❌ Error executing downgrade logic: {e}")
-
-                        # Sync Bitrix
-                        if transaction.bitrix_sync_status != 'synced' and BitrixService:
-                            try:
-                                logger.info("      🔄 Triggering Bitrix Sync from Asaas Webhook...")
-                                
-                                # Snapshot de Produtos
-                                products_list = []
-                                if transaction.mp_metadata and isinstance(transaction.mp_metadata, dict):
-                                    products_list = transaction.mp_metadata.get('original_products', [])
-                                
-                                # Fallback
-                                if not products_list:
-                                    from apps.accounts.models import UserQuestionnaire
-                                    last_q = UserQuestionnaire.objects.filter(user=transaction.user).order_by('-created_at').first()
-                                    if last_q:
-                                        prot = BitrixService.generate_protocol(last_q.answers)
-                                        products_list = prot.get('products', [])
-
-                                deal_id = BitrixService.prepare_deal_payment(
-                                    user=transaction.user,
-                                    products_list=products_list,
-                                    plan_title=f"ProtocoloMed - {transaction.plan_type}",
-                                    total_amount=float(transaction.amount),
-                                    answers=None,
-                                    payment_data={
-                                        "status": "approved",
-                                        "id": payment_id,
-                                        "asaas_payment_id": payment_id,
-                                        "date_created": datetime.now().isoformat()
-                                    }
-                                )
-                                if deal_id:
-                                    transaction.bitrix_deal_id = str(deal_id)
-                                    transaction.bitrix_sync_status = 'synced'
-                                    transaction.save()
-                                    logger.info(f"      ✅ Bitrix Synced. Deal: {deal_id}")
-                            except Exception as be:
-                                logger.error(f"      ❌ Bitrix Sync Error: {be}")
+                    ProfileSnapshotService.schedule(transaction.user_id, 'payment_status')
+
+                    # Sync Bitrix (Outbox): enfileirado no mesmo commit da mudança de status, executado pelo worker
+                    if new_status == Transaction.Status.APPROVED and transaction.bitrix_sync_status != 'synced':
+                        BitrixTransactionSync.enqueue_payment(transaction, {
+                            "status": "approved",
+                            "id": payment_id,
+                            "asaas_payment_id": payment_id,
+                            "date_created": datetime.now().isoformat()
+                        })
+                        logger.info("      📮 Bitrix Sync enqueued from Asaas Webhook.")
+
+                logger.info(f"   ✅ Transaction {transaction.id} updated to {new_status}")
+
+                if new_status == Transaction.Status.APPROVED:
+                    # Ativa Assinatura
+                    try:
+                        SubscriptionService.activate_subscription_from_transaction(transaction)
+                        logger.info(f"      📦 Subscription activated.")
+                    except Exception as e:
+                        logger.error(f"      ❌ Subscription Activation Error: {e}")
+
+                    # [DOWNGRADE EXECUTION]
+                    # Se o usuário tinha um downgrade agendado e pagou o valor do Standard, efetiva a troca.
+                    try:
+                        user = transaction.user
+                        if getattr(user, 'scheduled_plan', None) == 'standard':
+                            paid_val = float(payment_data.get('value', 0.0))
+                            # Valor do Standard é 97.00. Aceitamos pequena margem por segurança.
+                            if abs(paid_val - 97.00) < 1.0: 
+                                logger.info(f"📉 Efetivando Downgrade Agendado para {user.email}")
+                                user.current_plan = 'standard'
+                                user.scheduled_plan = None
+                                user.scheduled_transition_date = None
+                                user.save()
+                                ProfileSnapshotService.schedule(user.id, 'downgrade')
+                    except Exception as e:
+                        logger.error(f"      ❌ Error executing downgrade logic: {e}")
 
             return Response({"status": "received"}, status=200)
 
@@ -216,7 +189,9 @@ class PlanPricesView(APIView):
 
         return Response({
             "standard": price_standard,
-            "plus": price_plus
+            "plus": price_plus,
+            # Preço veio do último valor conhecido (Bitrix indisponível)
+            "stale": any(d.get('stale', False) for d in (standard_details, plus_details) if d)
         })
 
 class ValidateCouponView(APIView):
@@ -264,40 +239,22 @@ class TransactionStatusView(APIView):
                         
                         if transaction.status != new_status_mapped:
                             logger.info(f"🔄 Check-Status: Updating {transaction.external_reference} from {transaction.status} to {new_status_mapped}")
-                            transaction.status = new_status_mapped
-                            transaction.save()
-                            
-                            # Trigger Activation if Approved
-                            if transaction.status == Transaction.Status.APPROVED:
-                                SubscriptionService.activate_subscription_from_transaction(transaction)
-                                
-                                # [FIX] Sync Bitrix Payment Status
-                                try:
-                                    meta = transaction.mp_metadata or {}
-                                    products = meta.get('original_products', [])
-                                    # Fallback questionnaire check handled inside prepare_deal_payment ideally, 
-                                    # but let's pass what we have.
-                                    
-                                    # Need to import here to avoid circular dependency if any (though usually safe in method)
-                                    from apps.accounts.services import BitrixService
-                                    
-                                    payment_data_bitrix = {
+                            with db_transaction.atomic():
+                                transaction.status = new_status_mapped
+                                transaction.save()
+                                ProfileSnapshotService.schedule(transaction.user_id, 'payment_status')
+
+                                # [FIX] Sync Bitrix Payment Status (Outbox, mesmo fluxo do webhook)
+                                if transaction.status == Transaction.Status.APPROVED:
+                                    BitrixTransactionSync.enqueue_payment(transaction, {
                                         "status": "approved", # Explicitly approved
                                         "id": transaction.asaas_payment_id,
                                         "date_created": transaction.created_at.strftime("%Y-%m-%dT%H:%M:%S%z")
-                                    }
-                                    
-                                    BitrixService.prepare_deal_payment(
-                                        user=transaction.user,
-                                        products_list=products,
-                                        plan_title=f"ProtocoloMed - {transaction.plan_type}",
-                                        total_amount=float(transaction.amount),
-                                        answers=None, # Already synced at checkout
-                                        payment_data=payment_data_bitrix
-                                    )
-                                    logger.info(f"✅ Bitrix Updated for Manual Check: {transaction.external_reference}")
-                                except Exception as e:
-                                    logger.error(f"⚠️ Bitrix Manual Sync Failed: {e}")
+                                    })
+
+                            # Trigger Activation if Approved
+                            if transaction.status == Transaction.Status.APPROVED:
+                                SubscriptionService.activate_subscription_from_transaction(transaction)
 
                 except Exception as e:
                     logger.error(f"⚠️ Failed to force-check Asaas status: {e}")
@@ -528,24 +485,22 @@ class CompletePurchaseView(APIView):
                 subscription_id_value = asaas_subscription_id
                 status_mp = payment_result.get('status') if payment_result else 'unknown'
                 
-                # Bitrix Integration
-                bitrix_success = False
-                deal_id = None
-                try:
-                    # Pass correct ID (Subscription ID or Payment ID) depending on flow
-                    integ_id = subscription_id_value if is_subscription else mp_id_value
-                    # Construct temp result wrapper for Bitrix
-                    bitrix_payment_result = payment_result.copy()
-                    bitrix_payment_result['id'] = integ_id
-                    
-                    deal_id = self._handle_bitrix_integration(user, validated_data, bitrix_payment_result, plan_id, total_price, coupon_code)
-                    if deal_id: bitrix_success = True
-                except Exception as e:
-                    logger.error(f"⚠️ Bitrix Sync Failed: {e}")
+                # Bitrix Integration (Outbox)
+                # A escrita no Bitrix é enfileirada nesta mesma transação e executada pelo worker
+                # process_bitrix_outbox: o checkout não espera o Bitrix e nada é enviado se o commit falhar.
+                integ_id = subscription_id_value if is_subscription else mp_id_value
+                BitrixTransactionSync.enqueue_checkout(
+                    transaction,
+                    validated_data,
+                    payment_info={
+                        "id": integ_id,
+                        "date_created": payment_result.get('date_created'),
+                        "status": payment_result.get('status'),
+                    },
+                    total_amount=total_price,
+                    coupon_code=coupon_code,
+                )
 
-                transaction.bitrix_sync_status = 'synced' if bitrix_success else 'failed'
-                if bitrix_success: transaction.bitrix_deal_id = str(deal_id)
-                
                 # Metadata Snapshot
                 sanitized_products = [{"id": p.get("id"), "name": p.get("name"), "price": p.get("price")} for p in raw_products]
                 meta_data = {
@@ -558,10 +513,12 @@ class CompletePurchaseView(APIView):
                 transaction.mp_metadata = self._make_json_serializable(meta_data)
                 transaction.save()
 
-                # Cache Clear
-                from django.core.cache import cache
-                cache.delete(f"user_protocol_{user.id}")
-                cache.delete(f"user_profile_full_{user.id}")
+                # Cache Clear (todos os workers) + perfil (pagamento pendente/aprovado), ambos após o commit:
+                # invalidar antes deixaria uma leitura concorrente recachear as linhas antigas sob a tag nova
+                from config.cache import invalidate_tag
+                user_tag = f"user:{user.id}"
+                db_transaction.on_commit(lambda: invalidate_tag(user_tag))
+                ProfileSnapshotService.schedule(user.id, 'checkout')
 
                 # Response Construction
                 refresh = RefreshToken.for_user(user)
@@ -657,59 +614,6 @@ class CompletePurchaseView(APIView):
              return register_serializer.save()
         raise ValueError("Invalid User Data for Creation")
 
-    def _handle_bitrix_integration(self, user, validated_data, payment_result, plan_id, total_price, coupon_code=None):
-        """
-        Tenta realizar a integração completa. Retorna o Deal ID se sucesso, ou lança exceção.
-        """
-        if not BitrixService: return None
-
-        # 1. Lead/Contact Sync
-        if not user.id_bitrix:
-            bitrix_id = BitrixService.create_lead(user, validated_data.get('questionnaire_data'), validated_data.get('address_data'))
-            if bitrix_id:
-                user.id_bitrix = str(bitrix_id)
-                user.save()
-        
-        # 2. Update Contact
-        BitrixService.update_contact_data(user.id_bitrix, validated_data.get('cpf'), validated_data.get('phone'))
-
-        # 3. Prepare Deal
-        from apps.accounts.config import BitrixConfig
-        products = validated_data.get('products', [])
-        
-        # [FIX UPGRADE] Remover produtos que sejam PLANOS antigos (Standard/Plus) para evitar duplicidade
-        all_plan_ids = BitrixConfig.PLAN_IDS.values() # [262, 264, etc]
-        
-        # Filtrar produtos que NÃO sejam planos
-        filtered_products = [
-            p for p in products 
-            if int(p.get('id', 0)) not in all_plan_ids
-        ]
-        
-        final_products = list(filtered_products)
-        
-        # Add New Plan Item
-        if hasattr(BitrixService, 'get_plan_details'):
-            plan_item = BitrixService.get_plan_details(plan_id)
-            if plan_item: final_products.append(plan_item)
-        
-        payment_info_bitrix = {
-            "id": payment_result.get('id'),
-            "date_created": payment_result.get('date_created'),
-            "status": payment_result.get('status')
-        }
-
-        # Returns Deal ID or None
-        return BitrixService.prepare_deal_payment(
-            user, 
-            final_products, 
-            f"ProtocoloMed - {plan_id}", 
-            total_price, 
-            validated_data.get('questionnaire_data'), 
-            payment_data=payment_info_bitrix,
-            coupon_code=coupon_code
-        )
-
 # --- VIEW 6: CANCELAMENTO DE ASSINATURA ---
 class CancelSubscriptionView(APIView):
     permission_classes = [IsAuthenticated]
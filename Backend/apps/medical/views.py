@@ -11,6 +11,7 @@ from apps.accounts.models import User
 from .serializers import PatientPhotoSerializer
 from django.db import transaction
 from .permissions import IsDoctor
+from apps.accounts.authentication import ClaimsJWTAuthentication
 
 class SlotsView(APIView):
     permission_classes = [IsAuthenticated]
@@ -193,6 +194,7 @@ class DoctorPatientPhotosView(APIView):
 
 class DoctorDashboardStatsView(APIView):
     permission_classes = [IsAuthenticated, IsDoctor]
+    authentication_classes = [ClaimsJWTAuthentication] # role/nome/email vêm do token
 
     def get(self, request):
         
@@ -202,7 +204,7 @@ class DoctorDashboardStatsView(APIView):
         try:
             # Import local para evitar problemas de ciclo se houver, ou apenas garantir acesso
             from apps.accounts.models import Doctors
-            doctor_profile = Doctors.objects.get(user=request.user)
+            doctor_profile = Doctors.objects.get(user_id=request.user.pk)
         except Exception:
             doctor_profile = None
 
@@ -221,8 +223,8 @@ class DoctorDashboardStatsView(APIView):
                 # 2. Resumo de Agendamentos (Hoje)
         from django.utils import timezone
         today = timezone.localtime().date()
-        # FIX: Appointments.doctor é FK para User, então usamos 'doctor=request.user'
-        today_appts = Appointments.objects.filter(doctor=request.user, scheduled_at__date=today)
+        # FIX: Appointments.doctor é FK para User (doctor_id = pk, sem carregar o User das claims)
+        today_appts = Appointments.objects.filter(doctor_id=request.user.pk, scheduled_at__date=today)
         
         # 3. Lista de Pacientes (Meus pacientes atribuídos)
         from django.db.models import Q
@@ -382,7 +384,7 @@ class DoctorPatientDetailView(APIView):
                     if question_text:
                          anamnesis.append({"question": question_text, "answer": str(value)})
 
-            # 3. Busca Protocolo (Cacheado ou Bitrix)
+            # 3. Busca Protocolo (espelho local do Deal, sem chamada ao Bitrix)
             # Reaproveita lógica do UserProtocolView mas sem request.user
             protocol_data = {}
             try:
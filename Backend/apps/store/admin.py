@@ -8,7 +8,7 @@ from .models import (
 
 @admin.register(Products)
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ('name', 'product_type', 'price', 'is_active')
+    list_display = ('name', 'product_type', 'price', 'is_active', 'bitrix_id', 'bitrix_synced_at')
     list_filter = ('product_type', 'is_active')
     search_fields = ('name', 'composition_guide')
 
@@ -0,0 +1,265 @@
+"""
+Proxy das imagens dos produtos (GET /api/store/image/<product_id>/).
+
+O catálogo entregava os links do Bitrix (detailUrl/showUrl) direto ao navegador: cada visitante
+baixava o original em tamanho cheio do portal. Agora:
+  - public_url(): o catálogo e o protocolo apontam para a URL local, versionada pela origem
+    (`?v=<hash da URL do Bitrix>`): quando a imagem muda no Bitrix, a URL muda junto;
+  - no primeiro acesso o original é baixado uma única vez (singleflight por origem) para um cache
+    em disco endereçado por conteúdo: originals/<sha256[:2]>/<sha256>.<ext>, com
+    sources/<hash da origem> apontando para o digest (mesma imagem em dois produtos = um arquivo);
+  - variantes (?w=<largura>&fmt=webp|jpeg|png; `format` é reservado pelo DRF) são geradas com
+    Pillow sob demanda em variants/<sha256>/<largura>.<formato>; larguras arredondadas para
+    PRODUCT_IMAGE_WIDTHS.
+
+Arquivos são gravados em tmp + os.replace: workers concorrentes nunca leem um arquivo pela metade.
+O diretório (PRODUCT_IMAGE_CACHE_DIR, padrão media/product_images) pode ser apagado a qualquer momento.
+"""
+
+import os
+import hashlib
+import logging
+import tempfile
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.urls import reverse
+
+from apps.accounts.cache_utils import singleflight
+
+logger = logging.getLogger(__name__)
+
+# formato -> (formato do Pillow, content-type)
+FORMATS = {
+    'webp': ('WEBP', 'image/webp'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+    'png': ('PNG', 'image/png'),
+    'gif': ('GIF', 'image/gif'),
+}
+PIL_EXTENSIONS = {'JPEG': 'jpeg', 'PNG': 'png', 'WEBP': 'webp', 'GIF': 'gif'}
+
+
+class ImageNotAvailable(Exception):
+    """Produto sem imagem, origem fora do ar ou arquivo inválido."""
+
+
+@dataclass(frozen=True)
+class ImageVariant:
+    path: str
+    content_type: str
+    etag: str
+    version: str
+
+
+class ProductImageService:
+    PLACEHOLDER_IMAGE = "https://via.placeholder.com/150"
+
+    @staticmethod
+    def _root() -> str:
+        return getattr(settings, 'PRODUCT_IMAGE_CACHE_DIR', '') or os.path.join(settings.MEDIA_ROOT, 'product_images')
+
+    @staticmethod
+    def source_version(source_url: str) -> str:
+        return hashlib.sha1(source_url.encode()).hexdigest()[:16]
+
+    # =========================================================================
+    # URLs públicas (catálogo / protocolo)
+    # =========================================================================
+
+    @classmethod
+    def public_url(cls, product_id, source_url: Optional[str]) -> Optional[str]:
+        """URL local da imagem; sem imagem (None/placeholder) devolve a origem como está."""
+        if not source_url or source_url == cls.PLACEHOLDER_IMAGE:
+            return source_url
+        try:
+            path = reverse('product_image_proxy', args=[int(product_id)])
+        except (TypeError, ValueError):
+            return source_url
+        url = f"{path}?v={cls.source_version(source_url)}"
+        fmt = getattr(settings, 'PRODUCT_IMAGE_DEFAULT_FORMAT', 'webp')
+        return f"{url}&fmt={fmt}" if fmt else url
+
+    # =========================================================================
+    # Original (download único, endereçado por conteúdo)
+    # =========================================================================
+
+    @classmethod
+    def _source_url(cls, product_id: int) -> Optional[str]:
+        from .models import Products
+        product = Products.objects.filter(bitrix_id=product_id).only('image_url').first()
+        url = product.image_url if product else None
+        if not url or url == cls.PLACEHOLDER_IMAGE:
+            # Produto ainda não espelhado: mesma resolução (com cache) usada no catálogo
+            from apps.accounts.services import BitrixService
+            url = BitrixService._fetch_best_images([product_id]).get(str(product_id))
+        return None if not url or url == cls.PLACEHOLDER_IMAGE else url
+
+    @classmethod
+    def _original_path(cls, digest: str, ext: str) -> str:
+        return os.path.join(cls._root(), 'originals', digest[:2], f"{digest}.{ext}")
+
+    @classmethod
+    def _original(cls, source_url: str) -> Tuple[str, str]:
+        """(sha256, extensão) do original, baixando-o uma única vez por origem."""
+        version = cls.source_version(source_url)
+        key = f"product_image_src_{version}"
+        missing_key = f"product_image_missing_{version}"
+
+        def build():
+            if cache.get(missing_key):
+                raise ImageNotAvailable(f"Origem indisponível (cache negativo): {source_url}")
+            index = os.path.join(cls._root(), 'sources', version)
+            try:
+                with open(index) as f:
+                    digest, ext = f.read().split()
+                if not os.path.exists(cls._original_path(digest, ext)):
+                    raise FileNotFoundError(digest)
+            except (FileNotFoundError, ValueError):
+                try:
+                    digest, ext = cls._download(source_url)
+                except ImageNotAvailable:
+                    cache.set(missing_key, 1, getattr(settings, 'PRODUCT_IMAGE_MISSING_SECONDS', 600))
+                    raise
+                cls._write_atomic(index, f"{digest} {ext}".encode())
+            cache.set(key, (digest, ext), 86400)
+            return digest, ext
+
+        cached = cache.get(key)
+        if cached:
+            if os.path.exists(cls._original_path(*cached)):
+                return tuple(cached)
+            cache.delete(key)  # Diretório apagado: o cache aponta para um arquivo que não existe mais
+        return singleflight(key, build)
+
+    @classmethod
+    def _download(cls, source_url: str) -> Tuple[str, str]:
+        from PIL import Image, UnidentifiedImageError
+        from apps.accounts.services import BitrixService
+
+        max_bytes = getattr(settings, 'PRODUCT_IMAGE_MAX_BYTES', 10 * 1024 * 1024)
+        tmp_dir = os.path.join(cls._root(), 'tmp')
+        os.makedirs(tmp_dir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=tmp_dir)
+        sha = hashlib.sha256()
+        try:
+            try:
+                response = BitrixService._http_pool().request('GET', source_url, timeout=15, stream=True)
+            except Exception as e:
+                raise ImageNotAvailable(f"Falha ao baixar {source_url}: {e}") from e
+            try:
+                if response.status_code != 200:
+                    raise ImageNotAvailable(f"HTTP {response.status_code} em {source_url}")
+                size = 0
+                with os.fdopen(fd, 'wb') as f:
+                    fd = None
+                    for chunk in response.iter_content(64 * 1024):
+                        size += len(chunk)
+                        if size > max_bytes:
+                            raise ImageNotAvailable(f"Imagem maior que {max_bytes} bytes: {source_url}")
+                        sha.update(chunk)
+                        f.write(chunk)
+            finally:
+                response.close()
+
+            try:
+                with Image.open(tmp) as img:
+                    ext = PIL_EXTENSIONS.get(img.format)
+                    img.verify()
+            except (UnidentifiedImageError, OSError, SyntaxError) as e:
+                raise ImageNotAvailable(f"Arquivo inválido em {source_url}: {e}") from e
+            if ext is None:
+                raise ImageNotAvailable(f"Formato não suportado em {source_url}")
+
+            digest = sha.hexdigest()
+            final = cls._original_path(digest, ext)
+            os.makedirs(os.path.dirname(final), exist_ok=True)
+            os.replace(tmp, final)
+            logger.info(f"🖼️ Imagem de produto em cache: {source_url} -> {digest[:12]}")
+            return digest, ext
+        finally:
+            if fd is not None:
+                os.close(fd)
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    @staticmethod
+    def _write_atomic(path: str, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    # =========================================================================
+    # Variantes
+    # =========================================================================
+
+    @staticmethod
+    def pick_width(width: Optional[int]) -> Optional[int]:
+        """Menor largura configurada >= pedida (limita o número de variantes em disco)."""
+        if width is None:
+            return None
+        if width <= 0:
+            raise ValueError("largura inválida")
+        widths = sorted(getattr(settings, 'PRODUCT_IMAGE_WIDTHS', (160, 320, 640, 1280)))
+        return next((w for w in widths if w >= width), widths[-1])
+
+    @classmethod
+    def get_variant(cls, product_id: int, width: Optional[int] = None, fmt: Optional[str] = None) -> ImageVariant:
+        if fmt is not None and fmt not in FORMATS:
+            raise ValueError("formato inválido")
+        width = cls.pick_width(width)
+
+        source_url = cls._source_url(product_id)
+        if not source_url:
+            raise ImageNotAvailable(f"Produto {product_id} sem imagem")
+        version = cls.source_version(source_url)
+        digest, ext = cls._original(source_url)
+        original = cls._original_path(digest, ext)
+
+        if width is None and fmt in (None, ext):
+            # Original como veio do Bitrix
+            return ImageVariant(original, FORMATS[ext][1], f'"{digest[:20]}"', version)
+
+        fmt = fmt or ('png' if ext == 'gif' else ext)
+        path = os.path.join(cls._root(), 'variants', digest, f"{width or 'full'}.{fmt}")
+        if not os.path.exists(path):
+            cls._render(original, path, width, fmt)
+        return ImageVariant(path, FORMATS[fmt][1], f'"{digest[:20]}-{width or "full"}.{fmt}"', version)
+
+    @staticmethod
+    def _render(original: str, path: str, width: Optional[int], fmt: str):
+        from PIL import Image, ImageOps
+
+        quality = getattr(settings, 'PRODUCT_IMAGE_QUALITY', 80)
+        with Image.open(original) as source:
+            img = ImageOps.exif_transpose(source)
+            if width and img.width > width:
+                img = img.resize((width, max(1, round(img.height * width / img.width))), Image.LANCZOS)
+
+            if fmt == 'jpeg' and img.mode != 'RGB':
+                # JPEG não tem transparência: compõe sobre fundo branco
+                rgba = img.convert('RGBA')
+                img = Image.new('RGB', rgba.size, (255, 255, 255))
+                img.paste(rgba, mask=rgba.getchannel('A'))
+            elif img.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+                img = img.convert('RGBA')
+
+            options = {
+                'webp': {'quality': quality, 'method': 4},
+                'jpeg': {'quality': quality, 'optimize': True, 'progressive': True},
+                'png': {'optimize': True},
+                'gif': {},
+            }[fmt]
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    img.save(f, FORMATS[fmt][0], **options)
+                os.replace(tmp, path)
+            except Exception:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                raise
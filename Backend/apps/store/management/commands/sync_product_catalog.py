@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from apps.accounts.rate_limit import bitrix_lane, LANE_BATCH
+from apps.store.services import CatalogSyncService
+
+
+class Command(BaseCommand):
+    help = 'Reconcilia o espelho local do catálogo (store.Products) com o Bitrix (varredura paginada completa).'
+
+    def handle(self, *args, **options):
+        self.stdout.write("🗂️ Reconciliando catálogo com o Bitrix...")
+
+        # Cron: consome o rate limit do Bitrix na lane de batch (usuários têm prioridade)
+        with bitrix_lane(LANE_BATCH):
+            try:
+                stats = CatalogSyncService.full_reconcile()
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f"❌ Falha na reconciliação (espelho mantido como estava): {e}"))
+                return
+
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {stats['products']} produtos sincronizados em {stats['pages']} páginas. "
+            f"{stats['deactivated']} desativados."
+        ))
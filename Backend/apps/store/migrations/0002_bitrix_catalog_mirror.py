@@ -0,0 +1,48 @@
+# Generated by Django 6.0.2 on 2026-10-17 11:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='products',
+            name='bitrix_id',
+            field=models.IntegerField(blank=True, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='products',
+            name='bitrix_synced_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='products',
+            name='description',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='products',
+            name='image_url',
+            field=models.CharField(blank=True, max_length=500, null=True),
+        ),
+        migrations.AddField(
+            model_name='products',
+            name='section_id',
+            field=models.IntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='producttypes',
+            name='bitrix_section_id',
+            field=models.IntegerField(blank=True, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='products',
+            name='name',
+            field=models.CharField(max_length=255),
+        ),
+    ]
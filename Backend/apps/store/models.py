@@ -14,11 +14,13 @@ DOCTOR_MODEL = 'accounts.Doctors'
 
 class ProductTypes(models.Model):
     name = models.CharField(max_length=50)
+    # Seção do catálogo no Bitrix (espelho); null para tipos cadastrados só localmente
+    bitrix_section_id = models.IntegerField(unique=True, null=True, blank=True)
     class Meta:
         verbose_name = 'Tipo de Produto'
 
 class Products(models.Model):
-    name = models.CharField(max_length=100)
+    name = models.CharField(max_length=255)
     product_type = models.ForeignKey(ProductTypes, on_delete=models.PROTECT)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     cost_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
@@ -26,9 +28,29 @@ class Products(models.Model):
     # Usando ArrayField para tags (conforme decisão de não normalizar para simplificar)
     tags = models.CharField(max_length=255, null=True, blank=True) # Django não suporta ArrayField nativamente, usar CharField temporariamente se a biblioteca não estiver instalada.
     is_active = models.BooleanField(default=True)
+
+    # --- Espelho do Catálogo Bitrix (ver CatalogSyncService) ---
+    bitrix_id = models.IntegerField(unique=True, null=True, blank=True)
+    section_id = models.IntegerField(null=True, blank=True, db_index=True)
+    description = models.TextField(blank=True, default='')
+    image_url = models.CharField(max_length=500, null=True, blank=True)
+    bitrix_synced_at = models.DateTimeField(null=True, blank=True)
+
     class Meta:
         verbose_name = 'Produto/Fórmula'
 
+    def to_catalog_dict(self):
+        """Mesmo formato que BitrixService.get_product_catalog sempre devolveu (imagem via proxy local)."""
+        from .images import ProductImageService
+        return {
+            "id": str(self.bitrix_id),
+            "name": self.name,
+            "price": float(self.price),
+            "description": self.description,
+            "image_url": ProductImageService.public_url(self.bitrix_id, self.image_url),
+            "category_id": str(self.section_id) if self.section_id is not None else None,
+        }
+
 class PharmacyPartners(models.Model):
     name = models.CharField(max_length=100)
     cnpj = models.CharField(unique=True, max_length=20)
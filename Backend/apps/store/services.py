@@ -1,8 +1,15 @@
+import logging
+from decimal import Decimal, InvalidOperation
 from datetime import date, timedelta
+from typing import Any, Dict, Iterable, List, Optional
 from django.db import transaction
-from .models import Subscriptions, Orders
+from config.cache import invalidate_tags
+from django.utils import timezone
+from .models import Subscriptions, Orders, Products, ProductTypes
 from apps.financial.models import Transaction
 
+logger = logging.getLogger(__name__)
+
 class SubscriptionService:
     @staticmethod
     @transaction.atomic
@@ -53,8 +60,185 @@ class SubscriptionService:
             user.current_plan = plan_type
             user.save()
 
+        from apps.accounts.profile_snapshot import ProfileSnapshotService
+        ProfileSnapshotService.schedule(user.pk, 'subscription_activated')
+
         # 2. Link Transaction to Subscription (via Order if needed, or direct)
         # Note: In the current model, Orders link to Subscriptions.
         # Ideally we should create an Order record here too for history.
         
         return True
+
+
+class CatalogSyncService:
+    """
+    Espelho local do catálogo Bitrix em Products/ProductTypes.
+
+    - full_reconcile(): varre crm.product.list paginado, faz upsert e desativa o que sumiu do Bitrix.
+    - apply_event(): aplica ONCRMPRODUCTADD/UPDATE/DELETE incrementalmente (webhook).
+    - get_catalog()/get_product(): leituras locais usadas no request path.
+
+    Todos os produtos do Bitrix são espelhados (inclusive os de plano); o filtro por
+    seção (BitrixConfig.SECTION_IDS) acontece na leitura.
+    """
+    PRODUCT_SELECT = ["ID", "NAME", "PRICE", "DESCRIPTION", "SECTION_ID"]
+    PLACEHOLDER_IMAGE = "https://via.placeholder.com/150"
+
+    # =========================================================================
+    # LEITURA (Request Path)
+    # =========================================================================
+
+    @staticmethod
+    def get_catalog(section_ids: Iterable[int]) -> List[Dict[str, Any]]:
+        products = Products.objects.filter(
+            bitrix_id__isnull=False, is_active=True, section_id__in=list(section_ids)
+        ).order_by('bitrix_id')
+        return [p.to_catalog_dict() for p in products]
+
+    @staticmethod
+    def get_product(bitrix_id: Any) -> Optional[Products]:
+        try:
+            return Products.objects.filter(bitrix_id=int(bitrix_id), is_active=True).first()
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def invalidate_caches():
+        # Catálogo, versão do catálogo e detalhes dos planos, em todos os workers (config/cache.py)
+        invalidate_tags(['catalog', 'plan'])
+
+    # =========================================================================
+    # SYNC (Bitrix -> Local)
+    # =========================================================================
+
+    @classmethod
+    def _section_names(cls) -> Dict[int, str]:
+        names = {}
+        from apps.accounts.services import BitrixService
+        for page in BitrixService.iter_list_pages('crm.productsection.list', select=["ID", "NAME"]):
+            for section in page:
+                names[int(section["ID"])] = section.get("NAME") or ""
+        return names
+
+    @staticmethod
+    def _product_types(section_ids: Iterable[Optional[int]], names: Dict[int, str]) -> Dict[Optional[int], ProductTypes]:
+        types = {t.bitrix_section_id: t for t in ProductTypes.objects.filter(bitrix_section_id__in=[s for s in section_ids if s is not None])}
+        for section_id in set(section_ids):
+            if section_id is None:
+                # Produtos sem seção (ex: planos) ficam num tipo próprio
+                types[None], _ = ProductTypes.objects.get_or_create(bitrix_section_id=None, name="Bitrix (sem seção)")
+                continue
+            name = (names.get(section_id) or f"Seção Bitrix {section_id}")[:50]
+            current = types.get(section_id)
+            if current is None:
+                types[section_id] = ProductTypes.objects.create(bitrix_section_id=section_id, name=name)
+            elif section_id in names and current.name != name:
+                current.name = name
+                current.save(update_fields=['name'])
+        return types
+
+    @staticmethod
+    def _to_int(value: Any) -> Optional[int]:
+        try:
+            return int(value) if value not in (None, "") else None
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def _to_price(value: Any) -> Decimal:
+        try:
+            return Decimal(str(value or 0)).quantize(Decimal("0.01"))
+        except InvalidOperation:
+            return Decimal("0.00")
+
+    @classmethod
+    def _upsert(cls, rows: List[Dict[str, Any]], section_names: Dict[int, str]) -> List[int]:
+        """Grava um lote de produtos do Bitrix (com imagens resolvidas em batch). Retorna os bitrix_ids."""
+        from apps.accounts.services import BitrixService
+        if not rows:
+            return []
+
+        images = BitrixService._fetch_best_images([r["ID"] for r in rows], use_cache=False)
+        types = cls._product_types([cls._to_int(r.get("SECTION_ID")) for r in rows], section_names)
+        ids = [int(r["ID"]) for r in rows]
+        existing = {p.bitrix_id: p for p in Products.objects.filter(bitrix_id__in=ids)}
+        now = timezone.now()
+
+        to_create, to_update = [], []
+        for r in rows:
+            bitrix_id = int(r["ID"])
+            section_id = cls._to_int(r.get("SECTION_ID"))
+            product = existing.get(bitrix_id) or Products(bitrix_id=bitrix_id)
+            image_url = images.get(str(bitrix_id))
+            # Falha/ausência de imagem não apaga uma imagem boa já espelhada
+            if image_url == cls.PLACEHOLDER_IMAGE and product.image_url and product.image_url != cls.PLACEHOLDER_IMAGE:
+                image_url = product.image_url
+
+            product.name = (r.get("NAME") or "")[:255]
+            product.price = cls._to_price(r.get("PRICE"))
+            product.description = r.get("DESCRIPTION") or ""
+            product.section_id = section_id
+            product.product_type = types[section_id]
+            product.image_url = image_url
+            product.is_active = True
+            product.bitrix_synced_at = now
+            (to_update if product.pk else to_create).append(product)
+
+        with transaction.atomic():
+            if to_create:
+                Products.objects.bulk_create(to_create)
+            if to_update:
+                Products.objects.bulk_update(to_update, [
+                    'name', 'price', 'description', 'section_id', 'product_type',
+                    'image_url', 'is_active', 'bitrix_synced_at'
+                ])
+        return ids
+
+    @classmethod
+    def full_reconcile(cls) -> Dict[str, int]:
+        """
+        Sincronização completa (cron): todas as páginas de crm.product.list.
+        Produtos espelhados que não vieram mais do Bitrix são desativados (não apagados: OrderItems usa PROTECT).
+        """
+        from apps.accounts.services import BitrixService
+        section_names = cls._section_names()
+        seen, pages = set(), 0
+        # Streaming: a próxima página já é buscada enquanto a atual é gravada (imagens em batch por página)
+        for page in BitrixService.iter_list_pages('crm.product.list', {"order": {"ID": "ASC"}}, select=cls.PRODUCT_SELECT):
+            pages += 1
+            seen.update(cls._upsert(page, section_names))
+
+        deactivated = Products.objects.filter(
+            bitrix_id__isnull=False, is_active=True
+        ).exclude(bitrix_id__in=seen).update(is_active=False, bitrix_synced_at=timezone.now())
+
+        cls.invalidate_caches()
+        logger.info(f"🗂️ Catálogo Bitrix reconciliado: {len(seen)} produtos, {deactivated} desativados, {pages} páginas.")
+        return {"products": len(seen), "deactivated": deactivated, "pages": pages}
+
+    @classmethod
+    def apply_event(cls, event: str, product_id: Any) -> bool:
+        """Aplica um evento ONCRMPRODUCT* recebido por webhook."""
+        from apps.accounts.services import BitrixService, TRANSIENT_ERRORS
+        bitrix_id = cls._to_int(product_id)
+        if bitrix_id is None:
+            logger.warning(f"⚠️ Evento {event} sem ID de produto.")
+            return False
+
+        try:
+            if event == 'ONCRMPRODUCTDELETE':
+                Products.objects.filter(bitrix_id=bitrix_id).update(is_active=False, bitrix_synced_at=timezone.now())
+            else:
+                resp = BitrixService._safe_request('GET', 'crm.product.get.json', params={"id": bitrix_id})
+                product = (resp or {}).get('result')
+                if not product:
+                    return False
+                cls._upsert([{k: product.get(k) for k in cls.PRODUCT_SELECT}], section_names={})
+            return True
+        except TRANSIENT_ERRORS:
+            raise # Bitrix fora: o consumidor de webhooks reagenda o evento
+        except Exception as e:
+            logger.error(f"❌ Erro aplicando {event} do produto {bitrix_id} no espelho: {e}")
+            return False
+        finally:
+            cls.invalidate_caches()
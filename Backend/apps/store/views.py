@@ -2,9 +2,12 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import AllowAny
-from django.http import HttpResponse
+import logging
+from django.conf import settings
+from django.http import FileResponse, HttpResponseNotModified
 from apps.accounts.services import BitrixService
-import requests
+
+logger = logging.getLogger(__name__)
 
 class ProductCatalogView(APIView):
     """
@@ -23,16 +26,36 @@ class ProductCatalogView(APIView):
 
 class ProductImageProxyView(APIView):
     """
-    Proxy para servir imagens do Bitrix.
-    URL: /api/store/image/<product_id>/
+    Proxy para servir imagens do Bitrix (cache em disco + variantes, ver apps/store/images.py).
+    URL: /api/store/image/<product_id>/?v=<versão>&w=<largura>&fmt=webp|jpeg|png
     """
     permission_classes = [AllowAny]
+    authentication_classes = [] # Pública, como o catálogo
 
     def get(self, request, product_id):
-        # Agora o serviço retorna (conteúdo, content_type)
-        image_content, content_type = BitrixService.get_product_image_content(product_id)
-        
-        if image_content:
-            return HttpResponse(image_content, content_type=content_type)
-        
-        return Response({"error": "Imagem não encontrada"}, status=status.HTTP_404_NOT_FOUND)
\ No newline at end of file
+        from .images import ProductImageService, ImageNotAvailable
+
+        try:
+            width = int(request.GET['w']) if request.GET.get('w') else None
+            variant = ProductImageService.get_variant(product_id, width, request.GET.get('fmt') or None)
+        except ValueError:
+            return Response({"error": "Parâmetros de imagem inválidos"}, status=status.HTTP_400_BAD_REQUEST)
+        except ImageNotAvailable as e:
+            logger.info(f"🖼️ Imagem indisponível para o produto {product_id}: {e}")
+            return Response({"error": "Imagem não encontrada"}, status=status.HTTP_404_NOT_FOUND)
+
+        # URL versionada pela origem atual (?v=) é imutável: navegador/CDN guardam por 1 ano.
+        # Sem versão (ou versão antiga), cache curto para pegar a troca de imagem no Bitrix.
+        if request.GET.get('v') == variant.version:
+            cache_control = "public, max-age=31536000, immutable"
+        else:
+            cache_control = f"public, max-age={getattr(settings, 'PRODUCT_IMAGE_MAX_AGE', 3600)}"
+
+        if_none_match = request.headers.get('If-None-Match', '')
+        if variant.etag in [tag.strip() for tag in if_none_match.split(',')]:
+            response = HttpResponseNotModified()
+        else:
+            response = FileResponse(open(variant.path, 'rb'), content_type=variant.content_type)
+        response['ETag'] = variant.etag
+        response['Cache-Control'] = cache_control
+        return response
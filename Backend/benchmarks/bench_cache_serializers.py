@@ -0,0 +1,155 @@
+"""
+Microbenchmark: serialização dos valores do cache — pickle (RedisSerializer do Django) x CacheSerializer.
+
+Payloads no formato real das chaves quentes (ver config/cache.py): catálogo e protocolo dentro do
+envelope de tags do TieredCache, detalhes de plano, (digest, ext) do proxy de imagens, o perfil
+materializado e uma linha do espelho de Deals com Decimal/datetime. Para cada combinação de
+codec/compressão: tempo de encode e decode, tamanho gravado (Redis/L1) e pico de memória do encode.
+Codecs/compressões sem a lib instalada (orjson, lz4) são pulados.
+
+Uso (a partir de Backend/):
+    python benchmarks/bench_cache_serializers.py --catalog-size 60 --rounds 2000
+"""
+
+import argparse
+import datetime
+import os
+import pickle
+import random
+import sys
+import time
+import tracemalloc
+import uuid
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+VARIANTS = [
+    ("pickle (atual)", None, None),
+    ("msgpack", "msgpack", "none"),
+    ("msgpack + zlib", "msgpack", "zlib"),
+    ("msgpack + lz4", "msgpack", "lz4"),
+    ("orjson", "orjson", "none"),
+    ("orjson + zlib", "orjson", "zlib"),
+    ("orjson + lz4", "orjson", "lz4"),
+]
+
+
+def tagged(value, *tags):
+    return ("__tagged__", {tag: 1760000000000 + i for i, tag in enumerate(tags)}, value)
+
+
+def catalog_payload(size, rng):
+    words = "cabelo queda fórmula manipulada dose diária uso contínuo couro cabeludo tratamento".split()
+    catalog = []
+    for i in range(size):
+        description = "<p>" + " ".join(rng.choice(words) for _ in range(rng.randint(30, 90))) + "</p>"
+        catalog.append({
+            "id": str(100 + i), "name": f"Produto {i} {rng.choice(words).title()}", "price": round(rng.uniform(30, 300), 2),
+            "description": description, "image_url": f"/api/store/image/{100 + i}/?v={uuid.uuid4().hex[:16]}&fmt=webp",
+            "category_id": rng.choice(["16", "18", "20", "22", "24"]),
+        })
+    return tagged(catalog, "catalog")
+
+
+def protocol_payload(catalog):
+    products = [{**{k: p[k] for k in ("id", "name", "price", "description")}, "quantity": 1,
+                 "img": p["image_url"], "sub": "Protocolo Personalizado"} for p in catalog[2][:4]]
+    protocol = {"deal_id": "48213", "stage": "C3:PREPAYMENT_INVOICE", "title": "Protocolo Capilar",
+                "total_value": round(sum(p["price"] for p in products), 2), "products": products,
+                "source": "mirror", "synced_at": "2026-10-17T12:00:00+00:00", "stale": False}
+    return tagged(protocol, f"user:{uuid.uuid4()}")
+
+
+def profile_payload():
+    return {
+        "name": "Maria Souza", "email": "maria@example.com", "role": "PATIENT", "plan": "plus",
+        "phone": "11999990000", "date_of_birth": datetime.date(1990, 5, 17),
+        "address": {"street": "Rua A", "number": "100", "city": "São Paulo", "state": "SP", "zip": "01000-000",
+                    "neighborhood": "Centro", "complement": "", "country": "Brasil"},
+        "medical_team": {"trichologist": {"name": "Dr. Ana", "crm": "12345", "photo": None,
+                                          "id": str(uuid.uuid4()), "description": "Tricologista " * 20},
+                         "nutritionist": None},
+        "payment_info": {"has_card": True, "cardName": "Cartão Salvo", "cardNumber": "**** **** **** 4242",
+                         "brand": "VISA", "expiry": "**/**"},
+        "plan_info": {"name": "Plano Plus", "cycle": "Mensal", "price": "R$ 189.90", "status": "Ativo",
+                      "subscription_status": "active", "access_until": "17/11/2026", "is_subscription": True,
+                      "scheduled_plan": None, "scheduled_date": None},
+        "pending_transaction": {"exists": False},
+    }
+
+
+def mirror_payload():
+    now = datetime.datetime(2026, 10, 17, 12, 0, tzinfo=datetime.timezone.utc)
+    return [{"deal_id": 48213 + i, "contact_id": 9000 + i, "stage_id": "C3:WON", "opportunity": Decimal("189.90"),
+             "payment_status": "Aprovado", "synced_at": now, "date_modify": now - datetime.timedelta(hours=i),
+             "closed": False} for i in range(20)]
+
+
+def payloads(catalog_size, seed):
+    rng = random.Random(seed)
+    catalog = catalog_payload(catalog_size, rng)
+    return {
+        "catalog": catalog,
+        "user_protocol": protocol_payload(catalog),
+        "plan_details": tagged({"id": "132", "name": "Plano Plus", "price": 189.9}, "plan"),
+        "image_src": ("9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08", "jpeg"),
+        "profile": profile_payload(),
+        "deal_mirror_rows": mirror_payload(),
+    }
+
+
+def make_serializer(codec, compression, min_bytes):
+    if codec is None:
+        from django.core.cache.backends.redis import RedisSerializer
+        return RedisSerializer()
+    from config import cache_serializers
+    if (codec == "orjson" and cache_serializers.orjson is None) or (compression == "lz4" and cache_serializers.lz4_frame is None):
+        return None
+    return cache_serializers.CacheSerializer(codec=codec, compression=compression, min_bytes=min_bytes)
+
+
+def measure(serializer, value, rounds):
+    data = serializer.dumps(value)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        serializer.dumps(value)
+    encode = (time.perf_counter() - start) / rounds
+    start = time.perf_counter()
+    for _ in range(rounds):
+        serializer.loads(data)
+    decode = (time.perf_counter() - start) / rounds
+
+    tracemalloc.start()
+    serializer.dumps(value)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return data, encode, decode, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--catalog-size", type=int, default=60)
+    parser.add_argument("--rounds", type=int, default=2000)
+    parser.add_argument("--min-bytes", type=int, default=1024)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    print(f"catalog_size={args.catalog_size} rounds={args.rounds} min_bytes={args.min_bytes}\n")
+    for name, value in payloads(args.catalog_size, args.seed).items():
+        print(f"{name} (pickle: {len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))} bytes)")
+        print(f"  {'serializador':<18} {'encode':>10} {'decode':>10} {'tamanho':>10} {'pico enc.':>10}  ida e volta")
+        for label, codec, compression in VARIANTS:
+            serializer = make_serializer(codec, compression, args.min_bytes)
+            if serializer is None:
+                print(f"  {label:<18} {'(lib não instalada)':>43}")
+                continue
+            data, encode, decode, peak = measure(serializer, value, args.rounds)
+            same = serializer.loads(data) == value
+            print(f"  {label:<18} {encode * 1e6:>8.1f}µs {decode * 1e6:>8.1f}µs {len(data):>8}B {peak:>9}B  "
+                  f"{'idêntico' if same else 'tipos JSON (tuplas -> listas)'}")
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Benchmark: montagem do catálogo frio (cache vazio) em função do tamanho do catálogo.
+
+Compara a resolução de imagens antiga (2 chamadas sequenciais por produto:
+catalog.productImage.list + crm.product.get) com a atual (_fetch_best_images em batch).
+Sobe um stub local do Bitrix com latência por requisição; metade dos produtos
+só tem imagem em DETAIL_PICTURE (força a segunda etapa). O espelho local (store.Products,
+CatalogSyncService.get_catalog) é desligado durante o benchmark: mede-se o caminho Bitrix, sem banco.
+
+Uso (a partir de Backend/):
+    SECRET_KEY=x python benchmarks/bench_catalog_images.py --sizes 10 25 50 100 --latency-ms 80
+    # Com o rate limit real do Bitrix (2 req/s, burst 50):
+    SECRET_KEY=x python benchmarks/bench_catalog_images.py --rate-limit
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def make_handler(state):
+    def product_image_list(pid):
+        has_gallery = int(pid) % 2 == 0
+        return {"productImages": [{"detailUrl": f"https://cdn.example/{pid}.jpg"}] if has_gallery else []}
+
+    def product_get(pid):
+        return {"ID": pid, "DETAIL_PICTURE": {"showUrl": f"https://cdn.example/detail/{pid}.jpg"}}
+
+    def run(method, params):
+        pid = (params.get("productId") or params.get("id") or ["0"])[0]
+        if method == "catalog.productImage.list":
+            return product_image_list(pid)
+        if method == "crm.product.get":
+            return product_get(pid)
+        if method == "crm.product.list":
+            return [{"ID": str(i), "NAME": f"Produto {i}", "PRICE": "10", "SECTION_ID": "16"} for i in range(1, state["size"] + 1)]
+        return True
+
+    class StubBitrixHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            self._reply(None)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            self._reply(json.loads(self.rfile.read(length) or b"{}"))
+
+        def _reply(self, body):
+            time.sleep(state["latency"])
+            state["requests"] += 1
+            url = urlparse(self.path)
+            method = url.path.rsplit("/", 1)[-1].removesuffix(".json")
+            if method == "batch":
+                results = {}
+                for name, cmd in (body or {}).get("cmd", {}).items():
+                    sub_method, _, query = cmd.partition("?")
+                    results[name] = run(sub_method, parse_qs(query))
+                payload = {"result": {"result": results, "result_error": []}}
+            else:
+                payload = {"result": run(method, parse_qs(url.query))}
+            data = json.dumps(payload).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    return StubBitrixHandler
+
+
+def legacy_catalog(service):
+    """Algoritmo anterior: 2 chamadas sequenciais por produto."""
+    resp = service._safe_request('POST', 'crm.product.list.json', json={})
+    catalog = []
+    for p in resp["result"]:
+        img = service._safe_request('GET', 'catalog.productImage.list.json', params={"productId": p["ID"]})
+        url = (img["result"].get("productImages") or [{}])[0].get("detailUrl")
+        if not url:
+            prod = service._safe_request('GET', 'crm.product.get.json', params={"id": p["ID"]})
+            url = prod["result"]["DETAIL_PICTURE"]["showUrl"]
+        catalog.append({"id": p["ID"], "image_url": url})
+    return catalog
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 25, 50, 100])
+    parser.add_argument("--latency-ms", type=float, default=80.0)
+    parser.add_argument("--rate-limit", action="store_true", help="Aplica o token-bucket (2 req/s, burst 50)")
+    args = parser.parse_args()
+
+    state = {"size": 0, "latency": args.latency_ms / 1000, "requests": 0}
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    os.environ["BITRIX_WEBHOOK_URL"] = f"http://127.0.0.1:{server.server_address[1]}/rest/1/token/"
+    os.environ["BITRIX_RATE_LIMIT_BACKEND"] = "local"
+    os.environ["BITRIX_RATE_LIMIT_ENABLED"] = "True" if args.rate_limit else "False"
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+    import django
+    django.setup()
+    from django.core.cache import cache
+    from apps.accounts.services import BitrixService
+    from apps.store.services import CatalogSyncService
+    # Espelho vazio: _build_product_catalog cai no Bitrix (e não precisa de Postgres)
+    CatalogSyncService.get_catalog = staticmethod(lambda section_ids: [])
+
+    print(f"latency={args.latency_ms}ms rate_limit={'on' if args.rate_limit else 'off'}\n")
+    print(f"{'produtos':>8} | {'serial (antes)':>22} | {'batch (atual)':>22}")
+    for size in args.sizes:
+        state["size"] = size
+        row = []
+        for build in (lambda: legacy_catalog(BitrixService), BitrixService.get_product_catalog):
+            cache.clear()
+            state["requests"] = 0
+            start = time.perf_counter()
+            catalog = build()
+            elapsed = time.perf_counter() - start
+            assert len(catalog) == size
+            row.append(f"{elapsed * 1000:9.0f}ms {state['requests']:4d} reqs")
+        print(f"{size:>8} | {row[0]:>22} | {row[1]:>22}")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
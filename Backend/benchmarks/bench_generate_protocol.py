@@ -0,0 +1,135 @@
+"""
+Microbenchmark: throughput de generate_protocol para muitos conjuntos de respostas.
+
+Compara a implementação anterior (varredura linear do catálogo por papel, a cada chamada)
+com a atual (índice papel->produto por versão do catálogo + memo por hash das respostas).
+O catálogo sintético é gravado direto no cache, então não há Bitrix nem banco envolvidos.
+
+Uso (a partir de Backend/):
+    SECRET_KEY=x python benchmarks/bench_generate_protocol.py --answers 5000 --catalog-size 60
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+GENDERS = ["masculino", "feminino"]
+HEALTH = ["", "nenhuma", "cardiaca", "renal", "hepatica", "cancer", "cardiaca, renal"]
+ALLERGY = ["", "nenhuma", "finasterida", "minoxidil"]
+PETS = ["sim", "nao"]
+SYMPTOM = ["", "queda", "psoriase", "coceira"]
+
+
+def synthetic_catalog(size):
+    names = [
+        ("Finasterida 1mg", "16"), ("Dutasterida 0.5mg", "16"), ("Minoxidil 2.5mg", "16"),
+        ("Saw Palmetto 320mg", "18"), ("Minoxidil Tópico 5%", "20"), ("Finasterida Tópico 0.1%", "20"),
+        ("Shampoo Antiqueda", "22"), ("Biotina 10mg", "24"),
+    ]
+    catalog = [{"id": str(i), "name": f"Produto genérico {i}", "price": 10.0 + i, "description": "",
+                "image_url": None, "category_id": "32"} for i in range(size - len(names))]
+    # Produtos que casam ficam no fim: pior caso para a varredura linear
+    for i, (name, section) in enumerate(names):
+        catalog.append({"id": str(1000 + i), "name": name, "price": 50.0 + i, "description": "",
+                        "image_url": None, "category_id": section})
+    return catalog
+
+
+def random_answers(rng):
+    return {
+        "F1_Q1_gender": rng.choice(GENDERS), "F2_Q14_health_cond": rng.choice(HEALTH),
+        "F2_Q15_allergy": rng.choice(ALLERGY), "F2_Q18_pets": rng.choice(PETS),
+        "F2_Q8_symptom": rng.choice(SYMPTOM), "F1_Q6_goal": str(rng.random()),  # Ruído: não afeta o protocolo
+    }
+
+
+def legacy_generate_protocol(answers, catalog_loader):
+    """Implementação anterior (copiada) para comparação."""
+    MATCHERS = {
+        "dutasterida_oral": ["Dutasterida"], "finasterida_oral": ["Finasterida"],
+        "minoxidil_oral": ["Minoxidil", "2.5"], "saw_palmetto_oral": ["Saw"],
+        "minoxidil_topico": ["Minoxidil", "Tópico"], "finasterida_topica": ["Finasterida", "Tópico"],
+        "shampoo": ["Shampoo"], "biotina": ["Biotina"]
+    }
+    catalog_cache = catalog_loader()
+
+    def find_product(role_key):
+        keywords = [k.lower() for k in MATCHERS.get(role_key, [])]
+        for p in catalog_cache:
+            name = p.get("name", "").lower()
+            cat_id = str(p.get("category_id"))
+            if "topico" in role_key and cat_id != '20': continue
+            if all(k in name for k in keywords):
+                if "oral" in role_key and "topico" in name: continue
+                return p
+        return None
+
+    gender = answers.get("F1_Q1_gender", "masculino")
+    health = answers.get("F2_Q14_health_cond", "").lower()
+    alrg = answers.get("F2_Q15_allergy", "").lower()
+    pets = answers.get("F2_Q18_pets") == "sim"
+    block_horm = (gender == "feminino" or "cancer" in health or "hepatica" in health or "finasterida" in alrg)
+    block_minox_or = ("cardiaca" in health or "renal" in health or "minoxidil" in alrg)
+    block_minox_top = (pets or "psoriase" in answers.get("F2_Q8_symptom", "").lower() or "cardiaca" in health)
+    selected = []
+    oral = "minoxidil_oral" if gender == "feminino" else ("finasterida_oral" if not block_horm else ("minoxidil_oral" if not block_minox_or else "saw_palmetto_oral"))
+    if oral and not (oral == "minoxidil_oral" and block_minox_or): selected.append(oral)
+    topical = "minoxidil_topico" if not block_minox_top else None
+    if not topical and gender == "masculino" and not block_horm: topical = "finasterida_topica"
+    if topical: selected.append(topical)
+    selected.extend(["shampoo", "biotina"])
+    final_products, total = [], 0.0
+    for role in selected:
+        p = find_product(role)
+        if p:
+            total += p["price"]
+            final_products.append({"id": p["id"], "name": p["name"], "price": p["price"], "sub": "Protocolo Personalizado",
+                                   "img": p["image_url"], "description": p["description"]})
+    return {"redFlag": False, "title": "Seu Protocolo Exclusivo", "description": "Baseado na sua triagem.",
+            "products": final_products, "total_price": round(total, 2)}
+
+
+def run(label, fn, answer_sets):
+    start = time.perf_counter()
+    results = [fn(a) for a in answer_sets]
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {len(answer_sets) / elapsed:>10.0f} protocolos/s  ({elapsed * 1000:.0f}ms)")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--answers", type=int, default=5000)
+    parser.add_argument("--catalog-size", type=int, default=60)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+    import django
+    django.setup()
+    from django.core.cache import cache
+    from apps.accounts.services import BitrixService
+    from apps.accounts.protocol import ProtocolEngine
+
+    rng = random.Random(args.seed)
+    answer_sets = [random_answers(rng) for _ in range(args.answers)]
+    cache.set("bitrix_product_catalog", synthetic_catalog(args.catalog_size), 3600)
+    cache.delete(BitrixService.CATALOG_VERSION_KEY)
+
+    print(f"answers={args.answers} catalog_size={args.catalog_size}\n")
+    before = run("antes (varredura linear)", lambda a: legacy_generate_protocol(a, lambda: cache.get("bitrix_product_catalog")), answer_sets)
+    ProtocolEngine._memo.clear()
+    ProtocolEngine._index = None
+    after = run("atual (memo frio)", BitrixService.generate_protocol, answer_sets)
+    run("atual (memo quente)", BitrixService.generate_protocol, answer_sets)
+
+    assert before == after, "Resultado divergente da implementação anterior"
+    print("\n✅ Resultados idênticos à implementação anterior.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Benchmark: requests.request (conexão nova por chamada) vs pool keep-alive (http_pool).
+
+Sobe um stub HTTP local que imita o Bitrix e simula o custo do handshake
+(TCP + TLS até o Bitrix) com um atraso por conexão nova. Mede a latência dos
+fluxos reais, que fazem várias chamadas sequenciais ao Bitrix:
+
+  - prepare_deal_payment: contact.get, lead.get, deal.list, deal.update, productrows.set
+  - profile (cache miss):  deal.list, productrows.get, contact.get
+
+Uso (a partir de Backend/):
+    python benchmarks/bench_http_pool.py --handshake-ms 60 --rtt-ms 20 --iterations 30
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from apps.accounts.http_pool import HTTPClientPool  # noqa: E402
+
+FLOWS = {
+    "prepare_deal_payment": [
+        "crm.contact.get.json", "crm.lead.get.json", "crm.deal.list.json",
+        "crm.deal.update.json", "crm.deal.productrows.set.json",
+    ],
+    "profile_cache_miss": [
+        "crm.deal.list.json", "crm.deal.productrows.get.json", "crm.contact.get.json",
+    ],
+}
+
+
+def make_handler(handshake_s: float, rtt_s: float):
+    class StubBitrixHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # Keep-alive
+        disable_nagle_algorithm = True
+
+        def setup(self):
+            super().setup()
+            time.sleep(handshake_s)  # Custo de uma conexão nova
+
+        def _reply(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            if length:
+                self.rfile.read(length)
+            time.sleep(rtt_s)
+            body = json.dumps({"result": {"ID": "1"}, "time": {}}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        do_GET = _reply
+        do_POST = _reply
+
+        def log_message(self, *args):
+            pass
+
+    return StubBitrixHandler
+
+
+def run_flow(call, base_url, endpoints):
+    start = time.perf_counter()
+    for endpoint in endpoints:
+        call("POST", f"{base_url}{endpoint}", json={"id": 1}, timeout=10).json()
+    return time.perf_counter() - start
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    return f"p50={statistics.median(samples) * 1000:7.1f}ms  p95={p95 * 1000:7.1f}ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--handshake-ms", type=float, default=60.0)
+    parser.add_argument("--rtt-ms", type=float, default=20.0)
+    parser.add_argument("--iterations", type=int, default=30)
+    parser.add_argument("--pool-size", type=int, default=10)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(args.handshake_ms / 1000, args.rtt_ms / 1000))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/rest/1/token/"
+
+    pool = HTTPClientPool("bench", pool_size=args.pool_size)
+    pool.warm_up(f"{base_url}server.time.json")
+
+    print(f"handshake={args.handshake_ms}ms rtt={args.rtt_ms}ms iterations={args.iterations}\n")
+    for flow, endpoints in FLOWS.items():
+        cold = [run_flow(requests.request, base_url, endpoints) for _ in range(args.iterations)]
+        warm = [run_flow(pool.request, base_url, endpoints) for _ in range(args.iterations)]
+        print(f"{flow:<22} sem pool: {summarize(cold)}")
+        print(f"{'':<22} com pool: {summarize(warm)}")
+
+    print("\npool stats:", json.dumps(pool.snapshot(), indent=2))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
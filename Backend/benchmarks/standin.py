@@ -0,0 +1,853 @@
+"""
+Stand-in local do Bitrix (REST via webhook) e do Asaas (API v3) para benchmarks e testes de carga.
+
+Um único servidor HTTP atende os dois serviços:
+    Bitrix: http://127.0.0.1:<porta>/bitrix/rest/1/standin/<metodo>.json   (BITRIX_WEBHOOK_URL)
+    Asaas:  http://127.0.0.1:<porta>/asaas/api/v3/<endpoint>               (ASAAS_API_URL)
+
+Modos (--mode):
+  fake    (padrão) CRM e gateway em memória, com estado e dados sintéticos (--contacts, --products).
+          Implementa o que o backend chama: crm.{contact,lead,deal}.{add,get,list,update},
+          crm.deal.productrows.{get,set}, crm.product.{get,list}, crm.productsection.list,
+          catalog.productImage.list e batch (com referências $result[...]); no Asaas,
+          customers, payments (+ pixQrCode) e subscriptions.
+  record  encaminha para os serviços reais (--bitrix-upstream / --asaas-upstream) e grava as
+          respostas no cassette (--cassette, JSON).
+  replay  serve as respostas gravadas. Chave exata = serviço + método HTTP + caminho + params;
+          sem gravação exata, usa qualquer resposta gravada do mesmo endpoint; sem nenhuma,
+          cai no fake (ou 404 com --strict). Respostas repetidas da mesma chave giram em ordem.
+
+Injeção de falhas (em todos os modos, antes de responder):
+  --latency-ms / --jitter-ms   atraso de cada resposta
+  --error-rate 0.02            fração de respostas 500/503
+  --rate-limit-rate 0.05       fração de 429 aleatórios
+  --bitrix-rps 2               token bucket como o limite real do Bitrix (429 QUERY_LIMIT_EXCEEDED acima disso)
+
+Webhooks de saída (opcionais), para exercitar os receivers do backend sob carga:
+  --bitrix-webhook-url   ONCRMDEAL{ADD,UPDATE} a cada deal criado/alterado (auth[application_token] = --bitrix-app-token)
+  --asaas-webhook-url    PAYMENT_CONFIRMED para pagamentos criados (cartão na hora, Pix após --pix-confirm-seconds)
+
+GET /_standin/stats devolve as contagens por método e as falhas injetadas; POST /_standin/reset zera.
+
+Uso (a partir de Backend/):
+    python benchmarks/standin.py --port 8765 --latency-ms 120 --jitter-ms 40 --bitrix-rps 2
+    BITRIX_WEBHOOK_URL=http://127.0.0.1:8765/bitrix/rest/1/standin/ \\
+    ASAAS_API_URL=http://127.0.0.1:8765/asaas/api/v3 python manage.py runserver
+
+Outros benchmarks podem subir o stand-in no próprio processo com `start_standin(...)`.
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+import requests
+
+BRT = timezone(timedelta(hours=-3))
+PAGE_SIZE = 50
+CPF_FIELD = "UF_CRM_CONTACT_1767453262601"
+PIX_IMAGE = "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR42mNkYAAAAAYAAjCB0C8AAAAASUVORK5CYII="
+
+SECTIONS = {"16": "Tratamento Oral", "18": "Suplementos Orais", "20": "Tópicos", "22": "Shampoos",
+            "24": "Vitaminas", "32": "Planos"}
+PRODUCTS = [
+    ("Finasterida 1mg", "16", 89.9), ("Dutasterida 0.5mg", "16", 119.9), ("Minoxidil 2.5mg", "16", 79.9),
+    ("Saw Palmetto 320mg", "18", 69.9), ("Minoxidil Tópico 5%", "20", 99.9), ("Finasterida Tópico 0.1%", "20", 129.9),
+    ("Shampoo Antiqueda", "22", 49.9), ("Biotina 10mg", "24", 39.9),
+]
+PLANS = [(262, "Plano Standard", 149.9), (264, "Plano Plus", 249.9)]
+
+
+def now_bitrix() -> str:
+    return datetime.now(BRT).replace(microsecond=0).isoformat()
+
+
+# =============================================================================
+# Parâmetros no formato do Bitrix (http_build_query do PHP)
+# =============================================================================
+
+def parse_php_query(pairs):
+    """[('filter[EMAIL]', 'x'), ('select[]', 'ID')] -> {'filter': {'EMAIL': 'x'}, 'select': ['ID']}"""
+    root = {}
+    for key, value in pairs:
+        head = key.split('[', 1)[0]
+        parts = [head] + re.findall(r'\[([^\]]*)\]', key[len(head):])
+        append = len(parts) > 1 and parts[-1] == ''
+        if append:
+            parts = parts[:-1]
+        node = root
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+        if append:
+            node.setdefault(parts[-1], []).append(value)
+        else:
+            node[parts[-1]] = value
+    return _lists_from_indexes(root)
+
+
+def _lists_from_indexes(value):
+    if isinstance(value, dict):
+        value = {k: _lists_from_indexes(v) for k, v in value.items()}
+        if value and all(k.isdigit() for k in value):
+            return [value[k] for k in sorted(value, key=int)]
+    elif isinstance(value, list):
+        return [_lists_from_indexes(v) for v in value]
+    return value
+
+
+_REF = re.compile(r'^\$result\[([^\]]+)\]((?:\[[^\]]*\])*)$')
+
+
+def resolve_refs(value, results):
+    """Substitui $result[nome][0][ID] pelo resultado de um comando anterior do mesmo batch."""
+    if isinstance(value, dict):
+        return {k: resolve_refs(v, results) for k, v in value.items()}
+    if isinstance(value, list):
+        return [resolve_refs(v, results) for v in value]
+    if isinstance(value, str):
+        match = _REF.match(value)
+        if match:
+            node = results.get(match.group(1))
+            for part in re.findall(r'\[([^\]]*)\]', match.group(2)):
+                if isinstance(node, list) and part.isdigit() and int(part) < len(node):
+                    node = node[int(part)]
+                elif isinstance(node, dict):
+                    node = node.get(part)
+                else:
+                    node = None
+            return "" if node is None or isinstance(node, (dict, list)) else str(node)
+    return value
+
+
+# =============================================================================
+# Bitrix em memória
+# =============================================================================
+
+class BitrixError(Exception):
+    def __init__(self, status, code, description):
+        super().__init__(description)
+        self.status, self.code, self.description = status, code, description
+
+
+class FakeBitrix:
+    ENTITIES = ("contact", "lead", "deal")
+    MULTI_FIELDS = ("EMAIL", "PHONE")
+
+    def __init__(self, contacts=200, extra_products=20, seed=42, on_deal_event=None):
+        self.lock = threading.Lock()
+        self.rng = random.Random(seed)
+        self.on_deal_event = on_deal_event
+        self.tables = {entity: {} for entity in self.ENTITIES}
+        self.next_id = {entity: 1 for entity in self.ENTITIES}
+        self.rows = defaultdict(list)
+        self.products = {}
+        self._seed(contacts, extra_products)
+
+    # --- Dados sintéticos ---
+
+    def _seed(self, contacts, extra_products):
+        for pid, name, price in PLANS:
+            self.products[str(pid)] = {"ID": str(pid), "NAME": name, "PRICE": str(price), "SECTION_ID": "32",
+                                       "DESCRIPTION": f"{name} mensal", "CURRENCY_ID": "BRL"}
+        for i, (name, section, price) in enumerate(PRODUCTS):
+            pid = str(100 + i)
+            self.products[pid] = {"ID": pid, "NAME": name, "PRICE": str(price), "SECTION_ID": section,
+                                  "DESCRIPTION": f"{name} - uso contínuo", "CURRENCY_ID": "BRL"}
+        for i in range(extra_products):
+            pid = str(1000 + i)
+            section = self.rng.choice(list(SECTIONS)[:-1])
+            self.products[pid] = {"ID": pid, "NAME": f"Produto {pid}", "PRICE": f"{10 + i:.2f}",
+                                  "SECTION_ID": section, "DESCRIPTION": "", "CURRENCY_ID": "BRL"}
+
+        for i in range(1, contacts + 1):
+            contact_id = self._insert("contact", {
+                "NAME": f"Paciente{i}", "LAST_NAME": "Standin",
+                "EMAIL": [{"VALUE": f"paciente{i}@standin.local", "VALUE_TYPE": "WORK"}],
+                "PHONE": [{"VALUE": f"+55119{i:08d}", "VALUE_TYPE": "MOBILE"}],
+                CPF_FIELD: f"{i:011d}",
+            })
+            plan_id, plan_name, plan_price = self.rng.choice(PLANS)
+            deal_id = self._insert("deal", {
+                "TITLE": f"Protocolo Paciente{i}", "CONTACT_ID": str(contact_id), "LEAD_ID": None,
+                "STAGE_ID": "WON", "CLOSED": "Y", "OPPORTUNITY": str(plan_price), "CURRENCY_ID": "BRL",
+            })
+            rows = [{"PRODUCT_ID": plan_id, "PRODUCT_NAME": plan_name, "PRICE": plan_price, "QUANTITY": 1}]
+            for name, section, price in self.rng.sample(PRODUCTS, 3):
+                pid = next(p["ID"] for p in self.products.values() if p["NAME"] == name)
+                rows.append({"PRODUCT_ID": int(pid), "PRODUCT_NAME": name, "PRICE": price, "QUANTITY": 1})
+            self._set_rows(deal_id, rows)
+
+    def _insert(self, entity, fields):
+        new_id = self.next_id[entity]
+        self.next_id[entity] += 1
+        stamp = now_bitrix()
+        record = {"ID": str(new_id), "DATE_CREATE": stamp, "DATE_MODIFY": stamp}
+        if entity == "lead":
+            record.update({"STATUS_ID": "NEW", "CONTACT_ID": None})
+        record.update(self._normalize_fields(fields))
+        self.tables[entity][str(new_id)] = record
+        return new_id
+
+    def _normalize_fields(self, fields):
+        fields = dict(fields or {})
+        for multi in self.MULTI_FIELDS:
+            value = fields.get(multi)
+            if isinstance(value, dict):
+                fields[multi] = list(value.values())
+            elif isinstance(value, str):
+                fields[multi] = [{"VALUE": value, "VALUE_TYPE": "WORK"}]
+        return fields
+
+    def _set_rows(self, deal_id, rows):
+        self.rows[str(deal_id)] = [{
+            "ID": str(i + 1), "OWNER_ID": str(deal_id), "OWNER_TYPE": "D",
+            "PRODUCT_ID": int(row.get("PRODUCT_ID") or 0),
+            "PRODUCT_NAME": row.get("PRODUCT_NAME") or self.products.get(str(row.get("PRODUCT_ID")), {}).get("NAME", ""),
+            "PRICE": float(row.get("PRICE") or 0), "QUANTITY": float(row.get("QUANTITY") or 1), "SORT": (i + 1) * 10,
+        } for i, row in enumerate(rows or [])]
+
+    # --- Filtros / seleção ---
+
+    @staticmethod
+    def _field_values(record, field):
+        value = record.get(field)
+        if isinstance(value, list):
+            return [str(v.get("VALUE", "")).lower() if isinstance(v, dict) else str(v).lower() for v in value]
+        return ["" if value is None else str(value).lower()]
+
+    @staticmethod
+    def _compare(left, op, right):
+        def as_number(v):
+            try:
+                return float(v)
+            except (TypeError, ValueError):
+                return None
+        ln, rn = as_number(left), as_number(right)
+        if ln is not None and rn is not None:
+            left, right = ln, rn
+        elif op in (">", ">=", "<", "<="):
+            # Datas ISO do Bitrix: compara em UTC
+            try:
+                left = datetime.fromisoformat(str(left)).astimezone(timezone.utc)
+                right = datetime.fromisoformat(str(right)).astimezone(timezone.utc)
+            except ValueError:
+                pass
+        return {"=": left == right, "!": left != right, ">": left > right, ">=": left >= right,
+                "<": left < right, "<=": left <= right}[op]
+
+    def _matches(self, record, filters):
+        for key, expected in (filters or {}).items():
+            match = re.match(r'^(>=|<=|!=|!|>|<|=|%)?(.+)$', key)
+            op, field = match.group(1) or "=", match.group(2)
+            op = "!" if op == "!=" else op
+            values = self._field_values(record, field)
+            options = [str(e).lower() for e in (expected if isinstance(expected, list) else [expected])]
+            if op == "%":
+                ok = any(o in v for v in values for o in options)
+            elif op == "!":
+                ok = all(v not in options for v in values)
+            elif op == "=":
+                ok = any(v in options for v in values)
+            else:
+                ok = any(self._compare(v, op, options[0]) for v in values)
+            if not ok:
+                return False
+        return True
+
+    @staticmethod
+    def _select(record, select):
+        if not select or "*" in select:
+            return dict(record)
+        fields = set(select) | {"ID"}
+        if "UF_*" in fields:
+            fields |= {k for k in record if k.startswith("UF_")}
+        return {k: v for k, v in record.items() if k in fields}
+
+    def _list(self, records, params):
+        filters = params.get("filter") or {}
+        order = params.get("order") or {"ID": "ASC"}
+        select = params.get("select") or []
+        items = [r for r in records if self._matches(r, filters)]
+        for field, direction in reversed(list(order.items())):
+            def sort_key(r, field=field):
+                v = r.get(field)
+                try:
+                    return (0, float(v), "")
+                except (TypeError, ValueError):
+                    return (1, 0.0, "" if v is None else str(v))
+            items.sort(key=sort_key, reverse=str(direction).upper() == "DESC")
+
+        start = int(params.get("start") or 0)
+        if start == -1:
+            # Sem COUNT: só a primeira página, sem total/next (como no Bitrix)
+            return {"result": [self._select(r, select) for r in items[:PAGE_SIZE]]}
+        page = items[start:start + PAGE_SIZE]
+        response = {"result": [self._select(r, select) for r in page], "total": len(items)}
+        if start + PAGE_SIZE < len(items):
+            response["next"] = start + PAGE_SIZE
+        return response
+
+    # --- Métodos REST ---
+
+    def call(self, method, params):
+        with self.lock:
+            return self._call(method, params or {})
+
+    def _call(self, method, params):
+        crud = re.match(r'^crm\.(contact|lead|deal)\.(add|get|list|update)$', method)
+        if crud:
+            entity, action = crud.groups()
+            table = self.tables[entity]
+            if action == "list":
+                return self._list(table.values(), params)
+            if action == "add":
+                new_id = self._insert(entity, params.get("fields"))
+                if entity == "deal":
+                    self._emit("ONCRMDEALADD", new_id)
+                return {"result": new_id}
+            record = table.get(str(params.get("id") or params.get("ID") or ""))
+            if record is None:
+                raise BitrixError(400, "", "Not found")
+            if action == "get":
+                return {"result": dict(record)}
+            record.update(self._normalize_fields(params.get("fields")))
+            record["DATE_MODIFY"] = now_bitrix()
+            if entity == "deal":
+                self._emit("ONCRMDEALUPDATE", record["ID"])
+            return {"result": True}
+
+        if method in ("crm.deal.productrows.get", "crm.deal.productrows.set"):
+            deal_id = str(params.get("id") or "")
+            if deal_id not in self.tables["deal"]:
+                raise BitrixError(400, "", "Not found")
+            if method.endswith(".get"):
+                return {"result": list(self.rows.get(deal_id, []))}
+            self._set_rows(deal_id, params.get("rows") or [])
+            self.tables["deal"][deal_id]["DATE_MODIFY"] = now_bitrix()
+            return {"result": True}
+
+        if method == "crm.product.list":
+            return self._list(self.products.values(), params)
+        if method == "crm.product.get":
+            product = self.products.get(str(params.get("id") or ""))
+            if product is None:
+                raise BitrixError(400, "", "Not found")
+            return {"result": dict(product)}
+        if method == "crm.productsection.list":
+            sections = [{"ID": sid, "NAME": name, "CATALOG_ID": "24"} for sid, name in SECTIONS.items()]
+            return self._list(sections, params)
+        if method == "catalog.productImage.list":
+            pid = str(params.get("productId") or "")
+            images = [{"id": int(pid or 0), "productId": int(pid or 0),
+                       "detailUrl": f"https://standin.local/images/{pid}.jpg"}] if pid in self.products else []
+            return {"result": {"productImages": images}}
+
+        raise BitrixError(404, "ERROR_METHOD_NOT_FOUND", f"Method not found: {method}")
+
+    def batch(self, body):
+        commands = (body or {}).get("cmd") or {}
+        halt = str((body or {}).get("halt") or "0") not in ("0", "false", "")
+        results, errors, totals, nexts = {}, {}, {}, {}
+        for name, command in commands.items():
+            method, _, query = command.partition("?")
+            params = resolve_refs(parse_php_query(parse_qsl(query, keep_blank_values=True)), results)
+            try:
+                response = self.call(method.removesuffix(".json"), params)
+            except BitrixError as e:
+                errors[name] = {"error": e.code, "error_description": e.description}
+                if halt:
+                    break
+                continue
+            results[name] = response.get("result")
+            if "total" in response:
+                totals[name] = response["total"]
+            if "next" in response:
+                nexts[name] = response["next"]
+        # O PHP serializa dicionários vazios como lista
+        return {"result": {"result": results or [], "result_error": errors or [], "result_total": totals or [],
+                           "result_next": nexts or [], "result_time": []}}
+
+    def _emit(self, event, deal_id):
+        if self.on_deal_event:
+            self.on_deal_event(event, deal_id)
+
+
+# =============================================================================
+# Asaas em memória
+# =============================================================================
+
+class FakeAsaas:
+    CYCLE_DAYS = {"MONTHLY": 30, "QUARTERLY": 90}
+
+    def __init__(self, on_payment=None):
+        self.lock = threading.Lock()
+        self.on_payment = on_payment
+        self.customers, self.payments, self.subscriptions = {}, {}, {}
+        self.counter = 0
+
+    def _new_id(self, prefix):
+        self.counter += 1
+        return f"{prefix}_{self.counter:012d}"
+
+    @staticmethod
+    def _page(items):
+        return {"object": "list", "hasMore": False, "totalCount": len(items), "limit": 10, "offset": 0, "data": items}
+
+    @staticmethod
+    def _not_found():
+        return 404, {"errors": [{"code": "invalid_action", "description": "Recurso não encontrado."}]}
+
+    def call(self, method, path, query, body):
+        with self.lock:
+            return self._call(method, path.strip("/").split("/"), query, body or {})
+
+    def _call(self, method, parts, query, body):
+        resource = parts[0]
+        item_id = parts[1] if len(parts) > 1 else None
+
+        if resource == "customers":
+            if method == "GET" and not item_id:
+                items = [c for c in self.customers.values()
+                         if all(str(c.get(k, "")) == v for k, v in query.items() if k in ("cpfCnpj", "email"))]
+                return 200, self._page(items)
+            if method == "POST" and not item_id:
+                if not body.get("name"):
+                    return 400, {"errors": [{"code": "invalid_name", "description": "O nome do cliente é obrigatório."}]}
+                customer = {"object": "customer", "id": self._new_id("cus"), "dateCreated": date.today().isoformat(),
+                            **{k: body.get(k) for k in ("name", "email", "cpfCnpj", "mobilePhone", "notificationDisabled")}}
+                self.customers[customer["id"]] = customer
+                return 200, customer
+            customer = self.customers.get(item_id)
+            return (200, customer) if customer else self._not_found()
+
+        if resource == "payments":
+            if method == "POST" and not item_id:
+                if body.get("customer") not in self.customers:
+                    return 400, {"errors": [{"code": "invalid_customer", "description": "Cliente inválido."}]}
+                payment = self._payment(body)
+                self.payments[payment["id"]] = payment
+                if self.on_payment:
+                    self.on_payment(payment)
+                return 200, dict(payment)
+            payment = self.payments.get(item_id)
+            if payment is None:
+                return self._not_found()
+            if len(parts) > 2 and parts[2] == "pixQrCode":
+                expires = (datetime.now(BRT) + timedelta(days=1)).strftime("%Y-%m-%d %H:%M:%S")
+                return 200, {"encodedImage": PIX_IMAGE, "payload": f"00020126580014br.gov.bcb.pix0136{payment['id']}",
+                             "expirationDate": expires}
+            return 200, dict(payment)
+
+        if resource == "subscriptions":
+            if method == "POST" and not item_id:
+                if body.get("customer") not in self.customers:
+                    return 400, {"errors": [{"code": "invalid_customer", "description": "Cliente inválido."}]}
+                days = self.CYCLE_DAYS.get(body.get("cycle"), 30)
+                subscription = {"object": "subscription", "id": self._new_id("sub"), "customer": body.get("customer"),
+                                "billingType": body.get("billingType"), "value": body.get("value"),
+                                "cycle": body.get("cycle", "MONTHLY"), "description": body.get("description"),
+                                "status": "ACTIVE", "dateCreated": date.today().isoformat(),
+                                "nextDueDate": (date.today() + timedelta(days=days)).isoformat()}
+                self.subscriptions[subscription["id"]] = subscription
+                first = self._payment({**body, "subscription": subscription["id"]})
+                self.payments[first["id"]] = first
+                if self.on_payment:
+                    self.on_payment(first)
+                return 200, dict(subscription)
+            subscription = self.subscriptions.get(item_id)
+            if subscription is None:
+                return self._not_found()
+            if method == "DELETE":
+                subscription["status"] = "INACTIVE"
+                subscription["deleted"] = True
+                return 200, {"deleted": True, "id": item_id}
+            if method == "POST":
+                subscription.update({k: v for k, v in body.items() if k not in ("creditCard", "creditCardHolderInfo")})
+            return 200, dict(subscription)
+
+        return 404, {"errors": [{"code": "not_found", "description": f"Endpoint desconhecido: {'/'.join(parts)}"}]}
+
+    def _payment(self, body):
+        card = body.get("billingType") == "CREDIT_CARD"
+        payment_id = self._new_id("pay")
+        return {
+            "object": "payment", "id": payment_id, "customer": body.get("customer"),
+            "subscription": body.get("subscription"), "billingType": body.get("billingType"),
+            "value": body.get("value"), "netValue": round(float(body.get("value") or 0) * 0.97, 2),
+            "description": body.get("description"), "externalReference": body.get("externalReference"),
+            "status": "CONFIRMED" if card else "PENDING",
+            "dueDate": body.get("dueDate") or date.today().isoformat(), "dateCreated": date.today().isoformat(),
+            "invoiceUrl": f"https://standin.local/i/{payment_id}",
+        }
+
+    def confirm(self, payment_id):
+        with self.lock:
+            payment = self.payments.get(payment_id)
+            if payment and payment["status"] == "PENDING":
+                payment["status"] = "RECEIVED"
+            return dict(payment) if payment else None
+
+
+# =============================================================================
+# Record / replay
+# =============================================================================
+
+class Cassette:
+    """Respostas gravadas: {chave: [{"status": 200, "body": {...}}, ...]} num arquivo JSON."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = defaultdict(list)
+        self.cursor = Counter()
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.entries.update(json.load(f))
+
+    @staticmethod
+    def key(service, method, path, params):
+        clean = {k: v for k, v in (params or {}).items() if k not in ("creditCard", "creditCardHolderInfo")}
+        return f"{service} {method} {path} {json.dumps(clean, sort_keys=True, ensure_ascii=False)}"
+
+    @staticmethod
+    def loose_key(service, method, path):
+        # IDs do Asaas no caminho não se repetem entre gravação e reprodução
+        return f"{service} {method} {re.sub(r'/(cus|pay|sub)_[^/]+', '/{id}', path)} *"
+
+    def record(self, service, method, path, params, status, body):
+        with self.lock:
+            entry = {"status": status, "body": body}
+            self.entries[self.key(service, method, path, params)].append(entry)
+            self.entries[self.loose_key(service, method, path)].append(entry)
+            with open(self.path, "w") as f:
+                json.dump(self.entries, f, ensure_ascii=False, indent=1)
+
+    def lookup(self, service, method, path, params):
+        with self.lock:
+            for key in (self.key(service, method, path, params), self.loose_key(service, method, path)):
+                responses = self.entries.get(key)
+                if responses:
+                    entry = responses[self.cursor[key] % len(responses)]
+                    self.cursor[key] += 1
+                    return entry["status"], entry["body"]
+        return None
+
+
+# =============================================================================
+# Injeção de falhas
+# =============================================================================
+
+class Faults:
+    def __init__(self, latency_ms=0, jitter_ms=0, error_rate=0.0, rate_limit_rate=0.0, bitrix_rps=0.0, seed=None):
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.bitrix_rps = bitrix_rps
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        # Bucket do Bitrix: capacidade = 2x o ritmo (o Bitrix tolera pequenos picos)
+        self.tokens = bitrix_rps * 2
+        self.refilled_at = time.monotonic()
+
+    def delay(self):
+        if self.latency or self.jitter:
+            with self.lock:
+                extra = self.rng.uniform(-self.jitter, self.jitter)
+            time.sleep(max(0.0, self.latency + extra))
+
+    def _bitrix_bucket_allows(self):
+        if not self.bitrix_rps:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.bitrix_rps * 2, self.tokens + (now - self.refilled_at) * self.bitrix_rps)
+            self.refilled_at = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def pick(self, service):
+        """None, 429 ou 500/503 para esta requisição."""
+        if service == "bitrix" and not self._bitrix_bucket_allows():
+            return 429
+        with self.lock:
+            roll = self.rng.random()
+            if roll < self.rate_limit_rate:
+                return 429
+            if roll < self.rate_limit_rate + self.error_rate:
+                return self.rng.choice((500, 503))
+        return None
+
+
+FAULT_BODIES = {
+    ("bitrix", 429): {"error": "QUERY_LIMIT_EXCEEDED", "error_description": "Too many requests"},
+    ("bitrix", 500): {"error": "INTERNAL_SERVER_ERROR", "error_description": "Internal server error"},
+    ("bitrix", 503): {"error": "OVERLOAD_LIMIT", "error_description": "REST API is blocked due to overload."},
+    ("asaas", 429): {"errors": [{"code": "too_many_requests", "description": "Limite de requisições excedido."}]},
+    ("asaas", 500): {"errors": [{"code": "internal_error", "description": "Erro interno."}]},
+    ("asaas", 503): {"errors": [{"code": "unavailable", "description": "Serviço indisponível."}]},
+}
+
+
+# =============================================================================
+# Servidor
+# =============================================================================
+
+class StandIn:
+    def __init__(self, mode="fake", cassette=None, strict=False, faults=None, contacts=200, products=20, seed=42,
+                 bitrix_upstream="", asaas_upstream="", asaas_api_key="",
+                 bitrix_webhook_url="", bitrix_app_token="", asaas_webhook_url="", asaas_webhook_token="",
+                 pix_confirm_seconds=5.0):
+        self.mode = mode
+        self.strict = strict
+        self.faults = faults or Faults()
+        self.cassette = Cassette(cassette) if cassette else None
+        if mode in ("record", "replay") and self.cassette is None:
+            raise ValueError("--cassette é obrigatório nos modos record/replay")
+        self.bitrix_upstream = bitrix_upstream.rstrip("/") + "/" if bitrix_upstream else ""
+        self.asaas_upstream = asaas_upstream.rstrip("/")
+        self.asaas_api_key = asaas_api_key
+        self.bitrix_webhook_url, self.bitrix_app_token = bitrix_webhook_url, bitrix_app_token
+        self.asaas_webhook_url, self.asaas_webhook_token = asaas_webhook_url, asaas_webhook_token
+        self.pix_confirm_seconds = pix_confirm_seconds
+        self.outbox = ThreadPoolExecutor(max_workers=4, thread_name_prefix="standin-webhooks")
+        self.bitrix = FakeBitrix(contacts, products, seed, on_deal_event=self._deal_event)
+        self.asaas = FakeAsaas(on_payment=self._payment_created)
+        self.stats_lock = threading.Lock()
+        self.stats = Counter()
+
+    # --- Estatísticas ---
+
+    def count(self, key, n=1):
+        with self.stats_lock:
+            self.stats[key] += n
+
+    def snapshot(self):
+        with self.stats_lock:
+            return dict(sorted(self.stats.items()))
+
+    def reset_stats(self):
+        with self.stats_lock:
+            self.stats.clear()
+
+    # --- Webhooks de saída ---
+
+    def _deal_event(self, event, deal_id):
+        if not self.bitrix_webhook_url:
+            return
+        payload = {"event": event, "data[FIELDS][ID]": str(deal_id), "ts": str(int(time.time())),
+                   "auth[application_token]": self.bitrix_app_token, "auth[domain]": "standin.local"}
+        self.outbox.submit(self._post_webhook, self.bitrix_webhook_url, payload, None, f"bitrix webhook {event}")
+
+    def _payment_created(self, payment):
+        if not self.asaas_webhook_url:
+            return
+        delay = 0 if payment["status"] == "CONFIRMED" else self.pix_confirm_seconds
+        self.outbox.submit(self._confirm_later, payment["id"], delay)
+
+    def _confirm_later(self, payment_id, delay):
+        time.sleep(delay)
+        payment = self.asaas.confirm(payment_id)
+        if payment:
+            event = "PAYMENT_CONFIRMED" if payment["billingType"] == "CREDIT_CARD" else "PAYMENT_RECEIVED"
+            headers = {"asaas-access-token": self.asaas_webhook_token} if self.asaas_webhook_token else {}
+            self._post_webhook(self.asaas_webhook_url, None, {"event": event, "payment": payment, "headers": headers},
+                               f"asaas webhook {event}")
+
+    def _post_webhook(self, url, form, json_body, label):
+        try:
+            if form is not None:
+                requests.post(url, data=form, timeout=10)
+            else:
+                headers = json_body.pop("headers", {})
+                requests.post(url, json=json_body, headers=headers, timeout=10)
+            self.count(f"out {label}")
+        except requests.RequestException:
+            self.count(f"out {label} (falhou)")
+
+    # --- Upstream (record) ---
+
+    def _forward(self, service, method, path, query, raw_body, content_type):
+        if service == "bitrix":
+            if not self.bitrix_upstream:
+                raise ValueError("--bitrix-upstream não configurado")
+            url, headers = f"{self.bitrix_upstream}{path}", {}
+        else:
+            if not self.asaas_upstream:
+                raise ValueError("--asaas-upstream não configurado")
+            url, headers = f"{self.asaas_upstream}/{path}", {"access_token": self.asaas_api_key}
+        if content_type:
+            headers["Content-Type"] = content_type
+        response = requests.request(method, url, params=query, data=raw_body or None, headers=headers,
+                                    timeout=30, allow_redirects=False)
+        try:
+            return response.status_code, response.json()
+        except ValueError:
+            return response.status_code, {"raw": response.text}
+
+    # --- Despacho ---
+
+    def handle(self, service, method, path, query_pairs, raw_body, content_type):
+        """(status, corpo JSON) para uma requisição ao Bitrix ou ao Asaas."""
+        self.faults.delay()
+        fault = self.faults.pick(service)
+        if fault:
+            self.count(f"fault {service} {fault}")
+            return fault, FAULT_BODIES[(service, fault)]
+
+        body = {}
+        if raw_body:
+            if "json" in (content_type or ""):
+                body = json.loads(raw_body or b"{}")
+            else:
+                body = parse_php_query(parse_qsl(raw_body.decode(), keep_blank_values=True))
+        if service == "bitrix":
+            params = {**parse_php_query(query_pairs), **(body if isinstance(body, dict) else {})}
+        else:
+            params = {**dict(query_pairs), **(body if isinstance(body, dict) else {})}
+        api = path.removesuffix(".json") if service == "bitrix" else f"{method} {re.sub(r'(cus|pay|sub)_[^/]+', '{id}', path)}"
+        self.count(f"{service} {api}")
+        if service == "bitrix" and api == "batch":
+            for command in (params.get("cmd") or {}).values():
+                self.count(f"bitrix batch:{command.partition('?')[0]}")
+
+        if self.mode == "record":
+            status, response = self._forward(service, method, path, query_pairs, raw_body, content_type)
+            self.cassette.record(service, method, path, params, status, response)
+            return status, response
+        if self.mode == "replay":
+            recorded = self.cassette.lookup(service, method, path, params)
+            if recorded:
+                return recorded
+            self.count(f"replay miss {service} {api}")
+            if self.strict:
+                return 404, {"error": "STANDIN_NOT_RECORDED", "error_description": f"Sem gravação para {api}"}
+
+        if service == "bitrix":
+            try:
+                if api == "batch":
+                    return 200, self.bitrix.batch(params)
+                return 200, self.bitrix.call(api, params)
+            except BitrixError as e:
+                return e.status, {"error": e.code, "error_description": e.description}
+        return self.asaas.call(method, path, dict(query_pairs), params)
+
+
+def make_handler(standin):
+    class StandInHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # Keep-alive, como os serviços reais
+        disable_nagle_algorithm = True
+
+        def do_GET(self): self._dispatch()
+        def do_POST(self): self._dispatch()
+        def do_DELETE(self): self._dispatch()
+
+        def _dispatch(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            raw_body = self.rfile.read(length) if length else b""
+            url = urlsplit(self.path)
+            query = parse_qsl(url.query, keep_blank_values=True)
+
+            if url.path == "/_standin/stats":
+                return self._reply(200, standin.snapshot())
+            if url.path == "/_standin/reset" and self.command == "POST":
+                standin.reset_stats()
+                return self._reply(200, {"reset": True})
+
+            bitrix = re.match(r'^/bitrix/rest/\d+/[^/]+/(.+)$', url.path)
+            asaas = re.match(r'^/asaas/api/v3/(.+)$', url.path)
+            if bitrix:
+                service, path = "bitrix", bitrix.group(1)
+            elif asaas:
+                service, path = "asaas", asaas.group(1)
+            else:
+                return self._reply(404, {"error": "NOT_FOUND", "error_description": url.path})
+            try:
+                status, body = standin.handle(service, self.command, path, query, raw_body,
+                                              self.headers.get("Content-Type", ""))
+            except Exception as e:  # noqa: BLE001 - o stand-in nunca derruba a conexão
+                status, body = 500, {"error": "STANDIN_ERROR", "error_description": str(e)}
+            self._reply(status, body)
+
+        def _reply(self, status, body):
+            data = json.dumps(body, ensure_ascii=False).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    return StandInHandler
+
+
+def start_standin(host="127.0.0.1", port=0, **options):
+    """Sobe o stand-in numa thread. Devolve (server, standin, bitrix_webhook_url, asaas_api_url)."""
+    standin = StandIn(**options)
+    server = ThreadingHTTPServer((host, port), make_handler(standin))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://{host}:{server.server_address[1]}"
+    return server, standin, f"{base}/bitrix/rest/1/standin/", f"{base}/asaas/api/v3"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--mode", choices=("fake", "record", "replay"), default="fake")
+    parser.add_argument("--cassette", help="Arquivo JSON das respostas gravadas (record/replay)")
+    parser.add_argument("--strict", action="store_true", help="replay: 404 quando não há gravação (sem cair no fake)")
+    parser.add_argument("--contacts", type=int, default=200, help="Contatos sintéticos (cada um com um deal WON)")
+    parser.add_argument("--products", type=int, default=20, help="Produtos sintéticos além dos do protocolo")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--bitrix-rps", type=float, default=0.0, help="0 = sem limite")
+    parser.add_argument("--bitrix-upstream", default=os.getenv("STANDIN_BITRIX_UPSTREAM", ""))
+    parser.add_argument("--asaas-upstream", default=os.getenv("STANDIN_ASAAS_UPSTREAM", ""))
+    parser.add_argument("--asaas-api-key", default=os.getenv("ASAAS_API_KEY", ""))
+    parser.add_argument("--bitrix-webhook-url", default="", help="ex: http://127.0.0.1:8000/api/accounts/webhooks/bitrix/")
+    parser.add_argument("--bitrix-app-token", default=os.getenv("BITRIX_APP_TOKEN_SECRET", ""))
+    parser.add_argument("--asaas-webhook-url", default="", help="ex: http://127.0.0.1:8000/api/financial/webhook/")
+    parser.add_argument("--asaas-webhook-token", default=os.getenv("ASAAS_WEBHOOK_ACCESS_TOKEN", ""))
+    parser.add_argument("--pix-confirm-seconds", type=float, default=5.0)
+    args = parser.parse_args()
+
+    faults = Faults(args.latency_ms, args.jitter_ms, args.error_rate, args.rate_limit_rate, args.bitrix_rps, args.seed)
+    server, standin, bitrix_url, asaas_url = start_standin(
+        args.host, args.port, mode=args.mode, cassette=args.cassette, strict=args.strict, faults=faults,
+        contacts=args.contacts, products=args.products, seed=args.seed,
+        bitrix_upstream=args.bitrix_upstream, asaas_upstream=args.asaas_upstream, asaas_api_key=args.asaas_api_key,
+        bitrix_webhook_url=args.bitrix_webhook_url, bitrix_app_token=args.bitrix_app_token,
+        asaas_webhook_url=args.asaas_webhook_url, asaas_webhook_token=args.asaas_webhook_token,
+        pix_confirm_seconds=args.pix_confirm_seconds,
+    )
+    print(f"🧪 Stand-in ({args.mode}) no ar:")
+    print(f"   BITRIX_WEBHOOK_URL={bitrix_url}")
+    print(f"   ASAAS_API_URL={asaas_url}")
+    print(f"   Estatísticas: http://{args.host}:{server.server_address[1]}/_standin/stats")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
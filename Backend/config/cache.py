@@ -0,0 +1,322 @@
+"""
+Cache em dois níveis (backend do CACHES['default']).
+
+Sem CACHES configurado cada worker do gunicorn tinha o seu LocMem: um cache.delete(...) só limpava
+o worker que o executava. Agora:
+  - L2 (compartilhado): CACHES['shared'] — Redis (CACHE_REDIS_URL) em produção; sem ele, LocMem do
+    processo (stand-in para dev/testes: funciona igual, só não invalida entre processos);
+  - L1 (por processo): LRU pequeno na frente do L2, só para as famílias de leitura intensa
+    (FAMILIES com l1=True) e por no máximo CACHE_L1_TIMEOUT segundos. Locks/dedupe (cache.add),
+    `:prev`/`:last_good` e chaves fora das famílias vão direto ao L2. O `:prev` do singleflight leva
+    as tags da chave principal (invalidar `user:<id>` descarta também a cópia anterior do protocolo);
+    o `:last_good` não (é o fallback de quando o Bitrix está fora).
+
+Chaves versionadas: VERSION do CACHES (CACHE_VERSION) descarta tudo num deploy, e cada família tem
+tags (`user:<id>`, `catalog`, `plan`). A entrada é gravada com a versão corrente de cada tag;
+invalidate_tag() incrementa a versão no L2 e toda entrada gravada antes vira miss em todos os
+workers (os demais processos releem as versões das tags a cada CACHE_TAG_VERSION_TTL segundos).
+
+Hits (L1/L2) e misses por família vão para o /metrics: cache_requests_total{family,result}.
+No Redis os valores passam pelo CACHE_SERIALIZER (msgpack + compressão, config/cache_serializers.py);
+o L1 continua em pickle, que nos payloads daqui é o mais rápido para decodificar (cópia a cada hit).
+"""
+
+import re
+import time
+import pickle
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Tuple
+
+from django.core.cache import caches
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+
+from apps.accounts.metrics import inc
+
+# (família, regex da chave, tags, usa L1). `{id}` nas tags vem do grupo 'id' da regex.
+FAMILIES = (
+    ('user_protocol', re.compile(r'^user_protocol_(?P<id>[\w-]+)$'), ('user:{id}',), True),
+    ('catalog', re.compile(r'^bitrix_product_catalog(_version)?$'), ('catalog',), True),
+    ('plan', re.compile(r'^bitrix_plan_details_(?P<id>\w+)$'), ('plan',), True),
+    ('product_image', re.compile(r'^bitrix_product_image_\w+$'), (), True),
+    ('image_proxy', re.compile(r'^product_image_(src|missing)_\w+$'), (), True),
+    ('auth_version', re.compile(r'^auth_version_[\w-]+$'), (), True),
+)
+# IDs (uuid/números) no nome das famílias não mapeadas: cardinalidade fixa no /metrics
+_ID = re.compile(r'[0-9a-f]{8}-[0-9a-f-]{27}|\d+', re.IGNORECASE)
+
+_TAG_KEY = 'tagv:{}'
+_ENVELOPE = '__tagged__'
+_MISSING = object()
+
+
+@lru_cache(maxsize=4096)
+def family_of(key: str) -> Tuple[str, Tuple[str, ...], bool]:
+    """(família, tags, usa L1) de uma chave."""
+    base, _, suffix = key.partition(':')
+    if not suffix or suffix == 'prev':
+        for family, pattern, tags, l1 in FAMILIES:
+            match = pattern.match(base)
+            if match:
+                tags = tuple(t.format(**match.groupdict()) for t in tags)
+                return (f"{family}:prev", tags, False) if suffix else (family, tags, l1)
+    name = _ID.sub('{id}', base)
+    return (f"{name}:{suffix}" if suffix else name), (), False
+
+
+def _count(family: str, result: str):
+    inc('cache_requests_total', family=family, result=result)
+
+
+class _ProcessState:
+    """L1 + versões de tags lidas, por processo (o Django cria uma instância do backend por thread)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries: 'OrderedDict[str, Tuple[float, Dict[str, int], bytes]]' = OrderedDict()
+        self.tag_versions: Dict[str, Tuple[float, int]] = {}
+
+
+_states: Dict[str, _ProcessState] = {}
+_states_lock = threading.Lock()
+
+
+class TieredCache(BaseCache):
+    """
+    OPTIONS: SHARED (alias do L2, padrão 'shared'), L1_MAX_ENTRIES, L1_TIMEOUT (segundos),
+    TAG_VERSION_TTL (segundos que um processo confia na versão de tag que leu).
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS') or {}
+        self._shared_alias = options.get('SHARED', 'shared')
+        self._l1_max = int(options.get('L1_MAX_ENTRIES', 1000))
+        self._l1_timeout = float(options.get('L1_TIMEOUT', 5))
+        self._tag_ttl = float(options.get('TAG_VERSION_TTL', 1))
+        with _states_lock:
+            self._state = _states.setdefault(location or 'default', _ProcessState())
+
+    @property
+    def shared(self) -> BaseCache:
+        return caches[self._shared_alias]
+
+    def _v(self, version):
+        return self.version if version is None else version
+
+    # --- Tags ---
+
+    def _tag_versions(self, tags: Iterable[str]) -> Dict[str, int]:
+        tags = list(tags)
+        if not tags:
+            return {}
+        now = time.monotonic()
+        state = self._state
+        versions, stale = {}, []
+        with state.lock:
+            for tag in tags:
+                known = state.tag_versions.get(tag)
+                if known and now - known[0] < self._tag_ttl:
+                    versions[tag] = known[1]
+                else:
+                    stale.append(tag)
+        if stale:
+            found = self.shared.get_many([_TAG_KEY.format(t) for t in stale])
+            for tag in stale:
+                version = found.get(_TAG_KEY.format(tag))
+                if version is None:
+                    # Tag nunca invalidada (ou despejada do Redis): começa num valor novo, nunca igual a uma versão antiga
+                    self.shared.add(_TAG_KEY.format(tag), int(time.time() * 1000), timeout=None)
+                    version = self.shared.get(_TAG_KEY.format(tag), 0)
+                versions[tag] = int(version)
+            with state.lock:
+                for tag in stale:
+                    state.tag_versions[tag] = (now, versions[tag])
+        return versions
+
+    def invalidate_tag(self, tag: str) -> int:
+        """Descarta (em todos os workers) as entradas gravadas com a versão atual da tag."""
+        key = _TAG_KEY.format(tag)
+        try:
+            version = self.shared.incr(key)
+        except ValueError:
+            self.shared.add(key, int(time.time() * 1000), timeout=None)
+            version = self.shared.incr(key)
+        state = self._state
+        with state.lock:
+            state.tag_versions[tag] = (time.monotonic(), version)
+            for lkey in [k for k, entry in state.entries.items() if tag in entry[1]]:
+                del state.entries[lkey]
+        inc('cache_invalidations_total', tag=tag.split(':', 1)[0])
+        return version
+
+    def _wrap(self, value: Any, tag_versions: Dict[str, int]) -> Any:
+        return (_ENVELOPE, tag_versions, value) if tag_versions else value
+
+    def _unwrap(self, entry: Any, tags: Tuple[str, ...]) -> Tuple[bool, Any, Dict[str, int]]:
+        """(válida, valor, versões das tags) de uma entrada lida do L2."""
+        if entry is _MISSING:
+            return False, None, {}
+        if not tags:
+            return True, entry, {}
+        # Lista: codec JSON (CACHE_SERIALIZER_CODEC=orjson) devolve tuplas como listas
+        if not (isinstance(entry, (tuple, list)) and len(entry) == 3 and entry[0] == _ENVELOPE):
+            return False, None, {}
+        tag_versions = entry[1]
+        return tag_versions == self._tag_versions(tags), entry[2], tag_versions
+
+    # --- L1 ---
+
+    def _l1_timeout_for(self, timeout) -> float:
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        return self._l1_timeout if timeout is None else min(self._l1_timeout, timeout)
+
+    def _l1_get(self, lkey: str, tags: Tuple[str, ...]) -> Tuple[bool, Any]:
+        state = self._state
+        with state.lock:
+            entry = state.entries.get(lkey)
+            if entry is None:
+                return False, None
+            if entry[0] <= time.monotonic():
+                del state.entries[lkey]
+                return False, None
+            state.entries.move_to_end(lkey)
+        if tags and entry[1] != self._tag_versions(tags):
+            return False, None
+        # Cópia a cada leitura (como o LocMem): quem recebe o valor pode alterá-lo
+        return True, pickle.loads(entry[2])
+
+    def _l1_put(self, lkey: str, value: Any, tag_versions: Dict[str, int], ttl: float):
+        if ttl <= 0 or self._l1_max <= 0:
+            return
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        state = self._state
+        with state.lock:
+            state.entries[lkey] = (time.monotonic() + ttl, tag_versions, data)
+            state.entries.move_to_end(lkey)
+            while len(state.entries) > self._l1_max:
+                state.entries.popitem(last=False)
+
+    def _l1_drop(self, lkey: str):
+        with self._state.lock:
+            self._state.entries.pop(lkey, None)
+
+    # --- API do Django ---
+
+    def get(self, key, default=None, version=None):
+        family, tags, l1 = family_of(key)
+        lkey = self.make_and_validate_key(key, version)
+        if l1:
+            found, value = self._l1_get(lkey, tags)
+            if found:
+                _count(family, 'l1_hit')
+                return value
+        found, value, tag_versions = self._unwrap(self.shared.get(key, _MISSING, version=self._v(version)), tags)
+        if not found:
+            _count(family, 'miss')
+            return default
+        if l1:
+            self._l1_put(lkey, value, tag_versions, self._l1_timeout)
+        _count(family, 'l2_hit')
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        family, tags, l1 = family_of(key)
+        lkey = self.make_and_validate_key(key, version)
+        tag_versions = self._tag_versions(tags)
+        self.shared.set(key, self._wrap(value, tag_versions), timeout=timeout, version=self._v(version))
+        if l1:
+            self._l1_put(lkey, value, tag_versions, self._l1_timeout_for(timeout))
+        else:
+            self._l1_drop(lkey)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        family, tags, l1 = family_of(key)
+        lkey = self.make_and_validate_key(key, version)
+        tag_versions = self._tag_versions(tags)
+        added = self.shared.add(key, self._wrap(value, tag_versions), timeout=timeout, version=self._v(version))
+        if added and l1:
+            self._l1_put(lkey, value, tag_versions, self._l1_timeout_for(timeout))
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.shared.touch(key, timeout=timeout, version=self._v(version))
+
+    def delete(self, key, version=None):
+        self._l1_drop(self.make_and_validate_key(key, version))
+        return self.shared.delete(key, version=self._v(version))
+
+    def get_many(self, keys, version=None):
+        found, remaining = {}, []
+        for key in keys:
+            family, tags, l1 = family_of(key)
+            if l1:
+                hit, value = self._l1_get(self.make_and_validate_key(key, version), tags)
+                if hit:
+                    _count(family, 'l1_hit')
+                    found[key] = value
+                    continue
+            remaining.append(key)
+        entries = self.shared.get_many(remaining, version=self._v(version)) if remaining else {}
+        for key in remaining:
+            family, tags, l1 = family_of(key)
+            ok, value, tag_versions = self._unwrap(entries.get(key, _MISSING), tags)
+            if not ok:
+                _count(family, 'miss')
+                continue
+            if l1:
+                self._l1_put(self.make_and_validate_key(key, version), value, tag_versions, self._l1_timeout)
+            _count(family, 'l2_hit')
+            found[key] = value
+        return found
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        wrapped = {}
+        for key, value in data.items():
+            family, tags, l1 = family_of(key)
+            tag_versions = self._tag_versions(tags)
+            wrapped[key] = self._wrap(value, tag_versions)
+            lkey = self.make_and_validate_key(key, version)
+            if l1:
+                self._l1_put(lkey, value, tag_versions, self._l1_timeout_for(timeout))
+            else:
+                self._l1_drop(lkey)
+        return self.shared.set_many(wrapped, timeout=timeout, version=self._v(version))
+
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        for key in keys:
+            self._l1_drop(self.make_and_validate_key(key, version))
+        return self.shared.delete_many(keys, version=self._v(version))
+
+    def incr(self, key, delta=1, version=None):
+        self._l1_drop(self.make_and_validate_key(key, version))
+        return self.shared.incr(key, delta, version=self._v(version))
+
+    def decr(self, key, delta=1, version=None):
+        return self.incr(key, -delta, version=version)
+
+    def has_key(self, key, version=None):
+        return self.get(key, _MISSING, version=version) is not _MISSING
+
+    def clear(self):
+        with self._state.lock:
+            self._state.entries.clear()
+            self._state.tag_versions.clear()
+        return self.shared.clear()
+
+
+def invalidate_tag(tag: str) -> None:
+    invalidate_tags([tag])
+
+
+def invalidate_tags(tags: Iterable[str]) -> None:
+    """invalidate_tag no cache padrão; backend sem tags (CACHES sobrescrito) é limpo por inteiro."""
+    backend = caches['default']
+    if not isinstance(backend, TieredCache):
+        backend.clear()
+        return
+    for tag in dict.fromkeys(tags):
+        backend.invalidate_tag(tag)
@@ -0,0 +1,219 @@
+"""
+Serialização dos valores do cache no Redis (L2 do TieredCache, ver config/cache.py).
+
+O RedisSerializer do Django faz pickle de todo valor a cada cache.set e unpickle a cada hit; os
+valores quentes daqui (catálogo, protocolo, planos) são dicts/listas de str/float com Decimal e
+datetime ocasionais. CacheSerializer troca o pickle por:
+  - msgpack (padrão): Decimal, datetime, date, time, UUID e tuplas viram ext types e voltam com o
+    mesmo tipo (datetime com fuso volta em UTC; datetime sem fuso cai no pickle);
+  - orjson: o mais rápido, mas JSON puro — tuplas voltam como listas e UUIDs como str
+    (Decimal/datetime/date/time são preservados por marcadores {"$decimal": "..."});
+  - pickle: fallback de qualquer codec para tipos fora do mapeamento (sets, subclasses de str/dict,
+    objetos) e codec usado quando a lib escolhida não está instalada.
+Acima de CACHE_COMPRESS_MIN_BYTES o corpo é comprimido (lz4; zlib se o lz4 não estiver instalado)
+quando isso de fato reduz o tamanho.
+
+Medido (benchmarks/bench_cache_serializers.py): o ganho é no tamanho gravado e no encode — o catálogo
+cai de ~34KB para ~13KB no Redis. No decode o pickle 5 empata ou ganha (memoiza as chaves repetidas),
+por isso o L1 do TieredCache, decodificado a cada hit, continua em pickle.
+
+Formato: 2 bytes de cabeçalho (codec, compressão) + corpo. Tupla no topo (o envelope de tags do
+TieredCache) tem codec próprio: o corpo é a lista, sem empacotar duas vezes num ext type. Inteiros
+ficam sem serializar, como no RedisSerializer (incr/decr atômicos no Redis), e valores antigos em
+pickle puro continuam legíveis.
+"""
+
+import uuid
+import zlib
+import pickle
+import logging
+import datetime
+from decimal import Decimal
+from typing import Any, Optional
+
+from django.conf import settings
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+logger = logging.getLogger(__name__)
+
+PICKLE, MSGPACK, MSGPACK_TUPLE, ORJSON = b'P', b'M', b'T', b'J'
+RAW, ZLIB, LZ4 = b'-', b'Z', b'L'
+CODECS = {'pickle': PICKLE, 'msgpack': MSGPACK, 'orjson': ORJSON}
+COMPRESSIONS = {'': RAW, 'none': RAW, 'zlib': ZLIB, 'lz4': LZ4}
+
+# --- msgpack: ext types ---
+
+_EXT_DECIMAL, _EXT_DATE, _EXT_TIME, _EXT_UUID, _EXT_TUPLE = 1, 3, 4, 5, 6
+
+
+def _msgpack_default(obj):
+    # strict_types: subclasses (bool à parte) também chegam aqui e caem no pickle.
+    # datetime com fuso é nativo (timestamp ext do msgpack, em C)
+    kind = type(obj)
+    if kind is Decimal:
+        return msgpack.ExtType(_EXT_DECIMAL, str(obj).encode())
+    if kind is datetime.date:
+        return msgpack.ExtType(_EXT_DATE, obj.isoformat().encode())
+    if kind is datetime.time:
+        return msgpack.ExtType(_EXT_TIME, obj.isoformat().encode())
+    if kind is uuid.UUID:
+        return msgpack.ExtType(_EXT_UUID, obj.bytes)
+    if kind is tuple:
+        return msgpack.ExtType(_EXT_TUPLE, _msgpack_pack(list(obj)))
+    raise TypeError(f"tipo sem ext type: {kind.__name__}")
+
+
+def _msgpack_ext(code, data):
+    if code == _EXT_DECIMAL:
+        return Decimal(data.decode())
+    if code == _EXT_DATE:
+        return datetime.date.fromisoformat(data.decode())
+    if code == _EXT_TIME:
+        return datetime.time.fromisoformat(data.decode())
+    if code == _EXT_UUID:
+        return uuid.UUID(bytes=data)
+    if code == _EXT_TUPLE:
+        return tuple(_msgpack_unpack(data))
+    return msgpack.ExtType(code, data)
+
+
+def _msgpack_pack(obj) -> bytes:
+    return msgpack.packb(obj, default=_msgpack_default, strict_types=True, use_bin_type=True, datetime=True,
+                         buf_size=16 * 1024)  # Padrão 256KB por chamada; cresce se precisar
+
+
+def _msgpack_unpack(data: bytes):
+    return msgpack.unpackb(data, ext_hook=_msgpack_ext, raw=False, strict_map_key=False, timestamp=3)
+
+
+# --- orjson: marcadores ---
+
+_JSON_TAGS = {
+    '$decimal': Decimal,
+    '$datetime': datetime.datetime.fromisoformat,
+    '$date': datetime.date.fromisoformat,
+    '$time': datetime.time.fromisoformat,
+}
+
+
+def _orjson_default(obj):
+    kind = type(obj)
+    if kind is Decimal:
+        return {'$decimal': str(obj)}
+    if kind is datetime.datetime:
+        return {'$datetime': obj.isoformat()}
+    if kind is datetime.date:
+        return {'$date': obj.isoformat()}
+    if kind is datetime.time:
+        return {'$time': obj.isoformat()}
+    raise TypeError(f"tipo sem marcador JSON: {kind.__name__}")
+
+
+def _orjson_restore(obj):
+    if isinstance(obj, dict):
+        if len(obj) == 1:
+            (tag, value), = obj.items()
+            if tag in _JSON_TAGS and isinstance(value, str):
+                return _JSON_TAGS[tag](value)
+        return {k: _orjson_restore(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_orjson_restore(v) for v in obj]
+    return obj
+
+
+def _orjson_pack(obj) -> bytes:
+    return orjson.dumps(obj, default=_orjson_default,
+                        option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_SUBCLASS)
+
+
+def _orjson_unpack(data: bytes):
+    value = orjson.loads(data)
+    # Sem marcador no corpo (o caso comum): nada a percorrer
+    return _orjson_restore(value) if b'{"$' in data else value
+
+
+class CacheSerializer:
+    """
+    Compatível com o RedisSerializer (OPTIONS['serializer'] do RedisCache).
+    Sem argumentos lê CACHE_SERIALIZER_CODEC, CACHE_COMPRESSION e CACHE_COMPRESS_MIN_BYTES.
+    """
+
+    def __init__(self, codec: Optional[str] = None, compression: Optional[str] = None,
+                 min_bytes: Optional[int] = None):
+        codec = (codec if codec is not None else getattr(settings, 'CACHE_SERIALIZER_CODEC', 'msgpack')).lower()
+        compression = (compression if compression is not None else getattr(settings, 'CACHE_COMPRESSION', 'lz4')).lower()
+        if codec not in CODECS or compression not in COMPRESSIONS:
+            raise ValueError(f"Serializador de cache inválido: codec={codec!r} compression={compression!r}")
+
+        if (codec == 'msgpack' and msgpack is None) or (codec == 'orjson' and orjson is None):
+            logger.warning(f"⚠️ {codec} não instalado: cache serializado com pickle")
+            codec = 'pickle'
+        if compression == 'lz4' and lz4_frame is None:
+            logger.warning("⚠️ lz4 não instalado: cache comprimido com zlib")
+            compression = 'zlib'
+
+        self.codec = CODECS[codec]
+        self.compression = COMPRESSIONS[compression]
+        self.min_bytes = int(min_bytes if min_bytes is not None else getattr(settings, 'CACHE_COMPRESS_MIN_BYTES', 1024))
+
+    def dumps(self, obj: Any):
+        # Mesmo critério do RedisSerializer: int cru para incr()/decr() atômicos
+        if type(obj) is int:
+            return obj
+        codec, body = self.codec, None
+        try:
+            if codec == MSGPACK and type(obj) is tuple:
+                codec, body = MSGPACK_TUPLE, _msgpack_pack(list(obj))
+            elif codec == MSGPACK:
+                body = _msgpack_pack(obj)
+            elif codec == ORJSON:
+                body = _orjson_pack(obj)
+        except (TypeError, ValueError, OverflowError):
+            body = None
+        if body is None:
+            codec, body = PICKLE, pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+
+        compression = RAW
+        if self.compression != RAW and len(body) >= self.min_bytes:
+            packed = lz4_frame.compress(body) if self.compression == LZ4 else zlib.compress(body, 1)
+            if len(packed) < len(body):
+                compression, body = self.compression, packed
+        return codec + compression + body
+
+    def loads(self, data):
+        try:
+            return int(data)
+        except ValueError:
+            pass
+        data = bytes(data)
+        if data[:1] == b'\x80':
+            # Gravado pelo RedisSerializer (pickle puro, antes deste serializador)
+            return pickle.loads(data)
+        codec, compression, body = data[:1], data[1:2], data[2:]
+        if compression == ZLIB:
+            body = zlib.decompress(body)
+        elif compression == LZ4:
+            if lz4_frame is None:
+                raise ValueError("Valor do cache comprimido com lz4, mas lz4 não está instalado")
+            body = lz4_frame.decompress(body)
+        if codec == MSGPACK:
+            return _msgpack_unpack(body)
+        if codec == MSGPACK_TUPLE:
+            return tuple(_msgpack_unpack(body))
+        if codec == ORJSON:
+            return _orjson_unpack(body)
+        return pickle.loads(body)
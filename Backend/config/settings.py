@@ -107,6 +107,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'apps.accounts.middleware.StaleDataMiddleware',
+    'apps.accounts.middleware.OutboundCallerMiddleware',
 ]
 
 ROOT_URLCONF = 'config.urls'
@@ -197,12 +199,131 @@ MEDIA_ROOT = BASE_DIR / 'media'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 CORS_ALLOW_ALL_ORIGINS = True
+CORS_EXPOSE_HEADERS = ['X-Data-Stale']
 
 RESEND_API_KEY = os.getenv('RESEND_API_KEY')
 MERCADO_PAGO_ACCESS_TOKEN = os.getenv('MERCADO_PAGO_ACCESS_TOKEN')
 ASAAS_API_KEY = os.getenv('ASAAS_API_KEY')
 ASAAS_API_URL = os.getenv('ASAAS_API_URL', 'https://sandbox.asaas.com/api/v3')
 
+# --- Integração Bitrix (Pool HTTP Keep-Alive por worker) ---
+BITRIX_HTTP_POOL_SIZE = int(os.getenv('BITRIX_HTTP_POOL_SIZE', '10'))
+BITRIX_HTTP_POOL_BLOCK = os.getenv('BITRIX_HTTP_POOL_BLOCK', 'False') == 'True'
+BITRIX_HTTP_WARMUP_CONNECTIONS = int(os.getenv('BITRIX_HTTP_WARMUP_CONNECTIONS', '1'))
+# Threads (por processo) que buscam a próxima página dos *.list enquanto a atual é consumida
+BITRIX_LIST_PREFETCH_THREADS = int(os.getenv('BITRIX_LIST_PREFETCH_THREADS', '1'))
+
+# --- Integração Bitrix (Rate Limit compartilhado entre workers e crons) ---
+# Backend 'db' (linha compartilhada) ou 'local' (memória do processo, dev/testes)
+BITRIX_RATE_LIMIT_ENABLED = os.getenv('BITRIX_RATE_LIMIT_ENABLED', 'True') == 'True'
+BITRIX_RATE_LIMIT_BACKEND = os.getenv('BITRIX_RATE_LIMIT_BACKEND', 'db')
+BITRIX_RATE_LIMIT_PER_SECOND = float(os.getenv('BITRIX_RATE_LIMIT_PER_SECOND', '2'))
+BITRIX_RATE_LIMIT_BURST = float(os.getenv('BITRIX_RATE_LIMIT_BURST', '50'))
+# Tokens que a lane 'batch' (crons) nunca consome, reservados para requisições de usuários
+BITRIX_RATE_LIMIT_INTERACTIVE_RESERVE = float(os.getenv('BITRIX_RATE_LIMIT_INTERACTIVE_RESERVE', '10'))
+BITRIX_RATE_LIMIT_INTERACTIVE_MAX_WAIT = float(os.getenv('BITRIX_RATE_LIMIT_INTERACTIVE_MAX_WAIT', '10'))
+BITRIX_RATE_LIMIT_BATCH_MAX_WAIT = float(os.getenv('BITRIX_RATE_LIMIT_BATCH_MAX_WAIT', '300'))
+
+# --- Integração Bitrix (Circuit Breaker por worker) ---
+# Abre após X% de erros (ou de chamadas lentas) nas últimas N chamadas; leituras passam a vir do último valor bom.
+BITRIX_BREAKER_WINDOW = int(os.getenv('BITRIX_BREAKER_WINDOW', '20'))
+BITRIX_BREAKER_MIN_CALLS = int(os.getenv('BITRIX_BREAKER_MIN_CALLS', '5'))
+BITRIX_BREAKER_ERROR_THRESHOLD = float(os.getenv('BITRIX_BREAKER_ERROR_THRESHOLD', '0.5'))
+BITRIX_BREAKER_SLOW_CALL_SECONDS = float(os.getenv('BITRIX_BREAKER_SLOW_CALL_SECONDS', '5'))
+BITRIX_BREAKER_SLOW_CALL_THRESHOLD = float(os.getenv('BITRIX_BREAKER_SLOW_CALL_THRESHOLD', '0.5'))
+BITRIX_BREAKER_OPEN_SECONDS = float(os.getenv('BITRIX_BREAKER_OPEN_SECONDS', '30'))
+BITRIX_BREAKER_PROBE_TIMEOUT_SECONDS = float(os.getenv('BITRIX_BREAKER_PROBE_TIMEOUT_SECONDS', '60'))
+
+# --- Integração Bitrix (Webhooks bufferizados, process_bitrix_webhooks) ---
+# Rajadas da mesma entidade são processadas uma vez após X segundos de silêncio;
+# um evento até Y segundos de uma escrita nossa na mesma entidade é tratado como eco (um por escrita).
+BITRIX_WEBHOOK_COALESCE_SECONDS = float(os.getenv('BITRIX_WEBHOOK_COALESCE_SECONDS', '5'))
+BITRIX_WEBHOOK_ECHO_SECONDS = float(os.getenv('BITRIX_WEBHOOK_ECHO_SECONDS', '30'))
+
+# Validade do tipo persistido do id_bitrix (Contato/Lead); vencido = refaz os probes antes de escrever
+BITRIX_ENTITY_STATE_TTL_HOURS = float(os.getenv('BITRIX_ENTITY_STATE_TTL_HOURS', '720'))
+
+# Espelho local dos Deals (BitrixDeal/BitrixDealRow): linha sem confirmação do Bitrix há mais que isso
+# é servida como 'stale' e a leitura agenda uma sincronização (job 'sync_deal_mirror' do outbox)
+BITRIX_DEAL_MIRROR_MAX_AGE_MINUTES = int(os.getenv('BITRIX_DEAL_MIRROR_MAX_AGE_MINUTES', '60'))
+
+# Reconciliação incremental (bitrix_delta_sync): janela relida antes do high-water a cada execução
+BITRIX_DELTA_SYNC_OVERLAP_SECONDS = int(os.getenv('BITRIX_DELTA_SYNC_OVERLAP_SECONDS', '300'))
+
+# --- Cache em dois níveis (config/cache.py) ---
+# L1 = LRU por processo (CACHE_L1_*); L2 = Redis compartilhado por workers e crons (CACHE_REDIS_URL).
+# Sem CACHE_REDIS_URL o L2 é um LocMem do processo (dev/testes). CACHE_VERSION novo descarta todas as chaves.
+CACHE_REDIS_URL = os.getenv('CACHE_REDIS_URL', '')
+# Serialização dos valores no Redis (config/cache_serializers.py): msgpack | orjson | pickle; compressão
+# lz4 | zlib | none acima de CACHE_COMPRESS_MIN_BYTES. Trocar não exige CACHE_VERSION novo (cada valor leva o seu cabeçalho).
+CACHE_SERIALIZER = 'config.cache_serializers.CacheSerializer'
+CACHE_SERIALIZER_CODEC = os.getenv('CACHE_SERIALIZER_CODEC', 'msgpack')
+CACHE_COMPRESSION = os.getenv('CACHE_COMPRESSION', 'lz4')
+CACHE_COMPRESS_MIN_BYTES = int(os.getenv('CACHE_COMPRESS_MIN_BYTES', '1024'))
+CACHES = {
+    'default': {
+        'BACKEND': 'config.cache.TieredCache',
+        'KEY_PREFIX': 'pmed',
+        'VERSION': int(os.getenv('CACHE_VERSION', '1')),
+        'OPTIONS': {
+            'SHARED': 'shared',
+            'L1_MAX_ENTRIES': int(os.getenv('CACHE_L1_MAX_ENTRIES', '1000')),
+            'L1_TIMEOUT': float(os.getenv('CACHE_L1_TIMEOUT', '5')),
+            'TAG_VERSION_TTL': float(os.getenv('CACHE_TAG_VERSION_TTL', '1')),
+        },
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': CACHE_REDIS_URL,
+        'KEY_PREFIX': 'pmed',
+        'OPTIONS': {'serializer': CACHE_SERIALIZER},
+    } if CACHE_REDIS_URL else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'shared',
+        'KEY_PREFIX': 'pmed',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+
+# --- Autenticação JWT pelas claims (apps/accounts/authentication.py) ---
+# Versão das claims por usuário no cache; cada worker confia na que leu por até CACHE_L1_TIMEOUT segundos.
+AUTH_VERSION_CACHE_SECONDS = int(os.getenv('AUTH_VERSION_CACHE_SECONDS', '3600'))
+
+# --- Singleflight nos misses de cache caros (apps/accounts/cache_utils.py) ---
+# Lock do recálculo, espera máxima dos concorrentes e retenção do valor anterior (<key>:prev)
+SINGLEFLIGHT_LOCK_SECONDS = int(os.getenv('SINGLEFLIGHT_LOCK_SECONDS', '30'))
+SINGLEFLIGHT_WAIT_SECONDS = float(os.getenv('SINGLEFLIGHT_WAIT_SECONDS', '2'))
+SINGLEFLIGHT_POLL_SECONDS = float(os.getenv('SINGLEFLIGHT_POLL_SECONDS', '0.05'))
+SINGLEFLIGHT_PREV_SECONDS = int(os.getenv('SINGLEFLIGHT_PREV_SECONDS', '3600'))
+
+# --- Proxy de imagens dos produtos (apps/store/images.py) ---
+# Cache em disco endereçado por conteúdo (padrão: media/product_images) e variantes redimensionadas/WebP
+PRODUCT_IMAGE_CACHE_DIR = os.getenv('PRODUCT_IMAGE_CACHE_DIR', '')
+PRODUCT_IMAGE_WIDTHS = tuple(int(w) for w in os.getenv('PRODUCT_IMAGE_WIDTHS', '160,320,640,1280').split(','))
+PRODUCT_IMAGE_DEFAULT_FORMAT = os.getenv('PRODUCT_IMAGE_DEFAULT_FORMAT', 'webp')
+PRODUCT_IMAGE_QUALITY = int(os.getenv('PRODUCT_IMAGE_QUALITY', '80'))
+PRODUCT_IMAGE_MAX_BYTES = int(os.getenv('PRODUCT_IMAGE_MAX_BYTES', str(10 * 1024 * 1024)))
+PRODUCT_IMAGE_MAX_AGE = int(os.getenv('PRODUCT_IMAGE_MAX_AGE', '3600'))
+PRODUCT_IMAGE_MISSING_SECONDS = int(os.getenv('PRODUCT_IMAGE_MISSING_SECONDS', '600'))
+
+# --- Métricas das chamadas ao Bitrix/Asaas (GET /metrics, apps/accounts/metrics.py) ---
+# METRICS_DIR: diretório compartilhado onde cada processo (gunicorn, crons, workers) grava seu snapshot;
+# vazio = só o processo que atende o /metrics. METRICS_TOKEN vazio = endpoint aberto (restringir no nginx).
+METRICS_DIR = os.getenv('METRICS_DIR', '')
+METRICS_FLUSH_SECONDS = int(os.getenv('METRICS_FLUSH_SECONDS', '15'))
+METRICS_RETENTION_SECONDS = int(os.getenv('METRICS_RETENTION_SECONDS', str(7 * 24 * 3600)))
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+# --- Perfil materializado (UserProfileSnapshot, apps/accounts/profile_snapshot.py) ---
+# Linha sem reconstrução há mais que isso (ou marcada 'stale') agenda a releitura do Deal e do Contato no Bitrix
+PROFILE_SNAPSHOT_MAX_AGE_SECONDS = int(os.getenv('PROFILE_SNAPSHOT_MAX_AGE_SECONDS', '3600'))
+
+# --- Refresh pós-login (apps/accounts/warmup.py) ---
+# Sincroniza plano, reconstrói o perfil e pré-aquece o protocolo em threads do worker, fora do request de login
+SESSION_WARMUP_ENABLED = os.getenv('SESSION_WARMUP_ENABLED', 'True') == 'True'
+SESSION_WARMUP_THREADS = int(os.getenv('SESSION_WARMUP_THREADS', '2'))
+SESSION_WARMUP_DEDUPE_SECONDS = int(os.getenv('SESSION_WARMUP_DEDUPE_SECONDS', '60'))
+
 CSRF_TRUSTED_ORIGINS = [
     'http://localhost:8080',
     'http://127.0.0.1:8080',
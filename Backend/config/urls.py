@@ -19,6 +19,7 @@ from django.urls import path, include
 from django.conf import settings
 from django.http import JsonResponse
 from django.conf.urls.static import static
+from apps.accounts.views import MetricsView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -26,6 +27,7 @@ urlpatterns = [
     path('api/store/', include('apps.store.urls')),
     path('api/financial/', include('apps.financial.urls')),
     path('api/medical/', include('apps.medical.urls')),
+    path('metrics', MetricsView.as_view(), name='metrics'),
     path('', lambda request: JsonResponse({"status": "online", "project": "ProtocoloMedRoot", "version": "v2.0"})),
 ]
 if settings.DEBUG:
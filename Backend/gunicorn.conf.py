@@ -0,0 +1,19 @@
+# Backend/gunicorn.conf.py
+# Carregado automaticamente pelo gunicorn (arquivo ./gunicorn.conf.py no WORKDIR).
+# Bind/workers continuam definidos no docker-compose.
+
+import logging
+
+logger = logging.getLogger("gunicorn.error")
+
+
+def post_worker_init(worker):
+    """
+    Aquece o pool keep-alive do Bitrix assim que o worker carrega o Django,
+    antes de aceitar a primeira requisição.
+    """
+    try:
+        from apps.accounts.services import BitrixService
+        BitrixService.warm_up_connections()
+    except Exception as e:
+        logger.warning(f"⚠️ Warm-up do Bitrix ignorado no worker {worker.pid}: {e}")
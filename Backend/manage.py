@@ -14,6 +14,9 @@ def main():
         pass
 
     os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+    # Origem das chamadas ao Bitrix/Asaas nas métricas (apps/accounts/metrics.py)
+    if len(sys.argv) > 1:
+        os.environ.setdefault('OUTBOUND_CALLER', f"command:{sys.argv[1]}")
     try:
         from django.core.management import execute_from_command_line
     except ImportError as exc: